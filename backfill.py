@@ -0,0 +1,181 @@
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, List, NamedTuple
+
+from common import spawn_context
+
+
+class EpochResult(NamedTuple):
+    """
+    Outcome of processing one epoch of a backfill
+    """
+    epoch: datetime
+    ok: bool
+    stations: int = 0
+    error: str = ''
+    elapsed: float = 0.0
+
+
+def epochs_range(date_from: datetime, date_to: datetime, step_days: int = 7) -> list:
+    """
+    Epochs from date_from to date_to inclusive
+
+    Parameters
+    ----------
+    date_from : datetime
+        First epoch
+    date_to : datetime
+        Last epoch (included if it falls on the step)
+    step_days : int
+        Distance between epochs in days, 7 for one epoch per GPS week
+
+    Returns
+    -------
+    list
+        Epochs in chronological order
+    """
+    result = list()
+    day = date_from
+    while day <= date_to:
+        result.append(day)
+        day += timedelta(days=step_days)
+    return result
+
+
+def run(epochs: Iterable[datetime], fetch: Callable, process: Callable, write: Callable,
+        download_workers: int = 4, parse_workers: int = None, max_in_flight: int = None,
+        state_file: str = None) -> List[EpochResult]:
+    """
+    Processing many epochs with a bounded download -> parse -> write pipeline
+
+    fetch runs in a thread pool, process in a process pool and write in the calling thread only,
+    in chronological order, so later epochs overwrite earlier ones as a sequential run would.
+    A failure of any stage only fails its own epoch.
+    With state_file an interrupted or partly failed backfill is resumed: the file keeps the last epoch
+    up to which every epoch has been written, a run of the same epochs skips them. The epochs after
+    a failed one are written again, so the older epoch is never written after the newer ones.
+
+    Parameters
+    ----------
+    epochs : iterable of datetime
+        Epochs in chronological order
+    fetch : callable
+        fetch(epoch) -> tuple of arguments for process, I/O bound (FTP listing, download)
+    process : callable
+        process(*fetched) -> data for write, CPU bound, must be picklable (a module-level function)
+    write : callable
+        write(epoch, data) -> number of stations written
+    download_workers : int
+        Number of threads for fetch
+    parse_workers : int, optional
+        Number of processes for process, os.cpu_count() by default
+    max_in_flight : int, optional
+        Maximum number of epochs fetched or processed but not written yet,
+        2 * (download_workers + parse_workers) by default
+    state_file : str, optional
+        JSON file keeping the progress between runs
+
+    Returns
+    -------
+    list
+        EpochResult for each epoch processed (not skipped) in chronological order
+    """
+    epochs = list(epochs)
+    first_epoch = epochs[0] if epochs else None
+    written_through = load_progress(state_file, first_epoch)
+    if written_through is not None:
+        skipped = sum(epoch <= written_through for epoch in epochs)
+        epochs = epochs[skipped:]
+        print(f"Resuming after {written_through:%Y-%m-%d}: {skipped} epochs already written")
+    parse_workers = parse_workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * (download_workers + parse_workers)
+    results = list()
+    started = dict()
+    fetching = dict()
+    processing = dict()
+    finished = dict()
+    next_submit = 0
+    prefix_written = True
+    run_start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=download_workers) as threads, \
+            ProcessPoolExecutor(max_workers=parse_workers, mp_context=spawn_context()) as processes:
+        while len(results) < len(epochs):
+            while next_submit < len(epochs) and next_submit - len(results) < max_in_flight:
+                epoch = epochs[next_submit]
+                started[epoch] = time.perf_counter()
+                fetching[threads.submit(fetch, epoch)] = epoch
+                next_submit += 1
+
+            if fetching or processing:
+                done, _ = wait(list(fetching) + list(processing), return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in fetching:
+                        epoch = fetching.pop(future)
+                        if future.exception() is not None:
+                            finished[epoch] = future.exception()
+                        else:
+                            processing[processes.submit(process, *future.result())] = epoch
+                    else:
+                        epoch = processing.pop(future)
+                        finished[epoch] = future.exception() or (None, future.result())
+
+            while len(results) < len(epochs) and epochs[len(results)] in finished:
+                epoch = epochs[len(results)]
+                outcome = finished.pop(epoch)
+                if isinstance(outcome, BaseException):
+                    result = EpochResult(epoch, False, error=repr(outcome),
+                                         elapsed=time.perf_counter() - started[epoch])
+                else:
+                    try:
+                        count = write(epoch, outcome[1])
+                        result = EpochResult(epoch, True, stations=count,
+                                             elapsed=time.perf_counter() - started[epoch])
+                    except Exception as ex:
+                        result = EpochResult(epoch, False, error=repr(ex),
+                                             elapsed=time.perf_counter() - started[epoch])
+                results.append(result)
+                # The progress stops at the first failed epoch
+                prefix_written = prefix_written and result.ok
+                if prefix_written:
+                    save_progress(state_file, first_epoch, epoch)
+                report_progress(result, len(results), len(epochs), time.perf_counter() - run_start)
+    return results
+
+
+def load_progress(state_file: str, first_epoch: datetime):
+    """
+    Last epoch written without a failure before it by an earlier run starting at first_epoch, None if none
+    """
+    if state_file is None or first_epoch is None:
+        return None
+    try:
+        with open(state_file, 'r') as f:
+            state = json.load(f)
+        if datetime.fromisoformat(state['first']) != first_epoch:
+            print(f"The progress in {state_file} is of a backfill from {state['first']}, starting over")
+            return None
+        return datetime.fromisoformat(state['written_through'])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_progress(state_file: str, first_epoch: datetime, written_through: datetime) -> None:
+    if state_file is None:
+        return
+    directory = os.path.dirname(os.path.abspath(state_file))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp.')
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'first': first_epoch.isoformat(), 'written_through': written_through.isoformat()}, f)
+    os.replace(tmp_path, state_file)
+
+
+def report_progress(result: EpochResult, done: int, total: int, elapsed: float) -> None:
+    status = f"{result.stations} stations" if result.ok else f"FAILED: {result.error}"
+    eta = elapsed / done * (total - done)
+    print(f"[{done}/{total}] {result.epoch:%Y-%m-%d} {status} ({result.elapsed:.1f} s), "
+          f"elapsed {elapsed:.0f} s, remaining ~{eta:.0f} s")
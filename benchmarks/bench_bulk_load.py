@@ -0,0 +1,93 @@
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import mysql.connector
+
+import request_handler
+import stations_handler
+from station_batch import StationBatch
+from benchmarks import synthetic
+
+EPOCH = datetime(2022, 1, 1, 12)
+# Enough of station_tb for the statements of RequestHandler, the real table has more constraints
+STATION_TB_SCHEMA = """CREATE TABLE IF NOT EXISTS odtssw_paf.station_tb (
+    id INT AUTO_INCREMENT PRIMARY KEY, station_id VARCHAR(9) NOT NULL, user_id INT, station_config_id INT,
+    latitude DOUBLE, longitude DOUBLE, download INT, masterClockPriority INT, dataRate INT,
+    daily_download_site_id INT, backup_download_site_id INT, rinexFileRate VARCHAR(16), x DOUBLE, y DOUBLE,
+    z DOUBLE, vx DOUBLE, vy DOUBLE, vz DOUBLE, date DATETIME, available INT, precise INT, forceC1 INT,
+    public INT, satelliteSystem VARCHAR(8), oceanLoadingData VARCHAR(255), AntDome VARCHAR(8),
+    AntType VARCHAR(32), OffsetNorth DOUBLE, OffsetEast DOUBLE, OffsetUp DOUBLE, validFrom DATETIME,
+    validUntil DATETIME, product VARCHAR(32), KEY station_id (station_id))"""
+
+
+def timed(connection, batch, bulk_load_threshold) -> tuple:
+    handler = request_handler.RequestHandler(connection, bulk_load_threshold=bulk_load_threshold)
+    try:
+        start = time.perf_counter()
+        result = handler.upsert_station_data(batch)
+        return time.perf_counter() - start, result
+    finally:
+        handler.close()
+
+
+def wipe(connection) -> None:
+    cursor = connection.cursor()
+    cursor.execute("DELETE FROM odtssw_paf.station_tb;")
+    connection.commit()
+    cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the batched INSERT/UPDATE and LOAD DATA writers of '
+                                                 'station_tb on a local MySQL server. The odtssw_paf.station_tb '
+                                                 'table of the server is emptied!')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3306)
+    parser.add_argument('--user', default='root')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 20000], help="numbers of stations")
+    parser.add_argument('--repeat', type=int, default=3, help="number of runs, the best one is reported")
+    parser.add_argument('--wipe', action='store_true', help="allow emptying a station_tb that holds records")
+    args = parser.parse_args()
+
+    # local_infile must also be enabled on the server: SET GLOBAL local_infile = 1
+    connection = mysql.connector.connect(host=args.host, port=args.port, user=args.user, password=args.password,
+                                         use_pure=True, allow_local_infile=True)
+    cursor = connection.cursor()
+    cursor.execute("CREATE DATABASE IF NOT EXISTS odtssw_paf;")
+    cursor.execute(STATION_TB_SCHEMA)
+    cursor.execute("SELECT COUNT(*) FROM odtssw_paf.station_tb;")
+    if cursor.fetchall()[0][0] and not args.wipe:
+        raise SystemExit("odtssw_paf.station_tb is not empty, run with --wipe to empty it")
+    cursor.close()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in args.sizes:
+            file = synthetic.write_sinex(os.path.join(tmp_dir, f"{size}.snx"), size)
+            stations = frozenset(synthetic.station_name(i).lower() for i in range(size))
+            batch = stations_handler.process_product(file, stations, EPOCH)
+            moved = StationBatch(batch.names, batch.epochs, batch.xyz + 0.01, batch.blh)
+            print(f"{size} stations")
+            for name, threshold in (('batched INSERT/UPDATE', None), ('LOAD DATA LOCAL INFILE', 1)):
+                best_insert = best_update = None
+                for _ in range(args.repeat):
+                    wipe(connection)
+                    elapsed, result = timed(connection, batch, threshold)
+                    if result.inserted != size:
+                        raise RuntimeError(f"{name}: {result}")
+                    best_insert = elapsed if best_insert is None else min(best_insert, elapsed)
+                    elapsed, result = timed(connection, moved, threshold)
+                    if result.updated != size:
+                        raise RuntimeError(f"{name}: {result}")
+                    best_update = elapsed if best_update is None else min(best_update, elapsed)
+                print(f"  {name:24s} insert {best_insert * 1e3:9.1f} ms ({size / best_insert:9.0f} rows/s)  "
+                      f"update {best_update * 1e3:9.1f} ms ({size / best_update:9.0f} rows/s)")
+    wipe(connection)
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
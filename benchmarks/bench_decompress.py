@@ -0,0 +1,60 @@
+import argparse
+import os
+import shutil
+import tempfile
+
+import decompress
+import sinex
+from benchmarks import synthetic
+from benchmarks.bench_sinex import best_of
+
+
+def gunzip_and_read(file: str, work_dir: str) -> dict:
+    """
+    The previous path: gunzip -f into a file, read it back and remove it
+    """
+    work_file = os.path.join(work_dir, 'work_' + os.path.basename(file))
+    shutil.copyfile(file, work_file)
+    if os.system(f'gunzip -f "{work_file}"') != 0:
+        raise RuntimeError("gunzip failed")
+    result = {e.name: (e.x, e.y, e.z) for e in sinex.read_file(work_file[:-2])}
+    os.remove(work_file[:-2])
+    return result
+
+
+def stream(file: str) -> dict:
+    return {e.name: (e.x, e.y, e.z) for e in sinex.read_estimates(decompress.iter_file(file))}
+
+
+def decompress_all(file: str) -> int:
+    return sum(len(chunk) for chunk in decompress.iter_file(file))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the in-process .Z decompression')
+    parser.add_argument('--stations', type=int, default=5000, help="number of stations in the synthetic file")
+    parser.add_argument('--matrix-rows', type=int, default=50000, dest='matrix_rows',
+                        help="lines of the covariance block after the estimates")
+    parser.add_argument('--repeat', type=int, default=3, help="number of runs, the best one is reported")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        text = synthetic.generate_sinex(args.stations, matrix_rows=args.matrix_rows).encode('ascii')
+        file = os.path.join(tmp_dir, 'bench.snx.Z')
+        with open(file, 'wb') as f:
+            f.write(synthetic.compress_z(text))
+        print(f"{args.stations} stations, {len(text)} bytes, {os.path.getsize(file)} bytes compressed, "
+              f"NumPy {'on' if decompress.np is not None else 'off'}")
+
+        gunzip_time, expected = best_of(args.repeat, gunzip_and_read, file, tmp_dir)
+        stream_time, result = best_of(args.repeat, stream, file)
+        full_time, size = best_of(args.repeat, decompress_all, file)
+        if result != expected or size != len(text):
+            raise RuntimeError("The decompression returned different results")
+        print(f"gunzip + read + remove:      {gunzip_time * 1e3:8.1f} ms")
+        print(f"streaming decompress + parse: {stream_time * 1e3:7.1f} ms (stops after the estimates)")
+        print(f"streaming decompress, whole:  {full_time * 1e3:7.1f} ms ({size / full_time / 1e6:.1f} MB/s)")
+
+
+if __name__ == '__main__':
+    main()
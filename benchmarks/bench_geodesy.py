@@ -0,0 +1,67 @@
+import argparse
+import time
+
+import numpy as np
+
+import geodesy
+from stations_handler import ecef2blh as scalar_ecef2blh
+
+
+def random_points(count: int, seed: int = 0) -> np.ndarray:
+    """
+    Random geocentric points between -100 m and 10 km above the ellipsoid
+    """
+    rnd = np.random.default_rng(seed)
+    blh = np.column_stack((np.degrees(np.arcsin(rnd.uniform(-1.0, 1.0, count))),
+                           rnd.uniform(-180.0, 180.0, count),
+                           rnd.uniform(-100.0, 10000.0, count)))
+    return geodesy.blh2ecef(blh)
+
+
+def check_accuracy(xyz: np.ndarray) -> None:
+    """
+    Comparing the batch conversion with the scalar one and the round trip, in millimeters
+    """
+    scalar = np.array([scalar_ecef2blh(x, y, z) for x, y, z in xyz.tolist()])
+    for method in (geodesy.BOWRING, geodesy.ITERATIVE):
+        blh = geodesy.ecef2blh(xyz, method)
+        lat_err = np.max(np.abs(np.radians(blh[:, 0] - scalar[:, 0]))) * geodesy.A * 1e3
+        lon_err = np.max(np.abs(np.radians(blh[:, 1] - scalar[:, 1]))) * geodesy.A * 1e3
+        h_err = np.max(np.abs(blh[:, 2] - scalar[:, 2])) * 1e3
+        trip_err = np.max(np.abs(geodesy.blh2ecef(blh) - xyz)) * 1e3
+        print(f"{method:>9s} vs scalar: lat {lat_err:.2e} mm, lon {lon_err:.2e} mm, h {h_err:.2e} mm, "
+              f"round trip {trip_err:.2e} mm")
+
+
+def throughput(func, *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput of the batch geodesy conversions')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10 ** 3, 10 ** 5, 10 ** 7],
+                        help="numbers of points")
+    parser.add_argument('--scalar-limit', type=int, default=10 ** 5, dest='scalar_limit',
+                        help="largest size measured with the scalar function")
+    args = parser.parse_args()
+
+    check_accuracy(random_points(10 ** 4, seed=1))
+    for size in args.sizes:
+        xyz = random_points(size)
+        line = f"{size:>9d} points:"
+        if size <= args.scalar_limit:
+            points = xyz.tolist()
+            elapsed = throughput(lambda: [scalar_ecef2blh(x, y, z) for x, y, z in points])
+            line += f" scalar {size / elapsed:12.0f} pts/s"
+        for name, func, data in (('bowring', geodesy.ecef2blh, xyz),
+                                 ('iterative', lambda v: geodesy.ecef2blh(v, geodesy.ITERATIVE), xyz),
+                                 ('blh2ecef', geodesy.blh2ecef, xyz)):
+            elapsed = throughput(func, data)
+            line += f" {name} {size / elapsed:12.0f} pts/s"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import argparse
+import os
+import re
+import tempfile
+import time
+
+import sinex
+from benchmarks import synthetic
+
+
+def legacy_parse(file: str, stations: list) -> dict:
+    """
+    The regex-based parse() of stations_handler before the streaming SINEX reader
+    """
+    result = dict()
+    in_solution_estimate_section = False
+    with open(file, 'r') as f:
+        start_solution_estimate_pattern = re.compile(r'^\+SOLUTION/ESTIMATE.*')
+        end_solution_estimate_pattern = re.compile(r'^\-SOLUTION\/ESTIMATE.*')
+        station_coordinate_pattern = re.compile(
+            r'^\s+\d+\s+STA(\w)\s+(\w+)\s+(\w).*\d+\s+(-?[\d+]?\.\d+[Ee][+-]?\d+)\s+(-?[\d+]?\.\d+[Ee][+-]?\d+)$')
+        for line in f:
+            if start_solution_estimate_pattern.findall(line):
+                in_solution_estimate_section = True
+                continue
+            elif end_solution_estimate_pattern.findall(line):
+                break
+            if in_solution_estimate_section:
+                match = station_coordinate_pattern.findall(line)
+                if match and stations.count(match[0][1].lower()):
+                    xyz = result.setdefault(match[0][1].lower(), [0.0, 0.0, 0.0])
+                    xyz['XYZ'.index(match[0][0])] = float(match[0][3])
+    return result
+
+
+def best_of(repeat: int, func, *args) -> tuple:
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the SINEX parsers')
+    parser.add_argument('--stations', type=int, default=5000, help="number of stations in the synthetic file")
+    parser.add_argument('--selected', type=int, default=500, help="number of stations in the filter")
+    parser.add_argument('--repeat', type=int, default=3, help="number of runs, the best one is reported")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = synthetic.write_sinex(os.path.join(tmp_dir, 'bench.snx'), args.stations)
+        selected = [synthetic.station_name(i).lower() for i in range(0, args.stations, args.stations // args.selected)]
+
+        legacy_time, legacy = best_of(args.repeat, legacy_parse, file, selected)
+        new_time, new = best_of(args.repeat, lambda: {e.name: [e.x, e.y, e.z]
+                                                      for e in sinex.read_file(file, frozenset(selected))})
+        if legacy != new:
+            raise RuntimeError("The parsers returned different results")
+        print(f"{args.stations} stations, {len(selected)} selected, {os.path.getsize(file)} bytes")
+        print(f"legacy parse(): {legacy_time * 1e3:9.1f} ms")
+        print(f"sinex.read_file(): {new_time * 1e3:6.1f} ms  ({legacy_time / new_time:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+import datetime
+import re
+import time
+
+from request_handler import STATION_STAGING_TB, STATION_TB_DATETIME_FORMAT, STATION_TB_INSERT_COLUMNS, \
+    STATION_TB_SNAPSHOT_COLUMNS, STATION_TB_UPDATE_COLUMNS
+
+STATION_TB = 'odtssw_paf.station_tb'
+
+
+class FakeCursor:
+    """
+    Cursor of a FakeConnection, every execute is one round-trip
+    """
+
+    def __init__(self, connection: 'FakeConnection'):
+        self.connection = connection
+        self.rows = list()
+        self.rowcount = -1
+        self.column_names = ()
+
+    def execute(self, query: str, params=()) -> None:
+        self.connection.round_trip(query)
+        self.rows, self.rowcount = self.connection.apply(query, tuple(params or ()))
+        match = re.match(r'SELECT (.*?) FROM', query)
+        self.column_names = tuple(name.strip() for name in match.group(1).split(',')) if match else ()
+
+    def executemany(self, query: str, rows) -> None:
+        # mysql-connector sends a prepared statement once per row
+        for params in rows:
+            self.execute(query, params)
+
+    def fetchall(self) -> list:
+        rows, self.rows = self.rows, list()
+        return rows
+
+    def fetchmany(self, size: int) -> list:
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def close(self) -> None:
+        pass
+
+
+class FakeConnection:
+    """
+    In-memory stand-in for a MySQL connection counting the round-trips
+
+    Keeps station_tb as a dictionary and understands the statements of RequestHandler that touch it
+    (the snapshot and existence SELECTs, the multi-row INSERT, the CASE UPDATE and the LOAD DATA
+    staging table of bulk_load_station_data), every other statement succeeds without rows.
+    Each round-trip can be delayed by latency seconds to model the network between the script and the server.
+
+    Attributes
+    ----------
+    latency : float
+        Delay of every round-trip in seconds
+    round_trips : int
+        Number of statements, commits and rollbacks sent
+    statements : dict
+        Number of round-trips by the first word of the statement
+    station_tb : dict
+        (x, y, z, vx, vy, vz, date, product) by station_id
+    staging : dict
+        Rows of the staging table by station_id
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.round_trips = 0
+        self.statements = dict()
+        self.station_tb = dict()
+        self.staging = dict()
+
+    def cursor(self, prepared: bool = False, buffered: bool = None) -> FakeCursor:
+        return FakeCursor(self)
+
+    def commit(self) -> None:
+        self.round_trip('COMMIT')
+
+    def rollback(self) -> None:
+        self.round_trip('ROLLBACK')
+
+    def reset_counters(self) -> None:
+        self.round_trips = 0
+        self.statements = dict()
+
+    def round_trip(self, query: str) -> None:
+        self.round_trips += 1
+        kind = query.split(None, 1)[0].upper()
+        self.statements[kind] = self.statements.get(kind, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def apply(self, query: str, params: tuple) -> tuple:
+        """
+        Running a statement, returns the selected rows and the number of affected rows
+        """
+        if STATION_STAGING_TB in query:
+            return list(), self.__apply_staging(query)
+        if STATION_TB not in query:
+            return list(), 0
+        if query.startswith(f"SELECT {', '.join(STATION_TB_SNAPSHOT_COLUMNS)}"):
+            return [(station_id, *self.station_tb[station_id]) for station_id in params
+                    if station_id in self.station_tb], -1
+        if query.startswith('SELECT DISTINCT station_id'):
+            return [(station_id,) for station_id in params if station_id in self.station_tb], -1
+        if query.startswith('INSERT'):
+            width = len(STATION_TB_INSERT_COLUMNS)
+            for start in range(0, len(params), width):
+                row = dict(zip(STATION_TB_INSERT_COLUMNS, params[start:start + width]))
+                self.station_tb[row['station_id']] = _record(row)
+        elif query.startswith('UPDATE'):
+            # (station_id, value) pairs column after column, then the station_ids of the WHERE clause
+            count = len(params) // (2 * len(STATION_TB_UPDATE_COLUMNS) + 1)
+            station_ids = params[-count:]
+            values = {station_id: dict() for station_id in station_ids}
+            position = 0
+            for column in STATION_TB_UPDATE_COLUMNS:
+                for _ in range(count):
+                    values[params[position]][column] = params[position + 1]
+                    position += 2
+            for station_id, row in values.items():
+                if station_id in self.station_tb:
+                    self.station_tb[station_id] = _record(row)
+        return list(), -1
+
+    def __apply_staging(self, query: str) -> int:
+        if query.startswith('DELETE'):
+            count = len(self.staging)
+            self.staging = dict()
+            return count
+        if query.startswith('LOAD DATA'):
+            path = re.search(r"INFILE '((?:[^'\\]|\\.)*)'", query).group(1)
+            path = re.sub(r"\\(.)", r"\1", path)
+            with open(path, 'r') as f:
+                for line in f:
+                    row = dict(zip(STATION_TB_INSERT_COLUMNS, line.rstrip('\n').split('\t')))
+                    self.staging[row['station_id']] = _record(row)
+            return len(self.staging)
+        if query.startswith('UPDATE'):
+            matched = self.staging.keys() & self.station_tb.keys()
+            self.station_tb.update((station_id, self.staging[station_id]) for station_id in matched)
+            return len(matched)
+        if query.startswith('INSERT'):
+            new = self.staging.keys() - self.station_tb.keys()
+            self.station_tb.update((station_id, self.staging[station_id]) for station_id in new)
+            return len(new)
+        return 0
+
+
+def _date(value: str) -> datetime.datetime:
+    return datetime.datetime.strptime(value, STATION_TB_DATETIME_FORMAT)
+
+
+def _record(row: dict) -> tuple:
+    # Values of the statements or text fields of the LOAD DATA file
+    return (float(row['x']), float(row['y']), float(row['z']), float(row['vx']), float(row['vy']), float(row['vz']),
+            _date(row['date']), row['product'])
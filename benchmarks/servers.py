@@ -0,0 +1,152 @@
+import ftplib
+import functools
+import os
+import socket
+import socketserver
+import threading
+from contextlib import contextmanager
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+LOCALHOST = '127.0.0.1'
+
+
+class QuietHTTPRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Static file handler without the request log
+    """
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+@contextmanager
+def http_server(directory: str):
+    """
+    Serving a directory over HTTP on a free local port
+
+    Parameters
+    ----------
+    directory : str
+        Directory with the files to serve
+
+    Returns
+    -------
+    str
+        Base URL of the server, e.g. http://127.0.0.1:12345
+    """
+    handler = functools.partial(QuietHTTPRequestHandler, directory=directory)
+    with ThreadingHTTPServer((LOCALHOST, 0), handler) as server:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            yield f"http://{LOCALHOST}:{server.server_address[1]}"
+        finally:
+            server.shutdown()
+            thread.join()
+
+
+class FTPHandler(socketserver.StreamRequestHandler):
+    """
+    A minimal read-only FTP server: login, PASV, NLST, MLSD, NOOP and QUIT
+
+    Any user name and password are accepted, paths are relative to server.directory.
+    """
+
+    def handle(self) -> None:
+        self.passive = None
+        self.reply('220 Benchmark FTP server')
+        while True:
+            line = self.rfile.readline().decode('ascii', 'replace').strip()
+            if not line:
+                break
+            command, _, argument = line.partition(' ')
+            command = command.upper()
+            if command == 'USER':
+                self.reply('331 Password required')
+            elif command == 'PASS':
+                self.reply('230 Logged in')
+            elif command in ('TYPE', 'NOOP'):
+                self.reply('200 OK')
+            elif command == 'PASV':
+                self.open_passive()
+            elif command in ('NLST', 'MLSD'):
+                self.send_listing(command, argument)
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                break
+            else:
+                self.reply('502 Command not implemented')
+        if self.passive is not None:
+            self.passive.close()
+
+    def reply(self, text: str) -> None:
+        self.wfile.write(text.encode('ascii') + b'\r\n')
+
+    def open_passive(self) -> None:
+        if self.passive is not None:
+            self.passive.close()
+        self.passive = socket.socket()
+        self.passive.bind((LOCALHOST, 0))
+        self.passive.listen(1)
+        port = self.passive.getsockname()[1]
+        self.reply(f"227 Entering Passive Mode ({LOCALHOST.replace('.', ',')},{port >> 8},{port & 0xff})")
+
+    def send_listing(self, command: str, argument: str) -> None:
+        path = os.path.join(self.server.directory, argument.lstrip('/'))
+        if self.passive is None or not os.path.isdir(path):
+            self.reply('550 No such directory')
+            return
+        names = sorted(os.listdir(path))
+        if command == 'MLSD':
+            lines = [f"type={'dir' if os.path.isdir(os.path.join(path, name)) else 'file'}; {name}"
+                     for name in names]
+        else:
+            lines = [f"{argument.rstrip('/')}/{name}" for name in names]
+        self.reply('150 Listing')
+        data, _ = self.passive.accept()
+        with data:
+            data.sendall(''.join(line + '\r\n' for line in lines).encode('ascii'))
+        self.passive.close()
+        self.passive = None
+        self.reply('226 Done')
+
+
+class FTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, directory: str):
+        super().__init__((LOCALHOST, 0), FTPHandler)
+        self.directory = directory
+
+
+@contextmanager
+def ftp_server(directory: str):
+    """
+    Serving a directory over FTP on a free local port
+
+    Parameters
+    ----------
+    directory : str
+        Root directory of the server
+
+    Returns
+    -------
+    type
+        ftplib.FTP subclass connecting to the server, for StationDiscovery(ftp_class=...)
+    """
+    with FTPServer(directory) as server:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        port = server.server_address[1]
+
+        class LocalFTP(ftplib.FTP):
+            def __init__(self, host: str = LOCALHOST):
+                super().__init__()
+                self.connect(host, port)
+
+        try:
+            yield LocalFTP
+        finally:
+            server.shutdown()
+            thread.join()
@@ -0,0 +1,379 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import requests
+
+import downloader
+import ftp_discovery
+import request_handler
+import spatial_index
+import stations_handler
+from station_batch import StationBatch
+from benchmarks import synthetic
+from benchmarks.fakes import FakeConnection
+from benchmarks.servers import LOCALHOST, ftp_server, http_server
+
+SIZES = (100, 1000, 5000, 20000)
+EPOCH = datetime(2022, 1, 1, 12)
+DB_LATENCY = 0.0005  # seconds per round-trip, a server on the local network
+SPATIAL_QUERIES = 100  # random query points of each spatial case
+
+
+class Benchmark:
+    """
+    A fixture in the style of pytest-benchmark: benchmark(func, *args) runs func several times
+
+    Attributes
+    ----------
+    name : str
+        Name of the case with its parameter, e.g. bench_parse[1000]
+    group : str
+        Group of the case, e.g. parse
+    params : dict
+        Parameters of the case
+    rounds : int
+        Number of timed runs
+    times : list
+        Duration of every run in seconds
+    extra_info : dict
+        Values recorded by the case (throughput, round-trips...)
+    """
+
+    def __init__(self, name: str, group: str, params: dict, rounds: int):
+        self.name = name
+        self.group = group
+        self.params = params
+        self.rounds = rounds
+        self.times = list()
+        self.extra_info = dict()
+
+    def __call__(self, func, *args, **kwargs):
+        result = None
+        for _ in range(self.rounds):
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            self.times.append(time.perf_counter() - start)
+        return result
+
+    def pedantic(self, target, setup=None, rounds: int = None):
+        """
+        Running target(*args, **kwargs) with the arguments returned by setup, setup is not timed
+        """
+        result = None
+        for _ in range(rounds or self.rounds):
+            args, kwargs = setup() if setup is not None else ((), {})
+            start = time.perf_counter()
+            result = target(*args, **kwargs)
+            self.times.append(time.perf_counter() - start)
+        return result
+
+    @property
+    def best(self) -> float:
+        return min(self.times)
+
+    def as_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'group': self.group,
+            'params': self.params,
+            'stats': {
+                'min': min(self.times),
+                'max': max(self.times),
+                'mean': statistics.mean(self.times),
+                'median': statistics.median(self.times),
+                'stddev': statistics.stdev(self.times) if len(self.times) > 1 else 0.0,
+                'rounds': len(self.times),
+            },
+            'extra_info': self.extra_info,
+        }
+
+
+class Workload:
+    """
+    Synthetic inputs for one number of stations, written into a temporary directory
+
+    Attributes
+    ----------
+    size : int
+        Number of stations in the SINEX file and in the FTP listing
+    stations : frozenset
+        Station names (lower case)
+    sinex_file : str
+        Uncompressed SINEX file
+    compressed_file : str
+        The same file in the Unix compress (.Z) format
+    ftp_root : str
+        Root of the FTP server with the daily observation directory of EPOCH
+    """
+
+    def __init__(self, size: int, directory: str):
+        self.size = size
+        self.directory = directory
+        self.stations = frozenset(synthetic.station_name(i).lower() for i in range(size))
+        os.makedirs(directory)
+        self.sinex_file = synthetic.write_sinex(os.path.join(directory, 'product.snx'), size)
+        with open(self.sinex_file, 'rb') as f:
+            data = f.read()
+        self.compressed_file = self.sinex_file + '.Z'
+        with open(self.compressed_file, 'wb') as f:
+            f.write(synthetic.compress_z(data))
+        self.ftp_root = os.path.join(directory, 'ftp')
+        daily = os.path.join(self.ftp_root, ftp_discovery.DAILY_DIRECTORY.format(
+            year=EPOCH.year, doy=EPOCH.timetuple().tm_yday, yy=EPOCH.year % 100))
+        os.makedirs(daily)
+        for name in self.stations:
+            open(os.path.join(daily, f"{name}{EPOCH.timetuple().tm_yday:03d}0.{EPOCH.year % 100:02d}o"), 'w').close()
+
+    def batch(self):
+        return stations_handler.process_product(self.sinex_file, self.stations, EPOCH)
+
+
+def bench_parse(benchmark: Benchmark, workload: Workload) -> None:
+    result = benchmark(stations_handler.parse, workload.sinex_file, workload.stations, EPOCH)
+    benchmark.extra_info['stations'] = len(result)
+    benchmark.extra_info['stations_per_s'] = len(result) / benchmark.best
+    benchmark.extra_info['bytes_per_s'] = os.path.getsize(workload.sinex_file) / benchmark.best
+
+
+def bench_parse_compressed(benchmark: Benchmark, workload: Workload) -> None:
+    result = benchmark(stations_handler.parse, workload.compressed_file, workload.stations, EPOCH)
+    benchmark.extra_info['stations'] = len(result)
+    benchmark.extra_info['stations_per_s'] = len(result) / benchmark.best
+
+
+def bench_fill_geocentric_coordinates(benchmark: Benchmark, workload: Workload) -> None:
+    batch = stations_handler.parse(workload.sinex_file, workload.stations, EPOCH)
+    benchmark(stations_handler.fill_geocentric_coordinates, batch)
+    benchmark.extra_info['stations_per_s'] = len(batch) / benchmark.best
+
+
+def _upsert(connection: FakeConnection, batch, bulk_load_threshold: int = None) -> request_handler.UpsertResult:
+    handler = request_handler.RequestHandler(connection, bulk_load_threshold=bulk_load_threshold)
+    try:
+        return handler.upsert_changed_station_data(batch)
+    finally:
+        handler.close()
+
+
+def _db_case(benchmark: Benchmark, batch, prepare, bulk_load_threshold: int = None) -> None:
+    connections = list()
+
+    def setup():
+        connection = FakeConnection(DB_LATENCY)
+        prepare(connection)
+        connection.reset_counters()
+        connections.append(connection)
+        return (connection, batch, bulk_load_threshold), {}
+
+    result = benchmark.pedantic(_upsert, setup)
+    benchmark.extra_info.update(result._asdict())
+    benchmark.extra_info['round_trips'] = connections[-1].round_trips
+    benchmark.extra_info['round_trips_per_station'] = connections[-1].round_trips / len(batch)
+    benchmark.extra_info['statements'] = connections[-1].statements
+
+
+def bench_db_insert(benchmark: Benchmark, workload: Workload) -> None:
+    _db_case(benchmark, workload.batch(), lambda connection: None)
+
+
+def bench_db_update(benchmark: Benchmark, workload: Workload) -> None:
+    batch = workload.batch()
+    moved = StationBatch(batch.names, batch.epochs, batch.xyz + 0.01, batch.blh)
+    _db_case(benchmark, moved, lambda connection: _upsert(connection, batch))
+
+
+def bench_db_unchanged(benchmark: Benchmark, workload: Workload) -> None:
+    batch = workload.batch()
+    _db_case(benchmark, batch, lambda connection: _upsert(connection, batch))
+
+
+def bench_db_bulk_insert(benchmark: Benchmark, workload: Workload) -> None:
+    _db_case(benchmark, workload.batch(), lambda connection: None, bulk_load_threshold=1)
+
+
+def bench_db_bulk_update(benchmark: Benchmark, workload: Workload) -> None:
+    batch = workload.batch()
+    moved = StationBatch(batch.names, batch.epochs, batch.xyz + 0.01, batch.blh)
+    _db_case(benchmark, moved, lambda connection: _upsert(connection, batch), bulk_load_threshold=1)
+
+
+def _queries(count: int = SPATIAL_QUERIES) -> np.ndarray:
+    # Query points uniform on the sphere, the same ones for every run
+    rng = np.random.default_rng(0)
+    return np.column_stack((np.degrees(np.arcsin(rng.uniform(-1.0, 1.0, count))), rng.uniform(-180.0, 180.0, count)))
+
+
+def _spatial_case(benchmark: Benchmark, workload: Workload, query, brute_force) -> None:
+    """
+    Timing a set of queries on the index against the same queries answered by scanning every station
+    """
+    batch = workload.batch()
+    index = spatial_index.StationIndex(batch)
+    points = spatial_index.unit_vectors(batch.blh)
+    queries = _queries()
+    found = benchmark(lambda: sum(len(query(index, lat, lon)) for lat, lon in queries))
+    start = time.perf_counter()
+    expected = sum(len(brute_force(batch, points, lat, lon)) for lat, lon in queries)
+    brute_force_time = time.perf_counter() - start
+    if found != expected:
+        raise RuntimeError(f"{benchmark.name}: {found} stations found, {expected} expected")
+    benchmark.extra_info['stations_found'] = found
+    benchmark.extra_info['query_us'] = benchmark.best / len(queries) * 1e6
+    benchmark.extra_info['brute_force_query_us'] = brute_force_time / len(queries) * 1e6
+    benchmark.extra_info['speedup'] = brute_force_time / benchmark.best
+
+
+def _brute_force_within(points: np.ndarray, lat: float, lon: float, radius_km: float) -> np.ndarray:
+    query = spatial_index.unit_vectors([(lat, lon)])[0]
+    return np.nonzero(np.sum((points - query) ** 2, axis=1) <= spatial_index.chord(radius_km) ** 2)[0]
+
+
+def bench_spatial_build(benchmark: Benchmark, workload: Workload) -> None:
+    batch = workload.batch()
+    benchmark(spatial_index.StationIndex, batch)
+    benchmark.extra_info['stations_per_s'] = len(batch) / benchmark.best
+
+
+def bench_spatial_within(benchmark: Benchmark, workload: Workload) -> None:
+    _spatial_case(benchmark, workload, lambda index, lat, lon: index.within(lat, lon, 500.0),
+                  lambda batch, points, lat, lon: _brute_force_within(points, lat, lon, 500.0))
+
+
+def bench_spatial_nearest(benchmark: Benchmark, workload: Workload) -> None:
+    def brute_force(batch, points, lat, lon):
+        distance2 = np.sum((points - spatial_index.unit_vectors([(lat, lon)])[0]) ** 2, axis=1)
+        return np.argpartition(distance2, 9)[:10]
+
+    _spatial_case(benchmark, workload, lambda index, lat, lon: index.nearest(lat, lon, 10), brute_force)
+
+
+def bench_spatial_box(benchmark: Benchmark, workload: Workload) -> None:
+    def brute_force(batch, points, lat, lon):
+        inside = (batch.blh[:, 0] >= lat - 5.0) & (batch.blh[:, 0] <= lat + 5.0)
+        return np.nonzero(inside & ((batch.blh[:, 1] - (lon - 10.0)) % 360.0 <= 20.0))[0]
+
+    def query(index, lat, lon):
+        return index.in_box(lat - 5.0, lat + 5.0, lon - 10.0, lon + 10.0)
+
+    _spatial_case(benchmark, workload, query, brute_force)
+
+
+def bench_end_to_end(benchmark: Benchmark, workload: Workload) -> None:
+    """
+    FTP listing, product download over HTTP, parse with conversion and the station_tb write
+    """
+    with http_server(workload.directory) as base_url, ftp_server(workload.ftp_root) as ftp_class, \
+            requests.Session() as http_session, tempfile.TemporaryDirectory() as download_dir:
+        url = f"{base_url}/{os.path.basename(workload.compressed_file)}"
+
+        def run():
+            with ftp_discovery.StationDiscovery(LOCALHOST, 'anonymous', '', ftp_class=ftp_class) as discovery:
+                stations = discovery.list_day(EPOCH)
+            file = downloader.download(url, os.path.join(download_dir, 'product.snx.Z'), http_session).path
+            batch = stations_handler.process_product(file, stations, EPOCH, remove_file=True)
+            return _upsert(FakeConnection(DB_LATENCY), batch)
+
+        result = benchmark(run)
+    benchmark.extra_info.update(result._asdict())
+
+
+CASES = (
+    ('parse', bench_parse),
+    ('parse', bench_parse_compressed),
+    ('geodesy', bench_fill_geocentric_coordinates),
+    ('database', bench_db_insert),
+    ('database', bench_db_update),
+    ('database', bench_db_unchanged),
+    ('database', bench_db_bulk_insert),
+    ('database', bench_db_bulk_update),
+    ('spatial', bench_spatial_build),
+    ('spatial', bench_spatial_within),
+    ('spatial', bench_spatial_nearest),
+    ('spatial', bench_spatial_box),
+    ('end_to_end', bench_end_to_end),
+)
+
+
+def machine_info() -> dict:
+    return {
+        'node': platform.node(),
+        'processor': platform.processor(),
+        'machine': platform.machine(),
+        'system': platform.system(),
+        'python_version': platform.python_version(),
+        'numpy_version': np.__version__,
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(results: list, baseline_file: str, max_regression: float) -> bool:
+    """
+    Comparing the best times with a previous results file
+
+    Returns
+    -------
+    bool
+        False if a case got slower than the baseline by more than max_regression (a fraction)
+    """
+    with open(baseline_file, 'r') as f:
+        baseline = {entry['name']: entry for entry in json.load(f)['benchmarks']}
+    ok = True
+    for entry in results:
+        previous = baseline.get(entry['name'])
+        if previous is None:
+            print(f"{entry['name']:42s} new")
+            continue
+        ratio = entry['stats']['min'] / previous['stats']['min']
+        regression = ratio > 1.0 + max_regression
+        ok = ok and not regression
+        print(f"{entry['name']:42s} {previous['stats']['min'] * 1e3:10.2f} ms -> {entry['stats']['min'] * 1e3:10.2f} ms"
+              f"  x{ratio:.2f}{'  REGRESSION' if regression else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark suite of the hot paths on synthetic data')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES), help="numbers of stations")
+    parser.add_argument('--rounds', type=int, default=5, help="number of timed runs of each case")
+    parser.add_argument('-k', dest='keyword', default='', help="only run the cases whose name contains this text")
+    parser.add_argument('--output', default='benchmark_results.json', help="file to write the results to")
+    parser.add_argument('--compare', help="results file of a previous run to compare with")
+    parser.add_argument('--max-regression', type=float, default=0.25,
+                        help="slowdown (fraction of the baseline time) failing the comparison")
+    args = parser.parse_args()
+
+    results = list()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in args.sizes:
+            workload = None
+            for group, case in CASES:
+                name = f"{case.__name__}[{size}]"
+                if args.keyword not in name:
+                    continue
+                if workload is None:
+                    workload = Workload(size, os.path.join(tmp_dir, str(size)))
+                benchmark = Benchmark(name, group, {'stations': size}, args.rounds)
+                case(benchmark, workload)
+                results.append(benchmark.as_dict())
+                print(f"{name:42s} min {benchmark.best * 1e3:10.2f} ms  median "
+                      f"{statistics.median(benchmark.times) * 1e3:10.2f} ms  "
+                      f"{json.dumps(benchmark.extra_info, default=str)}")
+
+    with open(args.output, 'w') as f:
+        json.dump({'machine_info': machine_info(), 'datetime': datetime.now().isoformat(),
+                   'benchmarks': results}, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare and not compare(results, args.compare, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
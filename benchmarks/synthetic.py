@@ -0,0 +1,206 @@
+import math
+import random
+from datetime import datetime
+
+# WGS84 ellipsoid
+A = 6378137.0
+F = 1.0 / 298.257223563
+E2 = F * (2.0 - F)
+
+
+def station_name(index: int) -> str:
+    """
+    Deterministic 4-character station name for an index (base 36, first character is a letter)
+    """
+    alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+    name = alphabet[index // 36 ** 3 % 26]
+    for power in (2, 1, 0):
+        name += alphabet[index // 36 ** power % 36]
+    return name
+
+
+def station_positions(count: int, seed: int = 0) -> list:
+    """
+    Random station positions on the WGS84 ellipsoid
+
+    Parameters
+    ----------
+    count : int
+        Number of stations
+    seed : int
+        Seed of the random generator
+
+    Returns
+    -------
+    list
+        (name, x, y, z) for each station
+    """
+    rnd = random.Random(seed)
+    result = list()
+    for index in range(count):
+        lat = math.asin(rnd.uniform(-1.0, 1.0))
+        lon = rnd.uniform(-math.pi, math.pi)
+        h = rnd.uniform(-50.0, 3000.0)
+        n = A / math.sqrt(1.0 - E2 * math.sin(lat) ** 2)
+        x = (n + h) * math.cos(lat) * math.cos(lon)
+        y = (n + h) * math.cos(lat) * math.sin(lon)
+        z = (n * (1.0 - E2) + h) * math.sin(lat)
+        result.append((station_name(index), x, y, z))
+    return result
+
+
+def sinex_epoch(dt: datetime) -> str:
+    seconds = dt.hour * 3600 + dt.minute * 60 + dt.second
+    return f"{dt.year % 100:02d}:{dt.timetuple().tm_yday:03d}:{seconds:05d}"
+
+
+def estimate_line(index: int, kind: str, code: str, epoch: str, unit: str, value: float, std: float) -> str:
+    return f" {index:5d} {kind:<6s} {code:4s}  A    1 {epoch:12s} {unit:<4s} 2 {value:21.14e} {std:11.5e}\n"
+
+
+def generate_sinex(count: int, seed: int = 0, epoch: datetime = datetime(2022, 1, 1, 12), matrix_rows: int = 0,
+                   velocities: bool = False) -> str:
+    """
+    Generating the text of a SINEX file with the SITE/ID and SOLUTION/ESTIMATE blocks
+
+    Parameters
+    ----------
+    count : int
+        Number of stations
+    seed : int
+        Seed of the random generator
+    epoch : datetime
+        Reference epoch of the solution
+    matrix_rows : int
+        Number of lines of the SOLUTION/MATRIX_ESTIMATE block following the estimates
+    velocities : bool
+        Adding VELX/VELY/VELZ estimates (a few cm/year) after the positions of every station
+
+    Returns
+    -------
+    str
+        Contents of the SINEX file
+    """
+    ref_epoch = sinex_epoch(epoch)
+    stations = station_positions(count, seed)
+    lines = [f"%=SNX 2.02 IGS {ref_epoch} IGS {ref_epoch} {ref_epoch} P {(6 if velocities else 3) * count:05d} 2 S\n",
+             "*-------------------------------------------------------------------------------\n",
+             "+FILE/REFERENCE\n",
+             " DESCRIPTION        Synthetic weekly combined solution\n",
+             " OUTPUT             Benchmark input\n",
+             "-FILE/REFERENCE\n",
+             "*-------------------------------------------------------------------------------\n",
+             "+SITE/ID\n",
+             "*CODE PT __DOMES__ T _STATION DESCRIPTION__ APPROX_LON_ APPROX_LAT_ _APP_H_\n"]
+    for name, _, _, _ in stations:
+        lines.append(f" {name} A 00000M000 P Synthetic station     000 00 00.0  00 00 00.0     0.0\n")
+    lines += ["-SITE/ID\n",
+              "*-------------------------------------------------------------------------------\n",
+              "+SOLUTION/ESTIMATE\n",
+              "*INDEX TYPE__ CODE PT SOLN _REF_EPOCH__ UNIT S __ESTIMATED VALUE____ _STD_DEV___\n"]
+    rnd = random.Random(seed + 1)
+    index = 1
+    for name, x, y, z in stations:
+        for kind, value in (('STAX', x), ('STAY', y), ('STAZ', z)):
+            lines.append(estimate_line(index, kind, name, ref_epoch, 'm', value, rnd.uniform(1e-4, 5e-3)))
+            index += 1
+        if velocities:
+            for kind in ('VELX', 'VELY', 'VELZ'):
+                lines.append(estimate_line(index, kind, name, ref_epoch, 'm/y', rnd.uniform(-0.05, 0.05),
+                                           rnd.uniform(1e-5, 5e-4)))
+                index += 1
+    lines += ["-SOLUTION/ESTIMATE\n",
+              "*-------------------------------------------------------------------------------\n"]
+    if matrix_rows:
+        lines += ["+SOLUTION/MATRIX_ESTIMATE L COVA\n",
+                  "*PARA1 PARA2 ____PARA2+0__________ ____PARA2+1__________ ____PARA2+2__________\n"]
+        for row in range(matrix_rows):
+            lines.append(f" {row % (3 * count) + 1:5d} {row % (3 * count) + 1:5d} {rnd.uniform(-1e-6, 1e-5):21.14e}"
+                         f" {rnd.uniform(-1e-6, 1e-5):21.14e} {rnd.uniform(-1e-6, 1e-5):21.14e}\n")
+        lines.append("-SOLUTION/MATRIX_ESTIMATE L COVA\n")
+    lines.append("%ENDSNX\n")
+    return ''.join(lines)
+
+
+def write_sinex(file: str, count: int, seed: int = 0, matrix_rows: int = 0, velocities: bool = False) -> str:
+    with open(file, 'w') as f:
+        f.write(generate_sinex(count, seed, matrix_rows=matrix_rows, velocities=velocities))
+    return file
+
+
+def compress_z(data: bytes, max_bits: int = 16, clear: bool = False) -> bytes:
+    """
+    Compressing data into the Unix compress (.Z) format
+
+    Mirrors the decoder: the code width grows when the decoder's table is full
+    and the rest of the current group of 8 codes is padded with zeros. With `clear`
+    a CLEAR code is written whenever the table is full, as compress does when the
+    ratio drops, otherwise the table is never cleared.
+    """
+    out = bytearray(b'\x1f\x9d' + bytes((0x80 | max_bits,)))
+    max_max_code = 1 << max_bits
+    n_bits = 9
+    max_code = (1 << n_bits) - 1
+    acc = 0  # pending bits
+    acc_bits = 0
+    written = 0  # bits written since the start of the codes
+    segment = 0
+    decoder_free = 257
+    first = True
+
+    def pad() -> None:
+        nonlocal acc_bits, written, segment
+        group = n_bits * 8
+        padding = segment + (written - segment + group - 1) // group * group - written
+        acc_bits += padding
+        written += padding
+        segment = written
+
+    def put(code: int) -> None:
+        nonlocal acc, acc_bits, written, n_bits, max_code, decoder_free, first
+        if decoder_free > max_code and n_bits < max_bits:
+            pad()
+            n_bits += 1
+            max_code = max_max_code if n_bits == max_bits else (1 << n_bits) - 1
+        acc |= code << acc_bits
+        acc_bits += n_bits
+        written += n_bits
+        while acc_bits >= 8:
+            out.append(acc & 0xff)
+            acc >>= 8
+            acc_bits -= 8
+        if not first and decoder_free < max_max_code:
+            decoder_free += 1
+        first = False
+
+    table = dict()
+    free = 257
+    code = None
+    for byte in data:
+        if code is None:
+            code = byte
+            continue
+        key = code << 8 | byte
+        next_code = table.get(key)
+        if next_code is not None:
+            code = next_code
+            continue
+        put(code)
+        if free < max_max_code:
+            table[key] = free
+            free += 1
+        elif clear:
+            # The decoder drops its table down to the literals and restarts with 9-bit codes after the group
+            put(256)
+            pad()
+            n_bits = 9
+            max_code = (1 << n_bits) - 1
+            decoder_free = 256
+            table.clear()
+            free = 257
+        code = byte
+    if code is not None:
+        put(code)
+    if acc_bits:
+        out.append(acc & 0xff)
+    return bytes(out)
@@ -0,0 +1,13 @@
+import multiprocessing
+
+READ_CHUNK_SIZE = 1024 * 1024  # 1MB chunks of the files read by the parsers, the decompression and the caches
+
+
+def spawn_context():
+    """
+    Multiprocessing context of the worker pools
+
+    The parent already runs threads (downloads, SSH tunnel) when a pool starts, so the workers are spawned
+    rather than forked: a fork would copy the locks held by those threads into the workers.
+    """
+    return multiprocessing.get_context('spawn')
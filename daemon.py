@@ -0,0 +1,317 @@
+import json
+import os
+import signal
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+import metrics
+
+HEALTH_HOST = '127.0.0.1'
+# The service is unhealthy when no poll succeeded during this many poll intervals
+STALE_POLLS = 3
+WAKE_UP_INTERVAL = 1.0  # seconds, the longest time a stop request waits for the main loop
+RETRY_ATTEMPTS = 5
+RETRY_DELAY = 60.0  # seconds before the first retry of a failed group, doubled for every further one
+MAX_RETRY_DELAY = 3600.0
+
+
+class ScenarioDaemon:
+    """
+    A long-running service processing new scenarios by groups of equal epochs
+
+    The main loop calls poll(watermark) every poll_interval seconds (immediately again while it returns rows)
+    and runs process(epoch, scenario_ids) for every group in a thread pool, with at most max_concurrency
+    groups at a time and never two groups of the same epoch. A failed group (e.g. a product not published yet)
+    is retried after retry_delay seconds, doubled up to max_retry_delay for every further failure, and given up
+    after retry_attempts attempts. The watermark saved to state_file only advances past a poll once all of its
+    scenarios are processed or given up, so a restart repeats the unfinished ones.
+    stop() (SIGTERM/SIGINT once install_signal_handlers() is called) finishes the running groups and returns.
+
+    Attributes
+    ----------
+    poll_interval : float
+        Seconds between polls when there is nothing new
+    max_concurrency : int
+        Maximum number of groups processed at the same time
+    state_file : str
+        JSON file keeping the watermark between runs, None to keep it in memory only
+    health_port : int
+        Port of the health/status endpoint on 127.0.0.1, None to disable it
+    retry_attempts : int
+        Number of attempts of a group before it is given up
+    retry_delay : float
+        Seconds before the first retry of a failed group
+    max_retry_delay : float
+        Upper bound of the delay between two attempts
+
+    Methods
+    -------
+    run()
+        Polling and processing until stop() is called
+    stop()
+        Requesting a graceful shutdown
+    status()
+        Getting the state of the service
+    healthy()
+        Checking that the last successful poll is recent
+    """
+
+    def __init__(self, poll: Callable, process: Callable, watermark=None, poll_interval: float = 60.0,
+                 max_concurrency: int = 2, state_file: str = None, health_port: int = None,
+                 retry_attempts: int = RETRY_ATTEMPTS, retry_delay: float = RETRY_DELAY,
+                 max_retry_delay: float = MAX_RETRY_DELAY):
+        """
+        Parameters
+        ----------
+        poll : callable
+            poll(watermark) -> list of (watermark value, scenario_id, epoch) after the watermark, ascending
+        process : callable
+            process(epoch, scenario_ids) for a group of scenarios with the same epoch, raises on failure
+        watermark : optional
+            Initial watermark, the one of state_file takes precedence
+        """
+        self.poll_interval = poll_interval
+        self.max_concurrency = max_concurrency
+        self.state_file = state_file
+        self.health_port = health_port
+        self.retry_attempts = retry_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.__poll = poll
+        self.__process = process
+        self.__stop = threading.Event()
+        self.__lock = threading.Lock()
+        self.__watermark = self.__load_state(watermark)
+        self.__committed = self.__watermark
+        self.__batches = deque()  # [serial number, watermark after the poll, scenario_ids not processed yet]
+        self.__polls = 0
+        self.__pending = dict()  # scenario_ids by epoch, waiting for a worker
+        self.__failures = dict()  # (failed attempts, monotonic time of the next attempt) by epoch
+        self.__running = dict()  # (epoch, scenario_ids, number of polls before the start) by future
+        self.__started = time.time()
+        self.__last_poll = None
+        self.__last_error = None
+        self.__processed = 0
+        self.__failed = 0
+        self.__abandoned = 0
+
+    def run(self) -> None:
+        """
+        Polling and processing until stop() is called, the running groups are finished before returning
+        """
+        server = self.__start_health_server()
+        next_poll = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                while not self.__stop.is_set():
+                    if time.monotonic() >= next_poll:
+                        found = self.__poll_once()
+                        next_poll = time.monotonic() + (0.0 if found else self.poll_interval)
+                    self.__dispatch(executor)
+                    timeout = min(WAKE_UP_INTERVAL, max(0.0, next_poll - time.monotonic()))
+                    if self.__running:
+                        done, _ = wait(list(self.__running), timeout=timeout, return_when=FIRST_COMPLETED)
+                        self.__finish(done)
+                    else:
+                        self.__stop.wait(timeout)
+                print(f"Stopping, waiting for {len(self.__running)} running groups")
+                done, _ = wait(list(self.__running))
+                self.__finish(done)
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+            self.__save_state()
+
+    def stop(self) -> None:
+        """
+        Requesting a graceful shutdown: no new group is started, the running ones are finished
+        """
+        self.__stop.set()
+
+    def install_signal_handlers(self) -> None:
+        """
+        Stopping gracefully on SIGTERM and SIGINT (must be called from the main thread)
+        """
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signal_number, lambda number, frame: self.stop())
+
+    def healthy(self) -> bool:
+        """
+        Checking that the service runs and that the last successful poll is recent
+        """
+        last = self.__last_poll or self.__started
+        return not self.__stop.is_set() and time.time() - last <= STALE_POLLS * self.poll_interval
+
+    def status(self) -> dict:
+        """
+        Getting the state of the service (watermarks, queued and running groups, counters, last error)
+        """
+        with self.__lock:
+            return {
+                'healthy': self.healthy(),
+                'started': _timestamp(self.__started),
+                'uptime': time.time() - self.__started,
+                'last_poll': _timestamp(self.__last_poll),
+                'watermark': self.__watermark,
+                'committed_watermark': self.__committed,
+                'pending': {str(epoch): sorted(ids) for epoch, ids in sorted(self.__pending.items())},
+                'running': {str(epoch): sorted(ids) for epoch, ids, _ in self.__running.values()},
+                'retrying': {str(epoch): attempts for epoch, (attempts, _) in sorted(self.__failures.items())},
+                'processed_scenarios': self.__processed,
+                'failed_groups': self.__failed,
+                'abandoned_scenarios': self.__abandoned,
+                'last_error': self.__last_error,
+            }
+
+    def __poll_once(self) -> bool:
+        try:
+            with metrics.span('daemon_poll'):
+                rows = self.__poll(self.__watermark)
+        except Exception as ex:
+            print(f"Polling failed with error: {ex}")
+            with self.__lock:
+                self.__last_error = f"poll: {ex!r}"
+            metrics.flush()
+            return False
+        with self.__lock:
+            self.__last_poll = time.time()
+            if not rows and not self.__batches:
+                self.__committed = self.__watermark
+        if not rows:
+            metrics.flush()
+            return False
+        with self.__lock:
+            # A scenario without calculation epoch cannot be processed, the watermark still moves past it
+            missing = sorted(scenario_id for _, scenario_id, epoch in rows if epoch is None)
+            for value, scenario_id, epoch in rows:
+                if epoch is not None:
+                    self.__pending.setdefault(epoch, set()).add(scenario_id)
+            self.__watermark = rows[-1][0]
+            self.__polls += 1
+            self.__batches.append([self.__polls, self.__watermark,
+                                   {scenario_id for _, scenario_id, epoch in rows if epoch is not None}])
+            self.__advance()
+        print(f"{len(rows)} new scenarios, watermark {self.__watermark}")
+        if missing:
+            print(f"No calculation epoch for scenario_id {', '.join(missing)}, skipped")
+            metrics.count('daemon_scenarios_skipped', len(missing))
+        metrics.count('daemon_scenarios_polled', len(rows))
+        metrics.flush()
+        return True
+
+    def __dispatch(self, executor: ThreadPoolExecutor) -> None:
+        now = time.monotonic()
+        with self.__lock:
+            running_epochs = {epoch for epoch, _, _ in self.__running.values()}
+            for epoch in sorted(self.__pending):
+                if len(self.__running) >= self.max_concurrency:
+                    break
+                if epoch in running_epochs or self.__failures.get(epoch, (0, now))[1] > now:
+                    continue
+                ids = self.__pending.pop(epoch)
+                self.__running[executor.submit(self.__process, epoch, sorted(ids))] = (epoch, ids, self.__polls)
+                running_epochs.add(epoch)
+
+    def __finish(self, done) -> None:
+        for future in done:
+            with self.__lock:
+                epoch, ids, polls = self.__running.pop(future)
+            error = future.exception()
+            if error is not None:
+                metrics.count('daemon_groups_failed')
+            with self.__lock:
+                if error is None:
+                    self.__processed += len(ids)
+                    self.__failures.pop(epoch, None)
+                else:
+                    self.__failed += 1
+                    self.__last_error = f"{epoch}: {error!r}"
+                    attempts = self.__failures.get(epoch, (0, 0.0))[0] + 1
+                    if attempts < self.retry_attempts:
+                        # Still outstanding: the group goes back to the queue and the watermark stays before it
+                        delay = min(self.max_retry_delay, self.retry_delay * 2 ** (attempts - 1))
+                        self.__failures[epoch] = (attempts, time.monotonic() + delay)
+                        self.__pending.setdefault(epoch, set()).update(ids)
+                        print(f"Epoch {epoch} ({', '.join(sorted(ids))}) failed with error: {error}, "
+                              f"attempt {attempts} of {self.retry_attempts}, retrying in {delay:.0f} s")
+                        continue
+                    self.__failures.pop(epoch, None)
+                    self.__abandoned += len(ids)
+                    metrics.count('daemon_scenarios_abandoned', len(ids))
+                    print(f"Epoch {epoch} ({', '.join(sorted(ids))}) failed with error: {error}, "
+                          f"giving up after {attempts} attempts")
+                # A scenario polled again after the start of the group is still outstanding in the later poll
+                for batch in self.__batches:
+                    if batch[0] <= polls:
+                        batch[2] -= ids
+                self.__advance()
+            self.__save_state()
+            # A long-running service exposes its counters after every group, not only at exit
+            metrics.flush()
+
+    def __advance(self) -> None:
+        # The committed watermark moves past the leading polls without outstanding scenarios
+        while self.__batches and not self.__batches[0][2]:
+            self.__committed = self.__batches.popleft()[1]
+
+    def __load_state(self, watermark):
+        if self.state_file is None:
+            return watermark
+        try:
+            with open(self.state_file, 'r') as f:
+                return json.load(f)['watermark']
+        except (OSError, ValueError, KeyError):
+            return watermark
+
+    def __save_state(self) -> None:
+        if self.state_file is None:
+            return
+        with self.__lock:
+            state = {'watermark': self.__committed, 'saved': _timestamp(time.time())}
+        directory = os.path.dirname(os.path.abspath(self.state_file))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp.')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f, default=str)
+        os.replace(tmp_path, self.state_file)
+
+    def __start_health_server(self):
+        if self.health_port is None:
+            return None
+        daemon = self
+
+        class HealthHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/health':
+                    code = 200 if daemon.healthy() else 503
+                    body = {'status': 'ok' if code == 200 else 'unhealthy'}
+                elif self.path == '/status':
+                    code = 200
+                    body = daemon.status()
+                else:
+                    code = 404
+                    body = {'error': 'not found'}
+                data = json.dumps(body, default=str).encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((HEALTH_HOST, self.health_port), HealthHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Health endpoint on http://{HEALTH_HOST}:{server.server_address[1]}/health")
+        return server
+
+
+def _timestamp(value: float):
+    return None if value is None else datetime.fromtimestamp(value).isoformat(timespec='seconds')
@@ -0,0 +1,219 @@
+import zlib
+from typing import Iterable, Iterator
+
+from common import READ_CHUNK_SIZE
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+Z_MAGIC = b'\x1f\x9d'
+GZ_MAGIC = b'\x1f\x8b'
+
+# Unix compress (.Z) format
+INIT_BITS = 9
+CLEAR = 256
+BLOCK_MODE = 0x80
+BITS_MASK = 0x1f
+CODES_PER_BATCH = 1 << 14
+
+
+def iter_decompress(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Decompressing a stream of .Z or .gz data, other data is passed through unchanged
+
+    Parameters
+    ----------
+    chunks : iterable of bytes
+        Chunks of the file with arbitrary boundaries
+
+    Returns
+    -------
+    Iterator
+        Chunks of decompressed data
+    """
+    it = iter(chunks)
+    head = b''
+    for chunk in it:
+        head += chunk
+        if len(head) >= 2:
+            break
+    if head[:2] == Z_MAGIC:
+        return iter_unlzw(_prepend(head, it))
+    if head[:2] == GZ_MAGIC:
+        return iter_gunzip(_prepend(head, it))
+    return _prepend(head, it)
+
+
+def iter_file(file: str, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Reading a .Z, .gz or uncompressed file as a stream of decompressed chunks
+
+    Parameters
+    ----------
+    file : str
+        Path to the file
+    chunk_size : int
+        Size of the chunks read from the file
+
+    Returns
+    -------
+    Iterator
+        Chunks of decompressed data
+    """
+    with open(file, 'rb') as f:
+        yield from iter_decompress(iter(lambda: f.read(chunk_size), b''))
+
+
+def iter_gunzip(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Decompressing a stream of gzip data (several members are concatenated)
+    """
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        while chunk:
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+            chunk = b''
+            if decompressor.eof:
+                chunk = decompressor.unused_data
+                decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+def iter_unlzw(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Decompressing a stream of Unix compress (.Z, LZW) data with bounded memory
+
+    Codes are read in batches (with NumPy if it is available), the dictionary keeps whole strings,
+    so every code costs one lookup and one concatenation. Follows the quirks of compress:
+    when the code width changes or the table is cleared, the rest of the current group
+    of 8 codes is skipped.
+
+    Parameters
+    ----------
+    chunks : iterable of bytes
+        Chunks of the .Z file with arbitrary boundaries, starting with the header
+
+    Returns
+    -------
+    Iterator
+        Chunks of decompressed data
+
+    Raises
+    ------
+    ValueError
+        If the data is not in the compress format or is corrupted
+    """
+    it = iter(chunks)
+    buf = b''
+    for chunk in it:
+        buf += chunk
+        if len(buf) >= 3:
+            break
+    if len(buf) < 3 or buf[:2] != Z_MAGIC:
+        raise ValueError("Not a Unix compress (.Z) stream")
+    max_bits = buf[2] & BITS_MASK
+    block_mode = bool(buf[2] & BLOCK_MODE)
+    if not INIT_BITS <= max_bits <= 16:
+        raise ValueError(f"Unsupported maximum code width {max_bits}")
+    buf = buf[3:]
+
+    max_max_code = 1 << max_bits
+    n_bits = INIT_BITS
+    max_code = (1 << n_bits) - 1
+    table = [bytes((i,)) for i in range(256)]
+    if block_mode:
+        table.append(b'')  # CLEAR
+    previous = None
+    pos = 0  # bit position in buf
+    segment = 0  # bit position where the codes of the current width start
+    exhausted = False
+
+    while True:
+        if len(table) > max_code and n_bits < max_bits:
+            pos = _group_end(pos, segment, n_bits)
+            segment = pos
+            n_bits += 1
+            max_code = max_max_code if n_bits == max_bits else (1 << n_bits) - 1
+
+        available = (len(buf) * 8 - pos) // n_bits
+        if available < CODES_PER_BATCH and not exhausted:
+            chunk = next(it, None)
+            if chunk is None:
+                exhausted = True
+            else:
+                drop = pos >> 3
+                buf = buf[drop:] + chunk
+                pos -= drop * 8
+                segment -= drop * 8
+            continue
+        if available <= 0:
+            break
+
+        count = min(available, CODES_PER_BATCH)
+        if n_bits < max_bits:
+            # Every code adds one entry, the width can only change after this batch
+            count = min(count, max_code - len(table) + 1)
+        out = list()
+        consumed = 0
+        cleared = False
+        for code in _read_codes(buf, pos, n_bits, count):
+            consumed += 1
+            if previous is None:
+                previous = table[code]
+                out.append(previous)
+                continue
+            if code == CLEAR and block_mode:
+                del table[256:]
+                cleared = True
+                break
+            if code < len(table):
+                entry = table[code]
+            elif code == len(table):
+                entry = previous + previous[:1]
+            else:
+                raise ValueError(f"Corrupted .Z stream: code {code} is not in the table")
+            if len(table) < max_max_code:
+                table.append(previous + entry[:1])
+            out.append(entry)
+            previous = entry
+        pos += consumed * n_bits
+        if cleared:
+            pos = _group_end(pos, segment, n_bits)
+            segment = pos
+            n_bits = INIT_BITS
+            max_code = (1 << n_bits) - 1
+        if out:
+            yield b''.join(out)
+
+
+def _group_end(pos: int, segment: int, n_bits: int) -> int:
+    # Codes are written in groups of 8, i.e. n_bits bytes
+    group = n_bits * 8
+    return segment + (pos - segment + group - 1) // group * group
+
+
+def _read_codes(buf: bytes, pos: int, n_bits: int, count: int) -> list:
+    mask = (1 << n_bits) - 1
+    if np is not None and count > 64:
+        start = pos >> 3
+        data = np.frombuffer(buf[start:start + (count * n_bits + 7) // 8 + 3] + b'\0\0\0', dtype=np.uint8)
+        bits = (pos & 7) + np.arange(count, dtype=np.int64) * n_bits
+        index = bits >> 3
+        values = data[index].astype(np.uint32) | (data[index + 1].astype(np.uint32) << 8) | \
+            (data[index + 2].astype(np.uint32) << 16)
+        return ((values >> (bits & 7).astype(np.uint32)) & mask).tolist()
+    from_bytes = int.from_bytes
+    return [(from_bytes(buf[p >> 3:(p >> 3) + 3], 'little') >> (p & 7)) & mask
+            for p in range(pos, pos + count * n_bits, n_bits)]
+
+
+def _prepend(head: bytes, it: Iterator[bytes]) -> Iterator[bytes]:
+    if head:
+        yield head
+    yield from it
@@ -0,0 +1,301 @@
+import hashlib
+import os
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import requests
+
+import metrics
+
+CHUNK_SIZE = 1024 * 1024  # 1MB chunks
+MIN_RANGE_SIZE = 8 * 1024 * 1024
+
+CONTENT_RANGE_PATTERN = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+
+class DownloadError(Exception):
+    """
+    The file could not be downloaded completely within the allowed attempts
+    """
+
+
+class FileChangedError(DownloadError):
+    """
+    The file changed on the server while its ranges were downloaded
+    """
+
+
+class DownloadResult(NamedTuple):
+    """
+    Outcome of a successful download
+    """
+    path: str
+    size: int
+    duration: float
+    throughput: float
+    attempts: int
+    etag: str = None
+    last_modified: str = None
+    modified: bool = True
+
+
+def download(url: str, file_path: str, http_session, attempts: int = 5, backoff: float = 1.0,
+             max_backoff: float = 60.0, parallel_ranges: int = 1, min_range_size: int = MIN_RANGE_SIZE,
+             expected_size: int = None, sha256: str = None, timeout: float = 60.0,
+             headers: dict = None) -> DownloadResult:
+    """
+    Downloading a URL into a file with resume, retries and optional parallel ranges
+
+    The data goes to file_path + '.part', a retry resumes it with an HTTP Range request.
+    The validator of the file (a strong ETag, else Last-Modified) is kept in file_path + '.part.validator'
+    and sent as If-Range: a part file without a validator, or a file changed on the server (answered with
+    the whole file or another validator), is downloaded again from the start instead of being spliced.
+    Failed attempts are retried after an exponential backoff with full jitter.
+    Files larger than 2 * min_range_size can be fetched as parallel_ranges concurrent ranges.
+    The size (and the checksum if given) is checked before the file is renamed to file_path.
+    With conditional headers (If-None-Match/If-Modified-Since of a copy already in file_path), a 304 answer
+    leaves file_path as it is and returns a result with modified False.
+
+    Parameters
+    ----------
+    url : str
+        URL to download
+    file_path : str
+        Local file name to contain the data downloaded
+    http_session : requests.Session
+        Session used for the requests
+    attempts : int
+        Number of attempts (for each range when downloading in parallel)
+    backoff : float
+        Base of the backoff in seconds, the n-th retry waits up to backoff * 2 ** (n - 1)
+    max_backoff : float
+        Upper bound of the backoff in seconds
+    parallel_ranges : int
+        Number of concurrent ranges for large files, 1 to download with a single stream
+    min_range_size : int
+        Minimum size of one range in bytes
+    expected_size : int, optional
+        Expected size of the file in bytes
+    sha256 : str, optional
+        Expected SHA-256 hex digest of the file
+    timeout : float
+        Timeout of the connection and of each read in seconds
+    headers : dict, optional
+        Conditional headers sent with the first request of a download that does not resume a part file
+
+    Returns
+    -------
+    DownloadResult
+        Path, size, duration, throughput (bytes/s), attempts used, ETag and Last-Modified of the file,
+        whether it was modified
+
+    Raises
+    ------
+    DownloadError
+        If the file could not be downloaded or does not match expected_size/sha256
+    """
+    part_path = file_path + '.part'
+    start = time.perf_counter()
+    options = dict(attempts=attempts, backoff=backoff, max_backoff=max_backoff, timeout=timeout,
+                   headers=dict(headers or {}))
+
+    probe = None
+    if parallel_ranges > 1:
+        probe = _probe(url, http_session, timeout, options['headers'])
+    if probe is not None and probe[0] == 304:
+        return _not_modified(file_path, start, 1, probe[2], probe[3])
+    used = None
+    if probe is not None and probe[1] >= 2 * min_range_size:
+        _, total, etag, last_modified = probe
+        try:
+            used = _download_ranges(url, part_path, http_session, total, parallel_ranges, min_range_size,
+                                    _validator(etag, last_modified), options)
+        except FileChangedError as ex:
+            print(f'{ex}, downloading it again with a single stream')
+            _discard_part(part_path)
+    if used is None:
+        total, etag, last_modified, used, modified = _download_stream(url, part_path, http_session, options)
+        if not modified:
+            return _not_modified(file_path, start, used, etag, last_modified)
+
+    size = os.path.getsize(part_path)
+    if total is not None and size != total:
+        raise DownloadError(f"{url}: {size} bytes downloaded, {total} expected by the server")
+    if expected_size is not None and size != expected_size:
+        raise DownloadError(f"{url}: {size} bytes downloaded, {expected_size} expected")
+    if sha256 is not None:
+        digest = _sha256(part_path)
+        if digest != sha256.lower():
+            _discard_part(part_path)
+            raise DownloadError(f"{url}: SHA-256 {digest} does not match {sha256}")
+    os.replace(part_path, file_path)
+    _write_validator(part_path, None)
+    duration = time.perf_counter() - start
+    return DownloadResult(file_path, size, duration, size / duration if duration > 0 else 0.0, used,
+                          etag, last_modified)
+
+
+def _download_stream(url: str, part_path: str, http_session, options: dict) -> tuple:
+    for attempt in range(1, options['attempts'] + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        validator = _read_validator(part_path)
+        if offset and validator is None:
+            # Left over by an older run or from a file without validator, its origin cannot be checked
+            _discard_part(part_path)
+            offset = 0
+        headers = {'Range': f'bytes={offset}-', 'If-Range': validator} if offset else options['headers']
+        try:
+            with http_session.get(url, headers=headers, stream=True, timeout=options['timeout']) as response:
+                current = _validator(response.headers.get('ETag'), response.headers.get('Last-Modified'))
+                if not offset and response.status_code == 304:
+                    return None, response.headers.get('ETag'), response.headers.get('Last-Modified'), attempt, False
+                if offset and response.status_code == 416:
+                    # The part file is already complete
+                    total = _total_size(response)
+                    if (total is None or total == offset) and current in (None, validator):
+                        return (offset, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                                attempt, True)
+                    _discard_part(part_path)
+                    raise DownloadError("Range not satisfiable, restarting from byte 0")
+                response.raise_for_status()
+                if offset and response.status_code == 206 and current not in (None, validator):
+                    _discard_part(part_path)
+                    raise DownloadError("The file changed on the server, restarting from byte 0")
+                if offset and response.status_code != 206:
+                    offset = 0  # the server ignored the range, or If-Range did not match: the whole file
+                if not offset:
+                    _write_validator(part_path, current)
+                total = _total_size(response)
+                if total is None and response.headers.get('Content-Length') is not None:
+                    total = offset + int(response.headers['Content-Length'])
+                with open(part_path, 'ab' if offset else 'wb') as out_file:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        out_file.write(chunk)
+                        metrics.count('bytes_downloaded', len(chunk))
+                size = os.path.getsize(part_path)
+                if total is not None and size < total:
+                    raise DownloadError(f"Connection closed after {size} of {total} bytes")
+                return total, response.headers.get('ETag'), response.headers.get('Last-Modified'), attempt, True
+        except (requests.RequestException, OSError, DownloadError) as ex:
+            _retry_or_raise(url, attempt, ex, options)
+
+
+def _download_ranges(url: str, part_path: str, http_session, total: int, parallel_ranges: int,
+                     min_range_size: int, validator: str, options: dict) -> int:
+    count = max(1, min(parallel_ranges, total // min_range_size))
+    bounds = [total * i // count for i in range(count + 1)]
+    # The ranges always start from an empty file, only the single stream resumes a part file
+    _write_validator(part_path, None)
+    with open(part_path, 'wb') as out_file:
+        out_file.truncate(total)
+
+    def fetch(first: int, last: int) -> int:
+        position = first
+        for attempt in range(1, options['attempts'] + 1):
+            try:
+                headers = {'Range': f'bytes={position}-{last}'}
+                if validator is not None:
+                    headers['If-Range'] = validator
+                with http_session.get(url, headers=headers, stream=True, timeout=options['timeout']) as response:
+                    if response.status_code == 200 and validator is not None:
+                        raise FileChangedError(f"{url} changed on the server")
+                    if response.status_code != 206:
+                        response.raise_for_status()
+                        raise DownloadError(f"Range request answered with HTTP {response.status_code}")
+                    with open(part_path, 'r+b') as out_file:
+                        out_file.seek(position)
+                        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                            out_file.write(chunk[:last + 1 - position])
+                            position += len(chunk)
+                            metrics.count('bytes_downloaded', len(chunk))
+                if position <= last:
+                    raise DownloadError(f"Range {first}-{last}: connection closed at byte {position}")
+                return attempt
+            except FileChangedError:
+                raise
+            except (requests.RequestException, OSError, DownloadError) as ex:
+                _retry_or_raise(url, attempt, ex, options)
+
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        futures = [executor.submit(fetch, bounds[i], bounds[i + 1] - 1) for i in range(count)]
+        return sum(future.result() for future in futures)
+
+
+def _probe(url: str, http_session, timeout: float, headers: dict):
+    # A one-byte range request tells the size and whether ranges are supported, or that the file is not modified
+    try:
+        with http_session.get(url, headers={'Range': 'bytes=0-0', **headers}, stream=True,
+                              timeout=timeout) as response:
+            if response.status_code == 304:
+                return 304, None, response.headers.get('ETag'), response.headers.get('Last-Modified')
+            if response.status_code != 206:
+                return None
+            total = _total_size(response)
+            if total is None:
+                return None
+            return 206, total, response.headers.get('ETag'), response.headers.get('Last-Modified')
+    except requests.RequestException:
+        return None
+
+
+def _not_modified(file_path: str, start: float, attempts: int, etag: str, last_modified: str) -> DownloadResult:
+    size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+    return DownloadResult(file_path, size, time.perf_counter() - start, 0.0, attempts, etag, last_modified,
+                          modified=False)
+
+
+def _validator(etag: str, last_modified: str):
+    # If-Range only accepts strong entity tags
+    if etag and not etag.startswith('W/'):
+        return etag
+    return last_modified or None
+
+
+def _read_validator(part_path: str):
+    try:
+        with open(part_path + '.validator', 'r') as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def _write_validator(part_path: str, validator) -> None:
+    # The validator of the data in the part file, removed when there is none
+    if validator is None:
+        if os.path.exists(part_path + '.validator'):
+            os.remove(part_path + '.validator')
+        return
+    with open(part_path + '.validator', 'w') as f:
+        f.write(validator)
+
+
+def _discard_part(part_path: str) -> None:
+    if os.path.exists(part_path):
+        os.remove(part_path)
+    _write_validator(part_path, None)
+
+
+def _total_size(response):
+    match = CONTENT_RANGE_PATTERN.match(response.headers.get('Content-Range', ''))
+    if match is None or match.group(3) == '*':
+        return None
+    return int(match.group(3))
+
+
+def _retry_or_raise(url: str, attempt: int, ex: Exception, options: dict) -> None:
+    print(f'Attempt #{attempt} to download {url} failed with error: {ex}')
+    metrics.count('download_failed_attempts')
+    if attempt >= options['attempts']:
+        raise DownloadError(f"{url}: all {options['attempts']} attempts failed, last error: {ex}") from ex
+    time.sleep(random.uniform(0, min(options['max_backoff'], options['backoff'] * 2 ** (attempt - 1))))
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,216 @@
+import ftplib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Iterable
+
+import metrics
+
+DAILY_DIRECTORY = "LOCAL/FREE/CDIS/DATA/DAILY/{year}/{doy:03d}/{yy:02d}o"
+DEFAULT_TTL = 3600.0
+# Days older than this are complete on the server, their listings never expire
+SETTLED_AFTER = timedelta(days=3)
+
+
+class StationDiscovery:
+    """
+    Discovering the stations with observation files on the FTP server
+
+    Logged-in sessions are kept open and reused, several days are listed concurrently
+    (one session per worker), MLSD is used when the server supports it, otherwise NLST.
+    Listings are cached on disk per (year, day of year): recent days for ttl seconds,
+    settled days forever.
+
+    Attributes
+    ----------
+    server : str
+        Address of the FTP server
+    cache_dir : str
+        Directory of the listing cache, None to disable the cache
+    ttl : float
+        Lifetime in seconds of the cached listing of a recent day
+    workers : int
+        Maximum number of concurrent sessions
+
+    Methods
+    -------
+    list_day(day)
+        Getting the stations with an observation file for a day
+    list_days(days)
+        Listing several days concurrently
+    warm_up()
+        Opening a logged-in session ahead of the first listing
+    close()
+        Closing the sessions
+    """
+
+    def __init__(self, server: str, login: str, password: str, cache_dir: str = None, ttl: float = DEFAULT_TTL,
+                 workers: int = 4, ftp_class=ftplib.FTP):
+        self.server = server
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.workers = workers
+        self.__login = login
+        self.__password = password
+        self.__ftp_class = ftp_class
+        self.__idle = list()  # logged-in sessions not in use, the most recent last
+        self.__opened = 0  # sessions in use or idle, at most workers
+        # Notified when a session becomes idle or a slot is freed by a failed session
+        self.__available = threading.Condition()
+        self.__mlsd_supported = True
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def list_day(self, day: datetime) -> frozenset:
+        """
+        Getting the stations with an observation file for a day
+
+        Parameters
+        ----------
+        day : datetime
+            Day of the observations
+
+        Returns
+        -------
+        frozenset
+            Station names (4 characters, lower case)
+        """
+        cached = self.__read_cache(day)
+        if cached is not None:
+            metrics.count('ftp_listings_cached')
+            return cached
+        with metrics.span('ftp_list'), self.__session() as ftp:
+            directory = DAILY_DIRECTORY.format(year=day.year, doy=day.timetuple().tm_yday, yy=day.year % 100)
+            names = self.__list(ftp, directory)
+        result = frozenset(name[:4].lower() for name in names if len(name) >= 4)
+        self.__write_cache(day, result)
+        return result
+
+    def list_days(self, days: Iterable[datetime]) -> Dict[datetime, frozenset]:
+        """
+        Listing several days concurrently
+
+        Parameters
+        ----------
+        days : iterable of datetime
+            Days of the observations
+
+        Returns
+        -------
+        dict
+            Stations of each day
+        """
+        days = list(days)
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(days)))) as executor:
+            return dict(zip(days, executor.map(self.list_day, days)))
+
+    def warm_up(self) -> None:
+        """
+        Opening a logged-in session ahead of the first listing
+        """
+        with self.__session():
+            pass
+
+    def close(self) -> None:
+        """
+        Closing the sessions
+        """
+        with self.__available:
+            idle, self.__idle = self.__idle, list()
+            self.__opened -= len(idle)
+            self.__available.notify(len(idle))
+        for ftp in idle:
+            self.__quit(ftp)
+
+    def __list(self, ftp, directory: str) -> list:
+        if self.__mlsd_supported:
+            try:
+                return [name for name, facts in ftp.mlsd(directory, facts=['type'])
+                        if facts.get('type', 'file') == 'file']
+            except ftplib.error_perm as e:
+                if not str(e).startswith(('500', '502', '504')):
+                    raise
+                self.__mlsd_supported = False
+        return [os.path.basename(name) for name in ftp.nlst(directory)]
+
+    def __acquire(self):
+        # An idle session, or None when a new one may be opened; waits while all the sessions are in use
+        with self.__available:
+            while not self.__idle and self.__opened >= self.workers:
+                self.__available.wait()
+            if self.__idle:
+                return self.__idle.pop()
+            self.__opened += 1
+            return None
+
+    @contextmanager
+    def __session(self):
+        ftp = self.__acquire()
+        try:
+            if ftp is None:
+                ftp = self.__connect()
+            else:
+                try:
+                    ftp.voidcmd('NOOP')
+                except ftplib.all_errors:
+                    self.__quit(ftp)
+                    ftp = self.__connect()
+            yield ftp
+        except BaseException:
+            # The session may be in an unknown state, it is dropped and the next call opens a new one
+            if ftp is not None:
+                self.__quit(ftp)
+            with self.__available:
+                self.__opened -= 1
+                self.__available.notify()
+            raise
+        with self.__available:
+            self.__idle.append(ftp)
+            self.__available.notify()
+
+    def __connect(self):
+        ftp = self.__ftp_class(self.server)
+        ftp.login(self.__login, self.__password)
+        return ftp
+
+    @staticmethod
+    def __quit(ftp) -> None:
+        try:
+            ftp.quit()
+        except ftplib.all_errors:
+            ftp.close()
+
+    def __cache_path(self, day: datetime) -> str:
+        return os.path.join(self.cache_dir, f"ftp_{day.year}_{day.timetuple().tm_yday:03d}.json")
+
+    def __read_cache(self, day: datetime):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self.__cache_path(day), 'r') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        settled = datetime.fromtimestamp(cached['listed_at']) - day > SETTLED_AFTER
+        if not settled and time.time() - cached['listed_at'] > self.ttl:
+            return None
+        return frozenset(cached['stations'])
+
+    def __write_cache(self, day: datetime, stations: frozenset) -> None:
+        if self.cache_dir is None:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp.')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'listed_at': time.time(), 'stations': sorted(stations)}, f)
+        os.replace(tmp_path, self.__cache_path(day))
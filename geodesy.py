@@ -0,0 +1,90 @@
+import numpy as np
+
+# WGS84 ellipsoid parameters
+A = 6378137.0
+ONE_F = 298.257223563
+B = A * (1.0 - 1.0 / ONE_F)
+E2 = (1.0 / ONE_F) * (2 - (1.0 / ONE_F))  # e^2 = 2 * f - f * f = (a^2 - b^2) / a^2
+ED2 = E2 * A * A / (B * B)  # e'^2 = (a^2 - b^2) / b^2
+
+BOWRING = 'bowring'
+ITERATIVE = 'iterative'
+
+DEFAULT_TOLERANCE = 1e-12  # radians, ~6e-6 mm on the surface
+MAX_ITERATIONS = 10
+
+
+def ecef2blh(xyz, method: str = BOWRING, tolerance: float = DEFAULT_TOLERANCE) -> np.ndarray:
+    """
+    Converting geocentric coordinates to geodetic ones for a batch of points
+
+    Parameters
+    ----------
+    xyz : array_like
+        N x 3 array of geocentric coordinates X, Y, Z in meters
+    method : str
+        BOWRING for the closed form (same as stations_handler.ecef2blh, but with a height also valid
+        on the polar axis),
+        ITERATIVE for the iterative solution with the given tolerance
+    tolerance : float
+        Convergence threshold for the latitude in radians (ITERATIVE only)
+
+    Returns
+    -------
+    numpy.ndarray
+        N x 3 array of latitude and longitude in degrees and height in meters
+    """
+    xyz = np.asarray(xyz, dtype=np.float64).reshape(-1, 3)
+    x, y, z = xyz[:, 0], xyz[:, 1], xyz[:, 2]
+    p = np.hypot(x, y)
+    if method == BOWRING:
+        theta = np.arctan2(z * A, p * B)
+        lat = np.arctan2(z + ED2 * B * np.sin(theta) ** 3, p - E2 * A * np.cos(theta) ** 3)
+    elif method == ITERATIVE:
+        lat = np.arctan2(z, p * (1.0 - E2))
+        for _ in range(MAX_ITERATIONS):
+            sin_lat = np.sin(lat)
+            n = A / np.sqrt(1.0 - E2 * sin_lat * sin_lat)
+            new_lat = np.arctan2(z + E2 * n * sin_lat, p)
+            converged = np.max(np.abs(new_lat - lat), initial=0.0) < tolerance
+            lat = new_lat
+            if converged:
+                break
+    else:
+        raise ValueError(f"Unknown conversion method '{method}'")
+    sin_lat = np.sin(lat)
+    # Valid at the poles, unlike p / cos(lat) - N
+    height = p * np.cos(lat) + z * sin_lat - A * np.sqrt(1.0 - E2 * sin_lat * sin_lat)
+    result = np.empty_like(xyz)
+    result[:, 0] = np.degrees(lat)
+    result[:, 1] = np.degrees(np.arctan2(y, x))
+    result[:, 2] = height
+    return result
+
+
+def blh2ecef(blh) -> np.ndarray:
+    """
+    Converting geodetic coordinates to geocentric ones for a batch of points
+
+    Parameters
+    ----------
+    blh : array_like
+        N x 3 array of latitude and longitude in degrees and height in meters
+
+    Returns
+    -------
+    numpy.ndarray
+        N x 3 array of geocentric coordinates X, Y, Z in meters
+    """
+    blh = np.asarray(blh, dtype=np.float64).reshape(-1, 3)
+    lat = np.radians(blh[:, 0])
+    lon = np.radians(blh[:, 1])
+    height = blh[:, 2]
+    sin_lat = np.sin(lat)
+    cos_lat = np.cos(lat)
+    n = A / np.sqrt(1.0 - E2 * sin_lat * sin_lat)
+    result = np.empty_like(blh)
+    result[:, 0] = (n + height) * cos_lat * np.cos(lon)
+    result[:, 1] = (n + height) * cos_lat * np.sin(lon)
+    result[:, 2] = (n * (1.0 - E2) + height) * sin_lat
+    return result
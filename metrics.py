@@ -0,0 +1,233 @@
+import atexit
+import contextlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+PREFIX = 'station_handler'
+
+
+class _NullSpan:
+    """
+    Span used while the instrumentation is disabled, entering and leaving it does nothing
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('recorder', 'name', 'labels', 'start')
+
+    def __init__(self, recorder: 'Recorder', name: str, labels: dict):
+        self.recorder = recorder
+        self.name = name
+        self.labels = labels
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.recorder.record_span(self.name, self.labels, time.perf_counter() - self.start, exc_type is None)
+        return False
+
+
+class Recorder:
+    """
+    Collecting the spans and counters of one process
+
+    Every finished span is appended to the JSON-lines file as
+    {"time", "span", "duration", "ok", "labels"}; durations and counters are also totalled
+    and written to the Prometheus textfile (node_exporter textfile collector format) by flush().
+
+    Attributes
+    ----------
+    jsonl_path : str
+        JSON-lines file of the spans, None to skip it
+    prometheus_path : str
+        Prometheus textfile, None to skip it
+    counters : dict
+        Totals of the counters by name
+    spans : dict
+        [calls, failures, seconds] by (span name, sorted labels)
+    finished : list
+        (start time, name, labels, duration, ok) of every span when the spans are kept, None otherwise
+    """
+
+    def __init__(self, jsonl_path: str = None, prometheus_path: str = None, keep_spans: bool = False):
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.counters = dict()
+        self.spans = dict()
+        self.finished = list() if keep_spans else None
+        self.__lock = threading.Lock()
+        self.__jsonl = open(jsonl_path, 'a', buffering=1) if jsonl_path else None
+
+    def record_span(self, name: str, labels: dict, duration: float, ok: bool, start: float = None) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        if start is None:
+            start = time.time() - duration
+        line = None
+        if self.__jsonl is not None:
+            line = json.dumps({'time': start, 'span': name, 'duration': duration, 'ok': ok, 'labels': labels},
+                              default=str)
+        with self.__lock:
+            totals = self.spans.setdefault(key, [0, 0, 0.0])
+            totals[0] += 1
+            totals[1] += not ok
+            totals[2] += duration
+            if line is not None:
+                self.__jsonl.write(line + '\n')
+            if self.finished is not None:
+                self.finished.append((start, name, labels, duration, ok))
+
+    def count(self, name: str, value: float) -> None:
+        with self.__lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def flush(self) -> None:
+        with self.__lock:
+            if self.__jsonl is not None:
+                self.__jsonl.write(json.dumps({'time': time.time(), 'counters': self.counters}) + '\n')
+                self.__jsonl.flush()
+            if self.prometheus_path:
+                self.__write_prometheus()
+
+    def close(self) -> None:
+        self.flush()
+        with self.__lock:
+            if self.__jsonl is not None:
+                self.__jsonl.close()
+                self.__jsonl = None
+
+    def __write_prometheus(self) -> None:
+        lines = [f"# HELP {PREFIX}_span_seconds_total Time spent in the stage",
+                 f"# TYPE {PREFIX}_span_seconds_total counter"]
+        lines += [f"{PREFIX}_span_seconds_total{_labels(name, labels)} {totals[2]:.6f}"
+                  for (name, labels), totals in sorted(self.spans.items())]
+        lines += [f"# HELP {PREFIX}_span_calls_total Number of runs of the stage",
+                  f"# TYPE {PREFIX}_span_calls_total counter"]
+        lines += [f"{PREFIX}_span_calls_total{_labels(name, labels)} {totals[0]}"
+                  for (name, labels), totals in sorted(self.spans.items())]
+        lines += [f"# HELP {PREFIX}_span_failures_total Number of runs of the stage that raised",
+                  f"# TYPE {PREFIX}_span_failures_total counter"]
+        lines += [f"{PREFIX}_span_failures_total{_labels(name, labels)} {totals[1]}"
+                  for (name, labels), totals in sorted(self.spans.items())]
+        for name, value in sorted(self.counters.items()):
+            lines += [f"# TYPE {PREFIX}_{name}_total counter", f"{PREFIX}_{name}_total {value}"]
+        lines.append(f"{PREFIX}_last_flush_timestamp_seconds {time.time():.3f}")
+        # The collector may read the file at any moment, it is replaced atomically
+        directory = os.path.dirname(os.path.abspath(self.prometheus_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp.')
+        with os.fdopen(fd, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.prometheus_path)
+
+
+def _labels(name: str, labels: tuple) -> str:
+    pairs = [('stage', name)] + list(labels)
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+_recorder = None
+
+
+def configure(jsonl_path: str = None, prometheus_path: str = None) -> None:
+    """
+    Enabling the instrumentation of this process, it stays disabled if neither file is given
+
+    Parameters
+    ----------
+    jsonl_path : str, optional
+        JSON-lines file the spans are appended to
+    prometheus_path : str, optional
+        Prometheus textfile rewritten by flush() and at exit
+    """
+    global _recorder
+    if _recorder is not None:
+        _recorder.close()
+        _recorder = None
+    if jsonl_path or prometheus_path:
+        _recorder = Recorder(jsonl_path, prometheus_path)
+        atexit.register(_recorder.close)
+
+
+def enabled() -> bool:
+    return _recorder is not None
+
+
+def span(name: str, **labels):
+    """
+    Timing a stage: with metrics.span('parse', file=file): ...
+
+    Returns a shared no-op context manager while the instrumentation is disabled.
+    """
+    recorder = _recorder
+    if recorder is None:
+        return _NULL_SPAN
+    return _Span(recorder, name, labels)
+
+
+def count(name: str, value: float = 1) -> None:
+    """
+    Adding value to a counter (bytes_downloaded, sinex_lines_parsed, db_round_trips...)
+    """
+    recorder = _recorder
+    if recorder is not None:
+        recorder.count(name, value)
+
+
+@contextlib.contextmanager
+def collect():
+    """
+    Recording the spans and counters of a block in memory, whatever the configuration of this process
+
+    Meant for the worker processes, which have no output files: the collected dict is filled when the block
+    exits and can be sent back to the parent, which adds it to its own files with merge().
+
+        with metrics.collect() as collected:
+            result = parse(file)
+        return result, collected
+    """
+    global _recorder
+    previous, _recorder = _recorder, Recorder(keep_spans=True)
+    collected = dict()
+    try:
+        yield collected
+    finally:
+        recorder, _recorder = _recorder, previous
+        collected.update(counters=recorder.counters, spans=recorder.finished)
+
+
+def merge(collected: dict) -> None:
+    """
+    Adding the spans and counters collected by collect(), e.g. in a worker process, to this process
+    """
+    recorder = _recorder
+    if recorder is None or not collected:
+        return
+    for start, name, labels, duration, ok in collected['spans']:
+        recorder.record_span(name, labels, duration, ok, start)
+    for name, value in collected['counters'].items():
+        recorder.count(name, value)
+
+
+def flush() -> None:
+    """
+    Writing the counters to the JSON-lines file and rewriting the Prometheus textfile
+    """
+    recorder = _recorder
+    if recorder is not None:
+        recorder.flush()
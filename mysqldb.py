@@ -1,6 +1,13 @@
+import threading
+import time
+from contextlib import contextmanager
+
 import mysql.connector
 import sshtunnel
 from mysql.connector import Error
+from mysql.connector.errors import PoolError
+
+import metrics
 
 
 class MySQLConnection:
@@ -11,18 +18,22 @@ class MySQLConnection:
     connection = None
     tunnel = None
 
-    def __init__(self, host_name: str, database_name, user_name: str, user_password: str, port: int):
+    def __init__(self, host_name: str, database_name, user_name: str, user_password: str, port: int,
+                 allow_local_infile: bool = False):
         self.host_name = host_name
         self.database_name = database_name
         self.user_name = user_name
         self.user_password = user_password
         self.port = port
+        # Needed by RequestHandler.bulk_load_station_data (LOAD DATA LOCAL INFILE)
+        self.allow_local_infile = allow_local_infile
 
     def create_connection(self):
         try:
             self.connection = mysql.connector.connect(host=self.host_name, database=self.database_name,
                                                       user=self.user_name,
-                                                      passwd=self.user_password, port=self.port)
+                                                      passwd=self.user_password, port=self.port,
+                                                      allow_local_infile=self.allow_local_infile)
             self.__checking_connection()
         except Error as e:
             print(f"The error '{e}' occurred")
@@ -33,13 +44,15 @@ class MySQLConnection:
         self.tunnel = sshtunnel.SSHTunnelForwarder((ssh_host, ssh_port), ssh_username=ssh_username,
                                                    ssh_password=ssh_password,
                                                    remote_bind_address=('127.0.0.1', 3306))
-        self.tunnel.start()
+        with metrics.span('ssh_tunnel'):
+            self.tunnel.start()
         try:
             self.connection = mysql.connector.connect(user=self.user_name, password=self.user_password,
                                                       host='127.0.0.1',
                                                       database=self.database_name,
                                                       port=self.tunnel.local_bind_port,
-                                                      use_pure=True)
+                                                      use_pure=True,
+                                                      allow_local_infile=self.allow_local_infile)
             self.__checking_connection()
         except Error as e:
             print(f"The error '{e}' occurred")
@@ -62,3 +75,189 @@ class MySQLConnection:
             print(f"You're connected to database: {record}")
             is_connected = True
         return is_connected
+
+
+class ConnectionPool:
+    """
+    A pool of database connections sharing one SSH tunnel
+
+    The tunnel is opened once and restarted when it drops, connections are checked when borrowed
+    and replaced transparently if they are broken. The connector and the tunnel class can be replaced
+    (e.g. by fakes in tests), without ssh_host the connections go directly to host_name:port.
+
+    Attributes
+    ----------
+    pool_size : int
+        Maximum number of open connections
+    timeout : float
+        Seconds to wait for a free connection before raising PoolError
+    allow_local_infile : bool
+        Allowing LOAD DATA LOCAL INFILE on the connections (RequestHandler.bulk_load_station_data)
+
+    Methods
+    -------
+    borrow()
+        Getting a healthy connection from the pool
+    give_back(connection)
+        Returning a connection to the pool
+    connection()
+        Context manager borrowing a connection and returning it afterwards
+    close()
+        Closing all connections and the tunnel
+    """
+
+    def __init__(self, host_name: str, database_name: str, user_name: str, user_password: str, port: int,
+                 pool_size: int = 4, timeout: float = 30.0, ssh_host: str = None, ssh_port: int = 22,
+                 ssh_username: str = None, ssh_password: str = None, allow_local_infile: bool = False,
+                 connect=mysql.connector.connect, tunnel_class=sshtunnel.SSHTunnelForwarder):
+        self.host_name = host_name
+        self.database_name = database_name
+        self.user_name = user_name
+        self.user_password = user_password
+        self.port = port
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.ssh_host = ssh_host
+        self.ssh_port = ssh_port
+        self.ssh_username = ssh_username
+        self.ssh_password = ssh_password
+        self.allow_local_infile = allow_local_infile
+        self.tunnel = None
+        self.__connect = connect
+        self.__tunnel_class = tunnel_class
+        self.__idle = list()  # connections given back, the last one is borrowed first
+        self.__opened = 0
+        self.__available = threading.Condition()  # guards __idle and __opened, notified when either changes
+        self.__lock = threading.Lock()  # guards the tunnel
+        self.__closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def borrow(self):
+        """
+        Getting a healthy connection from the pool, opening a new one if the pool is not full
+
+        Returns
+        -------
+        mysql.connector.connect
+            Database connection object
+
+        Raises
+        ------
+        PoolError
+            If the pool is closed or no connection became free within timeout seconds
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self.__available:
+                # Woken by a connection given back and by a discarded one freeing a slot
+                while not self.__closed and not self.__idle and self.__opened >= self.pool_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolError(f"No free connection in the pool within {self.timeout} s")
+                    self.__available.wait(remaining)
+                if self.__closed:
+                    raise PoolError("The connection pool is closed")
+                connection = self.__idle.pop() if self.__idle else None
+                if connection is None:
+                    self.__opened += 1
+            if connection is None:
+                try:
+                    return self.__open_connection()
+                except BaseException:
+                    self.__release_slot()
+                    raise
+            if self.__is_healthy(connection):
+                return connection
+            self.__discard(connection)
+
+    def give_back(self, connection) -> None:
+        """
+        Returning a connection to the pool, an open transaction is rolled back
+
+        Parameters
+        ----------
+        connection : mysql.connector.connect
+            Connection received from borrow()
+        """
+        if self.__closed:
+            self.__discard(connection)
+            return
+        try:
+            connection.rollback()
+        except Error:
+            self.__discard(connection)
+            return
+        with self.__available:
+            self.__idle.append(connection)
+            self.__available.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrowing a connection for the block and returning it afterwards
+        """
+        connection = self.borrow()
+        try:
+            yield connection
+        finally:
+            self.give_back(connection)
+
+    def close(self) -> None:
+        """
+        Closing idle connections and the tunnel, connections still borrowed are closed when given back
+        """
+        with self.__available:
+            self.__closed = True
+            idle, self.__idle = self.__idle, list()
+            self.__available.notify_all()
+        for connection in idle:
+            self.__discard(connection)
+        with self.__lock:
+            if self.tunnel is not None:
+                self.tunnel.close()
+                self.tunnel = None
+
+    def __open_connection(self):
+        host, port = self.__address()
+        return self.__connect(host=host, port=port, database=self.database_name, user=self.user_name,
+                              password=self.user_password, use_pure=True,
+                              allow_local_infile=self.allow_local_infile)
+
+    def __address(self) -> tuple:
+        if self.ssh_host is None:
+            return self.host_name, self.port
+        with self.__lock:
+            if self.tunnel is None:
+                self.tunnel = self.__tunnel_class((self.ssh_host, self.ssh_port), ssh_username=self.ssh_username,
+                                                  ssh_password=self.ssh_password,
+                                                  remote_bind_address=('127.0.0.1', 3306))
+                with metrics.span('ssh_tunnel'):
+                    self.tunnel.start()
+            elif not self.tunnel.is_active:
+                print("The SSH tunnel is down, restarting it")
+                self.tunnel.restart()
+            return '127.0.0.1', self.tunnel.local_bind_port
+
+    @staticmethod
+    def __is_healthy(connection) -> bool:
+        try:
+            return connection.is_connected()
+        except Error:
+            return False
+
+    def __release_slot(self) -> None:
+        with self.__available:
+            self.__opened -= 1
+            self.__available.notify()
+
+    def __discard(self, connection) -> None:
+        self.__release_slot()
+        try:
+            connection.close()
+        except Error:
+            pass
@@ -0,0 +1,213 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import downloader
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+@dataclass
+class CacheStats:
+    """
+    Counters of a ProductCache
+    """
+    hits: int = 0
+    revalidated: int = 0
+    misses: int = 0
+    stale: int = 0
+    evictions: int = 0
+    bytes_downloaded: int = 0
+
+
+class ProductCache:
+    """
+    An on-disk cache of product files keyed by URL
+
+    Every request is revalidated with If-None-Match/If-Modified-Since sent by downloader.download (with its
+    timeout and retries): a 304 answer serves the cached copy, a 200 answer is streamed into the cache
+    (resumable, renamed when complete), and the cached copy is served with a warning if the server cannot
+    be reached. Concurrent runs are serialized per URL with a lock file,
+    the least recently used files are evicted when the cache grows over max_bytes.
+
+    Attributes
+    ----------
+    directory : str
+        Directory of the cache
+    max_bytes : int
+        Maximum total size of the cached files
+    download_options : dict
+        Keyword arguments of downloader.download (attempts, parallel_ranges...)
+    stats : CacheStats
+        Hit/miss counters of this instance
+
+    Methods
+    -------
+    get(url, http_session)
+        Getting the path of an up-to-date copy of the URL
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES, **download_options):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.download_options = download_options
+        self.stats = CacheStats()
+        self.__stats_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, url: str, http_session, revalidate: bool = True) -> str:
+        """
+        Getting the path of an up-to-date copy of the URL
+
+        Parameters
+        ----------
+        url : str
+            URL of the product
+        http_session : requests.Session
+            Session used for the request (e.g. SessionWithHeaderRedirection)
+        revalidate : bool
+            False to serve a cached copy without asking the server
+
+        Returns
+        -------
+        str
+            Path of the cached file, it must not be modified or removed by the caller
+        """
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        data_path = os.path.join(self.directory, key)
+        meta_path = data_path + '.json'
+        with self.__locked(data_path + '.lock'):
+            meta = self.__read_meta(meta_path) if os.path.exists(data_path) else None
+            if meta is not None and not revalidate:
+                self.__count(hits=1)
+                return self.__touch(data_path)
+
+            headers = dict()
+            if meta is not None:
+                if meta.get('etag'):
+                    headers['If-None-Match'] = meta['etag']
+                if meta.get('last_modified'):
+                    headers['If-Modified-Since'] = meta['last_modified']
+            try:
+                # One request: a changed product is streamed into the cache by the answer to the revalidation
+                result = downloader.download(url, data_path, http_session, headers=headers, **self.download_options)
+            except downloader.DownloadError as ex:
+                if meta is None:
+                    raise
+                print(f"Warning: revalidating {url} failed ({ex}), serving the cached copy")
+                self.__count(hits=1, stale=1)
+                return self.__touch(data_path)
+            if not result.modified:
+                self.__count(hits=1, revalidated=1)
+                return self.__touch(data_path)
+            self.__write_atomically(meta_path, [json.dumps({
+                'url': url,
+                'etag': result.etag,
+                'last_modified': result.last_modified,
+                'size': result.size,
+            }).encode('utf-8')])
+            self.__count(misses=1, bytes_downloaded=result.size)
+        self.evict(keep=data_path)
+        return data_path
+
+    def evict(self, keep: str = None) -> int:
+        """
+        Removing the least recently used files until the cache fits into max_bytes
+
+        Parameters
+        ----------
+        keep : str, optional
+            Path of a cached file that must not be evicted (the one just downloaded)
+
+        Returns
+        -------
+        int
+            Number of evicted files
+        """
+        evicted = 0
+        with self.__locked(os.path.join(self.directory, '.evict.lock')):
+            entries = list()
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if '.' in name or path == keep or not os.path.isfile(path):
+                    continue
+                info = os.stat(path)
+                entries.append((info.st_mtime, info.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            if keep is not None and os.path.exists(keep):
+                total += os.path.getsize(keep)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                with self.__locked(path + '.lock'):
+                    for file in (path, path + '.json'):
+                        if os.path.exists(file):
+                            os.remove(file)
+                total -= size
+                evicted += 1
+        self.__count(evictions=evicted)
+        return evicted
+
+    def __count(self, **counters) -> None:
+        with self.__stats_lock:
+            for name, value in counters.items():
+                setattr(self.stats, name, getattr(self.stats, name) + value)
+                metrics.count(f'product_cache_{name}', value)
+
+    @staticmethod
+    def __touch(path: str) -> str:
+        # The modification time of a data file is its last use for the LRU eviction
+        now = time.time()
+        os.utime(path, (now, now))
+        return path
+
+    @staticmethod
+    def __read_meta(path: str) -> dict:
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def __write_atomically(self, path: str, chunks) -> int:
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp.')
+        try:
+            with os.fdopen(fd, 'wb') as out_file:
+                for chunk in chunks:
+                    out_file.write(chunk)
+                    size += len(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return size
+
+    @staticmethod
+    @contextmanager
+    def __locked(path: str):
+        with open(path, 'a+b') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            else:
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                else:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,222 @@
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import Callable, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import gnsscal
+import numpy as np
+
+import metrics
+from common import spawn_context
+from station_batch import StationBatch
+
+IGS_URL = "https://cddis.nasa.gov/archive/gnss/products/{week}/igs{yy}P{week}{dow}.snx.Z"
+PRIORITY = 'priority'
+SIGMA = 'sigma'
+MERGE_RULES = (PRIORITY, SIGMA)
+SECTION_PREFIX = 'Product '  # configuration sections [Product <name>]
+
+
+class Product(NamedTuple):
+    """
+    A SINEX product of an analysis centre
+
+    url is a template filled with the day: {week} and {dow} (GPS week and day of the week), {yyyy}, {yy}
+    and {doy}. The merge prefers the products with the lower priority.
+    """
+    name: str
+    url: str
+    priority: int = 0
+
+    def url_for(self, day: datetime) -> str:
+        week, dow = gnsscal.date2gpswd(day.date())
+        return self.url.format(week=week, dow=dow, yyyy=f"{day:%Y}", yy=f"{day:%y}", doy=f"{day:%j}")
+
+
+IGS = Product('igs', IGS_URL)
+
+
+class ProductResult(NamedTuple):
+    """
+    Outcome of downloading and parsing one product
+    """
+    product: Product
+    batch: Optional[StationBatch] = None
+    error: str = ''
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.batch is not None
+
+
+def from_config(config) -> list:
+    """
+    Products of the [Product <name>] sections of a configuration
+
+    Parameters
+    ----------
+    config : configparser.ConfigParser
+        Configuration with sections such as
+        [Product cod]
+        url = https://.../COD0OPSFIN_{yyyy}{doy}0000_01D_01D_SOL.SNX.gz
+        priority = 1
+
+    Returns
+    -------
+    list
+        Products by increasing priority, the IGS product alone if no section is configured
+    """
+    result = [Product(section[len(SECTION_PREFIX):].strip(), config.get(section, 'url'),
+                      config.getint(section, 'priority', fallback=0))
+              for section in config.sections() if section.startswith(SECTION_PREFIX)]
+    return sorted(result, key=lambda product: product.priority) or [IGS]
+
+
+def merge(solutions: Iterable[Tuple[Product, StationBatch]], rule: str = PRIORITY) -> StationBatch:
+    """
+    One estimate per station out of the solutions of several products
+
+    With the 'priority' rule a station comes from the product of the lowest priority having it,
+    with the 'sigma' rule from the product with the smallest standard deviation of the position
+    (sqrt(sx^2 + sy^2 + sz^2)); estimates without standard deviations lose, ties go by priority.
+
+    Parameters
+    ----------
+    solutions : iterable of (Product, StationBatch)
+        Solutions of the products, moved to the same epoch
+    rule : str
+        'priority' or 'sigma'
+
+    Returns
+    -------
+    StationBatch
+        A new batch, the stations of the preferred product first, with the name of their product in products
+    """
+    if rule not in MERGE_RULES:
+        raise ValueError(f"Unknown merge rule {rule!r}, expected one of {', '.join(MERGE_RULES)}")
+    solutions = sorted(solutions, key=lambda item: item[0].priority)
+    batch = StationBatch.concatenate(solution for _, solution in solutions)
+    if not len(batch):
+        return batch
+    batch.products[:] = np.repeat([product.name for product, _ in solutions],
+                                  [len(solution) for _, solution in solutions])
+    rank = np.arange(len(batch))
+    if rule == SIGMA:
+        sigma = np.sqrt(np.sum(batch.sigmas ** 2, axis=1))
+        sigma[np.isnan(sigma)] = np.inf
+        order = np.lexsort((rank, sigma, batch.names))
+    else:
+        order = np.lexsort((rank, batch.names))
+    # The first row of every name in the sorted order is the preferred estimate of the station
+    names = batch.names[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = names[1:] != names[:-1]
+    return batch[np.sort(order[first])]
+
+
+def run(products: Sequence[Product], day: datetime, fetch: Callable, process: Callable,
+        parse_workers: int = None) -> List[ProductResult]:
+    """
+    Downloading and parsing the products of a day concurrently
+
+    fetch runs in one thread per product and process in a process pool as soon as its download is over,
+    so the wall time is close to the one of the slowest product rather than the sum.
+    A failure only fails its own product. A single product is processed in the calling thread.
+    The process pool is kept between the calls, the spans and counters of the workers are added
+    to the metrics of this process.
+
+    Parameters
+    ----------
+    products : sequence of Product
+        Products to process
+    day : datetime
+        Day of the products
+    fetch : callable
+        fetch(product, day) -> tuple of arguments for process, I/O bound (download)
+    process : callable
+        process(*fetched) -> StationBatch, CPU bound, must be picklable (a module-level function)
+    parse_workers : int, optional
+        Number of processes for process, os.cpu_count() by default; only the first call starts the pool
+
+    Returns
+    -------
+    list
+        ProductResult for each product, in the order of products
+    """
+    start = time.perf_counter()
+    if len(products) == 1:
+        product = products[0]
+        try:
+            return [ProductResult(product, process(*fetch(product, day)), elapsed=time.perf_counter() - start)]
+        except Exception as ex:
+            return [ProductResult(product, error=repr(ex), elapsed=time.perf_counter() - start)]
+
+    results = dict()
+    processes = _process_pool(parse_workers or os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=len(products)) as threads:
+        fetching = {threads.submit(fetch, product, day): product for product in products}
+        processing = dict()
+        while fetching or processing:
+            done, _ = wait(list(fetching) + list(processing), return_when=FIRST_COMPLETED)
+            for future in done:
+                batch, error = None, future.exception()
+                if future in fetching:
+                    product = fetching.pop(future)
+                    if error is None:
+                        try:
+                            processing[processes.submit(_process_collecting, process, *future.result())] = product
+                            continue
+                        except BrokenProcessPool as ex:
+                            error = ex
+                else:
+                    product = processing.pop(future)
+                    if error is None:
+                        batch, error, collected = future.result()
+                        metrics.merge(collected)
+                if isinstance(error, BrokenProcessPool):
+                    _discard_pool(processes)
+                results[product] = ProductResult(product, batch, '' if error is None else repr(error),
+                                                 time.perf_counter() - start)
+    return [results[product] for product in products]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _process_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    The parse workers, started by the first call and kept for the life of the process
+
+    Later calls (every day of a run, every group of the daemon) reuse the started workers and their imports,
+    workers is only used by the first call.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=spawn_context())
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    # A worker died (killed, out of memory): the next call starts a new pool
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def _process_collecting(process: Callable, *args) -> tuple:
+    """
+    Running process in a worker, the spans and counters recorded meanwhile are returned to the parent
+    """
+    with metrics.collect() as collected:
+        try:
+            return process(*args), None, collected
+        except Exception as ex:
+            return None, ex, collected
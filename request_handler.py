@@ -1,7 +1,28 @@
+import os
+import re
+import tempfile
 import requestsdb
 import datetime
-from dataclasses import dataclass
-from typing import Type
+import metrics
+import numpy as np
+from mysql.connector import Error
+from dataclasses import dataclass, field
+from station_batch import StationBatch
+from typing import Iterable, Iterator, NamedTuple, Optional, Type, Union
+
+STATION_TB_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+STATION_TB_INSERT_COLUMNS = ("station_id", "user_id", "station_config_id", "latitude", "longitude", "download",
+                             "masterClockPriority", "dataRate", "daily_download_site_id", "backup_download_site_id",
+                             "rinexFileRate", "x", "y", "z", "vx", "vy", "vz", "date", "available", "precise",
+                             "forceC1", "public", "satelliteSystem", "oceanLoadingData", "AntDome", "AntType",
+                             "OffsetNorth", "OffsetEast", "OffsetUp", "validFrom", "validUntil", "product")
+STATION_TB_UPDATE_COLUMNS = ("latitude", "longitude", "x", "y", "z", "vx", "vy", "vz", "date", "validFrom",
+                             "product")
+STATION_TB_SNAPSHOT_COLUMNS = ("station_id", "x", "y", "z", "vx", "vy", "vz", "date", "product")
+VELOCITY_TOLERANCE = 1e-5  # m/year, largest change of a velocity component that is not written
+COLUMN_NAME_PATTERN = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+STATION_STAGING_TB = "odtssw_paf.station_staging_tb"  # temporary table of bulk_load_station_data
+SCENARIO_TB_EPOCH_INDEX = 4  # calculation epoch in the records of SELECT * FROM scenario_tb
 
 
 @dataclass
@@ -10,13 +31,148 @@ class Coordinates:
     A class for representing station coordinates
     """
     name: str = str()
-    dt: datetime = datetime.datetime.now()
+    dt: datetime = field(default_factory=datetime.datetime.now)
     x: float = 0.0
     y: float = 0.0
     z: float = 0.0
+    vx: float = 0.0
+    vy: float = 0.0
+    vz: float = 0.0
     latitude: float = 0.0
     longitude: float = 0.0
     height: float = 0.0
+    product: str = str()
+
+
+class UpsertResult(NamedTuple):
+    """
+    Number of station_tb records written by RequestHandler.upsert_station_data
+    """
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+
+
+class StationSnapshot(NamedTuple):
+    """
+    Stored coordinates, epoch, source product and velocities (None if NULL) of a station_tb record
+    """
+    x: float
+    y: float
+    z: float
+    date: datetime.datetime
+    product: str = str()
+    vx: float = None
+    vy: float = None
+    vz: float = None
+
+
+def is_station_changed(data: Coordinates, stored: StationSnapshot, position_tolerance: float,
+                       epoch_tolerance: Optional[datetime.timedelta] = None) -> bool:
+    """
+    Checking whether new station data differs from the stored record beyond the tolerances, by its product
+    or by its velocities (beyond VELOCITY_TOLERANCE, a NULL velocity is always written)
+
+    Parameters
+    ----------
+    data : Coordinates
+        New station data
+    stored : StationSnapshot
+        Stored record, None if the station is not in station_tb
+    position_tolerance : float
+        Largest distance in meters between the new and the stored position considered unchanged
+    epoch_tolerance : timedelta, optional
+        Largest difference between the new and the stored epoch considered unchanged. None compares only
+        the positions: a station moved to a new calculation epoch is rewritten once it moved by more than
+        position_tolerance, not at every epoch
+
+    Returns
+    -------
+    bool
+        True if the station must be written
+    """
+    if stored is None or stored.date is None:
+        return True
+    if data.product != stored.product:
+        return True
+    for new, old in ((data.vx, stored.vx), (data.vy, stored.vy), (data.vz, stored.vz)):
+        if old is None or not abs(new - old) <= VELOCITY_TOLERANCE:
+            return True
+    if epoch_tolerance is not None and abs(data.dt - stored.date) > epoch_tolerance:
+        return True
+    dx = data.x - stored.x
+    dy = data.y - stored.y
+    dz = data.z - stored.z
+    return dx * dx + dy * dy + dz * dz > position_tolerance * position_tolerance
+
+
+def station_changed_mask(batch: StationBatch, snapshot: dict, position_tolerance: float,
+                         epoch_tolerance: Optional[datetime.timedelta] = None) -> np.ndarray:
+    """
+    Vectorized is_station_changed for all the stations of a batch
+
+    Parameters
+    ----------
+    batch : StationBatch
+        New station data
+    snapshot : dict
+        StationSnapshot by station_id (see RequestHandler.load_station_snapshot)
+    position_tolerance : float
+        Largest distance in meters between the new and the stored position considered unchanged
+    epoch_tolerance : timedelta, optional
+        Largest difference between the new and the stored epoch considered unchanged, None to compare
+        only the positions
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean mask of the stations that must be written
+    """
+    stored = [snapshot.get(name) for name in batch.names.tolist()]
+    known = np.array([record is not None and record.date is not None for record in stored], dtype=bool)
+    stored_xyz = np.array([(record.x, record.y, record.z) if ok else (np.nan, np.nan, np.nan)
+                           for record, ok in zip(stored, known)], dtype=np.float64).reshape(-1, 3)
+    moved = np.sum((batch.xyz - stored_xyz) ** 2, axis=1) > position_tolerance * position_tolerance
+    # NULL velocities become NaN, never within the tolerance
+    stored_velocities = np.array([(record.vx, record.vy, record.vz) if ok else (None, None, None)
+                                  for record, ok in zip(stored, known)], dtype=np.float64).reshape(-1, 3)
+    moved |= ~np.all(np.abs(batch.velocities - stored_velocities) <= VELOCITY_TOLERANCE, axis=1)
+    if epoch_tolerance is not None:
+        stored_epochs = np.array([record.date if ok else None for record, ok in zip(stored, known)],
+                                 dtype='datetime64[s]')
+        moved |= np.abs(batch.epochs - stored_epochs) > np.timedelta64(epoch_tolerance)
+    stored_products = np.array([record.product if ok else '' for record, ok in zip(stored, known)],
+                               dtype=batch.products.dtype)
+    return ~known | moved | (batch.products != stored_products)
+
+
+def column_list(columns: Union[str, Iterable[str]]) -> str:
+    """
+    Comma-separated column names for a query, checked to be plain identifiers
+
+    Raises
+    ------
+    ValueError
+        If a column is not a plain column name or no column is given
+    """
+    columns = [columns] if isinstance(columns, str) else list(columns)
+    for column in columns:
+        if COLUMN_NAME_PATTERN.fullmatch(column) is None:
+            raise ValueError(f"Invalid column name '{column}'")
+    if not columns:
+        raise ValueError("No column selected")
+    return ", ".join(columns)
+
+
+class ScenarioStationsDiff(NamedTuple):
+    """
+    Stations added to and removed from a scenario by RequestHandler.sync_scenario_stations
+
+    rolled_back is set when the transaction failed: nothing has been written, unlike an empty diff.
+    """
+    added: frozenset = frozenset()
+    removed: frozenset = frozenset()
+    rolled_back: bool = False
 
 
 class RequestHandler:
@@ -27,15 +183,47 @@ class RequestHandler:
     ----------
     connection : mysql.connector.connect
         Database connection object
+    batch_size : int
+        Number of stations per statement of upsert_station_data
+    bulk_load_threshold : int
+        Number of stations from which upsert_station_data uses bulk_load_station_data, None to never use it
+        (the connection must be opened with allow_local_infile=True)
 
     Methods
     -------
     getting_station_data(station_id, dt)
         Getting records from station_tb for a specific station ID and for a given date
+    upsert_station_data(batch, batch_size)
+        Inserting or updating station_tb records for a batch of stations in one transaction
+    upsert_changed_station_data(batch, snapshot, position_tolerance, epoch_tolerance)
+        Writing only the stations of a batch that differ from station_tb beyond the tolerances
+    sync_scenario_stations(scenario_id, stations)
+        Bringing the stations of a scenario in scenario_station_tb to the given set in one transaction
+    select_scenario_epochs(scenario_ids)
+        Getting the calculation epochs of several scenarios with one query
+    select_scenario_epochs_in_window(date_from, date_to)
+        Getting the scenarios whose calculation epoch is in a window
+    select_scenarios_after(watermark_column, watermark, limit)
+        Getting the scenarios past a high-water mark
+    iter_station_data(columns, station_ids, fetch_size)
+        Iterating over station_tb records in constant memory
+    bulk_load_station_data(batch)
+        Inserting or updating station_tb records through LOAD DATA LOCAL INFILE and a staging table
+    close()
+        Deallocating the prepared statements of the handler
     """
 
-    def __init__(self, connection):
+    def __init__(self, connection, batch_size: int = 500, bulk_load_threshold: int = None):
         self.connection = connection
+        self.batch_size = batch_size
+        self.bulk_load_threshold = bulk_load_threshold
+        self.statements = requestsdb.PreparedStatements(connection)
+
+    def close(self) -> None:
+        """
+        Deallocating the prepared statements of the handler
+        """
+        self.statements.close()
 
     # Section for working with the scenario_tb table
     def select_scenario_data(self, scenario_id: str) -> list:
@@ -52,13 +240,143 @@ class RequestHandler:
         list()
             A list of records from the database
         """
-        select_station_data_query = f"SELECT * " \
-                                    f"FROM odtssw_paf.scenario_tb " \
-                                    f"WHERE scenario_id='{scenario_id}'; "
-        return requestsdb.execute_read_query(self.connection, select_station_data_query)
+        select_station_data_query = "SELECT * " \
+                                    "FROM odtssw_paf.scenario_tb " \
+                                    "WHERE scenario_id=%s;"
+        return self.statements.read(select_station_data_query, (scenario_id,))
+
+    def select_scenario_epochs(self, scenario_ids: Iterable[str]) -> dict:
+        """
+        Getting the calculation epochs of several scenarios with one query
+
+        Parameters
+        ----------
+        scenario_ids : iterable of str
+            Scenario identifiers
+
+        Returns
+        -------
+        dict
+            Calculation epoch by scenario_id for the scenarios found with an epoch (a NULL epoch is left out
+            like a missing scenario), None if an error occurred
+        """
+        scenario_ids = sorted(set(scenario_ids))
+        if not scenario_ids:
+            return dict()
+        # scenario_tb.* keeps the column positions of SELECT * after the leading scenario_id
+        select_scenarios_query = f"SELECT scenario_id, scenario_tb.* " \
+                                 f"FROM odtssw_paf.scenario_tb " \
+                                 f"WHERE scenario_id IN ({', '.join(['%s'] * len(scenario_ids))});"
+        selected = self.statements.read(select_scenarios_query, tuple(scenario_ids))
+        if selected is None:
+            return None
+        return {str(record[0]): record[1 + SCENARIO_TB_EPOCH_INDEX] for record in selected
+                if record[1 + SCENARIO_TB_EPOCH_INDEX] is not None}
+
+    def select_scenario_epochs_in_window(self, epoch_column: str, date_from: datetime.datetime,
+                                         date_to: datetime.datetime) -> dict:
+        """
+        Getting the scenarios whose calculation epoch is in a window
+
+        The window is applied by the database on `epoch_column`, so an index on the column is used instead of
+        reading the whole scenario_tb.
+
+        Parameters
+        ----------
+        epoch_column : str
+            Column of scenario_tb holding the calculation epoch
+        date_from : datetime
+            Start of the window (included)
+        date_to : datetime
+            End of the window (excluded)
+
+        Returns
+        -------
+        dict
+            Calculation epoch by scenario_id, None if an error occurred
+
+        Raises
+        ------
+        ValueError
+            If epoch_column is not a plain column name
+        """
+        column_list(epoch_column)
+        # Half-open like the days of the window: an epoch at midnight of date_to belongs to the next day
+        select_scenarios_query = f"SELECT scenario_id, {epoch_column} " \
+                                 f"FROM odtssw_paf.scenario_tb " \
+                                 f"WHERE {epoch_column} >= %s AND {epoch_column} < %s;"
+        selected = self.statements.read(select_scenarios_query, (date_from, date_to))
+        if selected is None:
+            return None
+        return {str(record[0]): record[1] for record in selected}
+
+    def select_scenarios_after(self, watermark_column: str, watermark=None, limit: int = 100) -> list:
+        """
+        Getting the scenarios past a high-water mark, in the order of an indexed column
+
+        The scenarios are paged on the compound key (watermark_column, scenario_id): the column alone
+        may hold one value for more scenarios than limit, the rest would be skipped once the watermark
+        reached that value.
+
+        Parameters
+        ----------
+        watermark_column : str
+            Column of scenario_tb increasing with new or changed scenarios (scenario_id, a modification time...)
+        watermark : tuple, optional
+            (value of the column, scenario_id) of the last scenario processed, all the scenarios if None;
+            a single value (watermark of an older version) selects the scenarios with a larger value
+        limit : int
+            Maximum number of scenarios returned
+
+        Returns
+        -------
+        list
+            ((value of the column, scenario_id), scenario_id, calculation epoch) in ascending watermark order,
+            the epoch is None for a scenario without one; None if an error occurred
+
+        Raises
+        ------
+        ValueError
+            If watermark_column is not a plain column name
+        """
+        column_list(watermark_column)
+        if watermark is None:
+            where, params = "", ()
+        elif isinstance(watermark, (tuple, list)):
+            where, params = f"WHERE ({watermark_column}, scenario_id) > (%s, %s) ", tuple(watermark)
+        else:
+            where, params = f"WHERE {watermark_column} > %s ", (watermark,)
+        select_scenarios_query = f"SELECT {watermark_column}, scenario_id, scenario_tb.* " \
+                                 f"FROM odtssw_paf.scenario_tb " \
+                                 f"{where}" \
+                                 f"ORDER BY {watermark_column}, scenario_id " \
+                                 f"LIMIT %s;"
+        selected = self.statements.read(select_scenarios_query, params + (int(limit),))
+        if selected is None:
+            return None
+        return [((record[0], record[1]), str(record[1]), record[2 + SCENARIO_TB_EPOCH_INDEX]) for record in selected]
+
+    def select_scenario_watermark(self, watermark_column: str):
+        """
+        Getting the current high-water mark of scenario_tb, the watermark of its last scenario
+
+        Parameters
+        ----------
+        watermark_column : str
+            Column of scenario_tb increasing with new or changed scenarios
+
+        Returns
+        -------
+        tuple
+            Largest (value of the column, scenario_id), None if the table is empty or an error occurred
+        """
+        column_list(watermark_column)
+        selected = self.statements.read(f"SELECT {watermark_column}, scenario_id FROM odtssw_paf.scenario_tb "
+                                        f"ORDER BY {watermark_column} DESC, scenario_id DESC LIMIT 1;")
+        return tuple(selected[0]) if selected else None
 
     # Section for working with the station_tb table
-    def select_station_data(self, station_id: str) -> list:
+    def select_station_data(self, station_id: str, columns: Iterable[str] = None) -> list:
         """
         Getting records from station_tb for a specific station ID and for a given date
         
@@ -66,16 +384,57 @@ class RequestHandler:
         ----------
         station_id : str
             Station identifier (station name)
+        columns : iterable of str, optional
+            Columns to select, all of them if None
 
         Returns
         -------
         list()
             A list of records from the database
         """
-        select_station_data_query = f"SELECT * " \
+        select_station_data_query = f"SELECT {'*' if columns is None else column_list(columns)} " \
                                     f"FROM odtssw_paf.station_tb " \
-                                    f"WHERE station_id='{station_id}'; "
-        return requestsdb.execute_read_query(self.connection, select_station_data_query)
+                                    f"WHERE station_id=%s;"
+        return self.statements.read(select_station_data_query, (station_id,))
+
+    def iter_station_data(self, columns: Iterable[str] = STATION_TB_SNAPSHOT_COLUMNS,
+                          station_ids: Iterable[str] = None, fetch_size: int = requestsdb.FETCH_SIZE) -> Iterator:
+        """
+        Iterating over station_tb records in constant memory (audits of the history, snapshot diffs)
+
+        The connection cannot run other queries of the handler until the iteration ends.
+
+        Parameters
+        ----------
+        columns : iterable of str
+            Columns to select, those of load_station_snapshot by default
+        station_ids : iterable of str, optional
+            Station identifiers (station names) to read, the whole table if None
+        fetch_size : int
+            Number of rows fetched per round-trip
+
+        Yields
+        ------
+        namedtuple
+            One record per row with the selected columns as fields, in station_id order
+
+        Raises
+        ------
+        Error
+            If the query fails, also in the middle of the iteration
+        """
+        params = ()
+        where = ""
+        if station_ids is not None:
+            params = tuple(sorted(set(station_ids)))
+            if not params:
+                return iter(())
+            where = f"WHERE station_id IN ({', '.join(['%s'] * len(params))}) "
+        select_station_data_query = f"SELECT {column_list(columns)} " \
+                                    f"FROM odtssw_paf.station_tb " \
+                                    f"{where}" \
+                                    f"ORDER BY station_id;"
+        return self.statements.stream(select_station_data_query, params, fetch_size)
 
     def insert_station_data(self, data: Type[Coordinates]) -> None:
         """
@@ -84,27 +443,13 @@ class RequestHandler:
         Parameters
         ----------
         data : Coordinates
-            Station data structure (name, datetime, x, y, z, latitude, longitude, height)
+            Station data structure (name, datetime, x, y, z, vx, vy, vz, latitude, longitude, height, product)
 
         Returns
         -------
         None
         """
-        valid_from = data.dt - datetime.timedelta(days=1)
-        dt_to_str = data.dt.strftime("%Y-%m-%d %H:%M:%S")
-        valid_dt_to_str = valid_from.strftime("%Y-%m-%d %H:%M:%S")
-        insert_station_data_query = f"INSERT INTO odtssw_paf.station_tb (station_id, user_id, station_config_id," \
-                                    f" latitude, longitude, download, masterClockPriority, dataRate," \
-                                    f" daily_download_site_id," \
-                                    f"backup_download_site_id, rinexFileRate, x, y, z, vx, vy, vz, date," \
-                                    f" available, precise, forceC1, public, satelliteSystem," \
-                                    f"oceanLoadingData, AntDome, AntType, OffsetNorth, OffsetEast," \
-                                    f" OffsetUp, validFrom, validUntil)" \
-                                    f"VALUES ('{data.name}', '1', '1', '{data.latitude}', '{data.longitude}'," \
-                                    f" '1', '0', '30', '31', '31', '', '{data.x}', '{data.y}', '{data.z}'," \
-                                    f"'0', '0', '0', '{dt_to_str}', '1', '0', '0', '0', 'GRE', '', '', ''," \
-                                    f" '0', '0', '0', '{valid_dt_to_str}', '2030-01-01 00:00:00');"
-        requestsdb.execute_write_query(self.connection, insert_station_data_query)
+        self.statements.write(self.__station_insert_query(1), self.__station_insert_row(data))
 
     def delete_station_data(self) -> None:
         """
@@ -117,13 +462,13 @@ class RequestHandler:
         -------
         None
         """
-        set_sql_safe_upd = f"SET SQL_SAFE_UPDATES = 0;"
-        requestsdb.execute_write_query(self.connection, set_sql_safe_upd)
-        set_foreign_key_check = f"SET FOREIGN_KEY_CHECKS = 0;"
-        requestsdb.execute_write_query(self.connection, set_foreign_key_check)
+        set_sql_safe_upd = "SET SQL_SAFE_UPDATES = 0;"
+        self.statements.write(set_sql_safe_upd)
+        set_foreign_key_check = "SET FOREIGN_KEY_CHECKS = 0;"
+        self.statements.write(set_foreign_key_check)
 
-        delete_stations_query = f"DELETE FROM odtssw_paf.station_tb;"
-        requestsdb.execute_write_query(self.connection, delete_stations_query)
+        delete_stations_query = "DELETE FROM odtssw_paf.station_tb;"
+        self.statements.write(delete_stations_query)
 
     def update_station_data(self, station_id: str, data: Type[Coordinates]) -> None:
         """
@@ -136,21 +481,255 @@ class RequestHandler:
         dt: datetime
             The epoch for which the data needs to be updated
         data : Coordinates
-            Station data structure (name, datetime, x, y, z, latitude, longitude, height)
+            Station data structure (name, datetime, x, y, z, vx, vy, vz, latitude, longitude, height, product)
 
         Returns
         -------
         None
         """
+        update_station_data_query = "UPDATE odtssw_paf.station_tb " \
+                                    "SET latitude=%s, longitude=%s, x=%s, y=%s, z=%s, vx=%s, vy=%s, vz=%s, " \
+                                    "date=%s, validFrom=%s, product=%s " \
+                                    "WHERE station_id=%s;"
+        row = self.__station_update_row(data)
+        self.statements.write(update_station_data_query, row[1:] + (station_id,))
+
+    def load_station_snapshot(self, station_ids: Iterable[str]) -> dict:
+        """
+        Getting the stored coordinates, epochs, products and velocities of the given stations with one query
+
+        The rows are streamed (iter_station_data), only the snapshot is kept in memory.
+
+        Parameters
+        ----------
+        station_ids : iterable of str
+            Station identifiers (station names)
+
+        Returns
+        -------
+        dict
+            StationSnapshot by station_id for the stations present in station_tb, None if an error occurred
+        """
+        snapshot = dict()
+        try:
+            for station_id, x, y, z, vx, vy, vz, date, product in self.iter_station_data(station_ids=station_ids):
+                if isinstance(date, str):
+                    date = datetime.datetime.strptime(date, STATION_TB_DATETIME_FORMAT)
+                velocities = (None if value is None else float(value) for value in (vx, vy, vz))
+                snapshot[station_id] = StationSnapshot(float(x), float(y), float(z), date, product or '', *velocities)
+        except Error:
+            # Printed by iter_read_query
+            return None
+        return snapshot
+
+    def upsert_changed_station_data(self, batch: Union[StationBatch, Iterable[Coordinates]], snapshot: dict = None,
+                                    position_tolerance: float = 0.001,
+                                    epoch_tolerance: Optional[datetime.timedelta] = None,
+                                    batch_size: int = None) -> UpsertResult:
+        """
+        Writing only the stations whose position or epoch changed beyond the tolerances
+
+        Parameters
+        ----------
+        batch : StationBatch or iterable of Coordinates
+            Station data structures (name, datetime, x, y, z, vx, vy, vz, latitude, longitude, height, product)
+        snapshot : dict, optional
+            Result of load_station_snapshot covering the batch, loaded with one query if not given
+        position_tolerance : float
+            Largest change of the position in meters that is not written
+        epoch_tolerance : timedelta, optional
+            Largest change of the epoch that is not written, None to compare only the positions
+        batch_size : int, optional
+            Number of stations per statement, self.batch_size by default
+
+        Returns
+        -------
+        UpsertResult
+            Number of inserted, updated and unchanged (skipped) stations
+        """
+        if not isinstance(batch, StationBatch):
+            batch = list(batch)
+        if snapshot is None:
+            snapshot = self.load_station_snapshot(batch.names.tolist() if isinstance(batch, StationBatch)
+                                                  else [data.name for data in batch])
+            if snapshot is None:
+                return UpsertResult()
+        if isinstance(batch, StationBatch):
+            changed = batch[station_changed_mask(batch, snapshot, position_tolerance, epoch_tolerance)]
+        else:
+            changed = [data for data in batch
+                       if is_station_changed(data, snapshot.get(data.name), position_tolerance, epoch_tolerance)]
+        result = self.upsert_station_data(changed, batch_size, known_station_ids=snapshot.keys())
+        if result.inserted + result.updated < len(changed):
+            return result
+        metrics.count('rows_unchanged', len(batch) - len(changed))
+        return result._replace(unchanged=len(batch) - len(changed))
+
+    def upsert_station_data(self, batch: Union[StationBatch, Iterable[Coordinates]], batch_size: int = None,
+                            known_station_ids: set = None) -> UpsertResult:
+        """
+        Inserting or updating station_tb records for a batch of stations
+
+        Works as insert_station_data/update_station_data for each station, but every chunk of
+        batch_size stations costs one SELECT, one multi-row INSERT and one UPDATE, all of them
+        prepared statements reused by chunks of the same size, and the whole batch is committed once.
+        Batches of at least bulk_load_threshold stations are written by bulk_load_station_data.
+
+        Parameters
+        ----------
+        batch : StationBatch or iterable of Coordinates
+            Station data structures (name, datetime, x, y, z, vx, vy, vz, latitude, longitude, height, product),
+            the chunks of a StationBatch are slices of its arrays
+        batch_size : int, optional
+            Number of stations per statement, self.batch_size by default
+        known_station_ids : set, optional
+            Station IDs known to be in station_tb (the keys of load_station_snapshot), the per-chunk SELECT
+            is skipped if given
+
+        Returns
+        -------
+        UpsertResult
+            Number of inserted and updated stations, zeros if the transaction has been rolled back
+        """
+        if not isinstance(batch, StationBatch):
+            batch = list(batch)
+        if self.bulk_load_threshold and len(batch) >= self.bulk_load_threshold:
+            return self.bulk_load_station_data(batch)
+        batch_size = batch_size or self.batch_size
+        if known_station_ids is not None:
+            known_station_ids = set(known_station_ids)
+        inserted = 0
+        updated = 0
+        try:
+            with self.statements.transaction():
+                for start in range(0, len(batch), batch_size):
+                    chunk = batch[start:start + batch_size]
+                    if known_station_ids is not None:
+                        existing = known_station_ids
+                    else:
+                        select_existing_query = f"SELECT DISTINCT station_id " \
+                                                f"FROM odtssw_paf.station_tb " \
+                                                f"WHERE station_id IN ({', '.join(['%s'] * len(chunk))});"
+                        existing = {record[0] for record in
+                                    self.statements.read(select_existing_query, tuple(data.name for data in chunk))}
+                    insert_rows = list()
+                    update_rows = list()
+                    for data in chunk:
+                        if data.name in existing:
+                            update_rows.append(self.__station_update_row(data))
+                        else:
+                            insert_rows.append(self.__station_insert_row(data))
+                            existing.add(data.name)
+                    if insert_rows:
+                        self.statements.write(self.__station_insert_query(len(insert_rows)),
+                                              tuple(value for row in insert_rows for value in row))
+                    if update_rows:
+                        self.statements.write(*self.__station_update_statement(update_rows))
+                    inserted += len(insert_rows)
+                    updated += len(update_rows)
+        except Error as e:
+            print(f"The error '{e}' occurred, the transaction has been rolled back")
+            return UpsertResult()
+        print("Transaction executed successfully")
+        metrics.count('rows_inserted', inserted)
+        metrics.count('rows_updated', updated)
+        return UpsertResult(inserted=inserted, updated=updated)
+
+    def bulk_load_station_data(self, batch: Union[StationBatch, Iterable[Coordinates]],
+                               directory: str = None) -> UpsertResult:
+        """
+        Inserting or updating station_tb records for a large batch of stations
+
+        The batch is written to a temporary tab-separated file in the column order of the INSERT, sent with
+        LOAD DATA LOCAL INFILE into a temporary staging table and merged into station_tb by one UPDATE
+        joined with the staging table and one INSERT ... SELECT of the stations not in station_tb,
+        all in one transaction. The cost does not depend on the number of stations in round-trips,
+        but the connection must be opened with allow_local_infile=True.
+
+        Parameters
+        ----------
+        batch : StationBatch or iterable of Coordinates
+            Station data structures (name, datetime, x, y, z, vx, vy, vz, latitude, longitude, height, product),
+            the last one is written for a station given several times
+        directory : str, optional
+            Directory of the temporary file, the system temporary directory by default
+
+        Returns
+        -------
+        UpsertResult
+            Number of inserted and updated stations, zeros if the transaction has been rolled back
+        """
+        rows = {data.name: self.__station_insert_row(data) for data in batch}
+        if not rows:
+            return UpsertResult()
+        fd, tmp_path = tempfile.mkstemp(suffix='.tsv', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', newline='\n') as f:
+                f.writelines("\t".join(map(str, row)) + "\n" for row in rows.values())
+            columns = ", ".join(STATION_TB_INSERT_COLUMNS)
+            path = tmp_path.replace("\\", "\\\\").replace("'", "\\'")
+            assignments = ", ".join(f"s.{column}=t.{column}" for column in STATION_TB_UPDATE_COLUMNS)
+            with self.statements.transaction():
+                self.statements.execute(f"CREATE TEMPORARY TABLE IF NOT EXISTS {STATION_STAGING_TB} "
+                                        f"LIKE odtssw_paf.station_tb;")
+                self.statements.execute(f"DELETE FROM {STATION_STAGING_TB};")
+                self.statements.execute(f"LOAD DATA LOCAL INFILE '{path}' INTO TABLE {STATION_STAGING_TB} "
+                                        f"CHARACTER SET utf8mb4 FIELDS TERMINATED BY '\\t' "
+                                        f"LINES TERMINATED BY '\\n' ({columns});")
+                self.statements.execute(f"UPDATE odtssw_paf.station_tb AS s "
+                                        f"JOIN {STATION_STAGING_TB} AS t ON s.station_id = t.station_id "
+                                        f"SET {assignments};")
+                inserted = self.statements.execute(f"INSERT INTO odtssw_paf.station_tb ({columns}) "
+                                                   f"SELECT {columns} FROM {STATION_STAGING_TB} AS t "
+                                                   f"WHERE NOT EXISTS (SELECT 1 FROM odtssw_paf.station_tb AS s "
+                                                   f"WHERE s.station_id = t.station_id);")
+        except Error as e:
+            print(f"The error '{e}' occurred, the transaction has been rolled back")
+            return UpsertResult()
+        finally:
+            os.remove(tmp_path)
+        print("Transaction executed successfully")
+        # The UPDATE only counts the rows it changed, every staged station not inserted has been matched
+        updated = len(rows) - inserted
+        metrics.count('rows_inserted', inserted)
+        metrics.count('rows_updated', updated)
+        metrics.count('rows_bulk_loaded', len(rows))
+        return UpsertResult(inserted=inserted, updated=updated)
+
+    @staticmethod
+    def __station_insert_query(count: int) -> str:
+        values = "(" + ", ".join(["%s"] * len(STATION_TB_INSERT_COLUMNS)) + ")"
+        return f"INSERT INTO odtssw_paf.station_tb ({', '.join(STATION_TB_INSERT_COLUMNS)}) " \
+               f"VALUES {', '.join([values] * count)};"
+
+    @staticmethod
+    def __station_insert_row(data: Coordinates) -> tuple:
+        valid_from = data.dt - datetime.timedelta(days=1)
+        return (data.name, 1, 1, data.latitude, data.longitude, 1, 0, 30, 31, 31, '', data.x, data.y, data.z,
+                data.vx, data.vy, data.vz, data.dt.strftime(STATION_TB_DATETIME_FORMAT), 1, 0, 0, 0, 'GRE', '', '',
+                '', 0, 0, 0, valid_from.strftime(STATION_TB_DATETIME_FORMAT), '2030-01-01 00:00:00', data.product)
+
+    @staticmethod
+    def __station_update_row(data: Coordinates) -> tuple:
         valid_from = data.dt - datetime.timedelta(days=1)
-        dt_to_str = data.dt.strftime("%Y-%m-%d %H:%M:%S")
-        valid_dt_to_str = valid_from.strftime("%Y-%m-%d %H:%M:%S")
+        return (data.name, data.latitude, data.longitude, data.x, data.y, data.z, data.vx, data.vy, data.vz,
+                data.dt.strftime(STATION_TB_DATETIME_FORMAT), valid_from.strftime(STATION_TB_DATETIME_FORMAT),
+                data.product)
+
+    @staticmethod
+    def __station_update_statement(rows: list) -> tuple:
+        # One UPDATE for the whole chunk: every column is picked per station_id with a CASE expression
+        when_then = " ".join(["WHEN %s THEN %s"] * len(rows))
+        assignments = ", ".join(f"{column}=CASE station_id {when_then} END" for column in STATION_TB_UPDATE_COLUMNS)
         update_station_data_query = f"UPDATE odtssw_paf.station_tb " \
-                                    f"SET latitude='{data.latitude}', longitude='{data.longitude}', " \
-                                    f"x='{data.x}', y='{data.y}', z='{data.z}',  date='{dt_to_str}', " \
-                                    f"validFrom='{valid_dt_to_str}'" \
-                                    f"WHERE station_id='{station_id}';"
-        requestsdb.execute_write_query(self.connection, update_station_data_query)
+                                    f"SET {assignments} " \
+                                    f"WHERE station_id IN ({', '.join(['%s'] * len(rows))});"
+        params = list()
+        for column in range(1, len(STATION_TB_UPDATE_COLUMNS) + 1):
+            for row in rows:
+                params += (row[0], row[column])
+        params += (row[0] for row in rows)
+        return update_station_data_query, tuple(params)
 
     # Section for working with the scenario_station_tb table
     def insert_station(self, scenario_id: str, station_id: str, user_id: int = 1, station_config_tb: int = 1) -> None:
@@ -172,10 +751,10 @@ class RequestHandler:
         -------
         None
         """
-        insert_station_query = f"INSERT INTO odtssw_paf.scenario_station_tb " \
-                               f"(scenario_id, station_id, user_id, station_config_id) " \
-                               f"VALUES ('{scenario_id}', '{station_id}', '{user_id}', '{station_config_tb}');"
-        requestsdb.execute_write_query(self.connection, insert_station_query)
+        insert_station_query = "INSERT INTO odtssw_paf.scenario_station_tb " \
+                               "(scenario_id, station_id, user_id, station_config_id) " \
+                               "VALUES (%s, %s, %s, %s);"
+        self.statements.write(insert_station_query, (scenario_id, station_id, user_id, station_config_tb))
 
     def delete_stations(self, scenario_id: int) -> None:
         """
@@ -190,10 +769,69 @@ class RequestHandler:
         -------
         None
         """
-        delete_stations_query = f"DELETE " \
-                                f"FROM odtssw_paf.scenario_station_tb " \
-                                f"WHERE scenario_id='{scenario_id}';"
-        requestsdb.execute_write_query(self.connection, delete_stations_query)
+        delete_stations_query = "DELETE " \
+                                "FROM odtssw_paf.scenario_station_tb " \
+                                "WHERE scenario_id=%s;"
+        self.statements.write(delete_stations_query, (scenario_id,))
+
+    def sync_scenario_stations(self, scenario_id: str, stations: Iterable[str], user_id: int = 1,
+                               station_config_tb: int = 1, batch_size: int = None) -> ScenarioStationsDiff:
+        """
+        Bringing the stations of a scenario to the given set
+
+        Unlike delete_stations followed by insert_station for each station, only the difference
+        is written, with batched statements in one transaction, so the scenario is never seen empty.
+
+        Parameters
+        ----------
+        scenario_id : str
+            Scenario ID whose stations are synchronized
+        stations : iterable of str
+            Station IDs (names of the stations) the scenario must contain
+        user_id : int
+            The user ID received during registration (see the user_tb table) for the added stations
+        station_config_tb : int
+            The ID of the config for determining system parameters (see the table station_config_tb)
+        batch_size : int, optional
+            Number of stations per statement, self.batch_size by default
+
+        Returns
+        -------
+        ScenarioStationsDiff
+            Added and removed stations, with rolled_back set if the transaction has been rolled back
+        """
+        stations = frozenset(stations)
+        batch_size = batch_size or self.batch_size
+        select_stations_query = "SELECT station_id " \
+                                "FROM odtssw_paf.scenario_station_tb " \
+                                "WHERE scenario_id=%s;"
+        try:
+            with self.statements.transaction():
+                current = frozenset(record[0] for record in
+                                    self.statements.read(select_stations_query, (scenario_id,)))
+                added = stations - current
+                removed = current - stations
+                removed_list = sorted(removed)
+                for start in range(0, len(removed_list), batch_size):
+                    chunk = removed_list[start:start + batch_size]
+                    placeholders = ", ".join(["%s"] * len(chunk))
+                    delete_stations_query = f"DELETE " \
+                                            f"FROM odtssw_paf.scenario_station_tb " \
+                                            f"WHERE scenario_id=%s AND station_id IN ({placeholders});"
+                    self.statements.write(delete_stations_query, (scenario_id, *chunk))
+                added_list = sorted(added)
+                for start in range(0, len(added_list), batch_size):
+                    chunk = added_list[start:start + batch_size]
+                    insert_station_query = f"INSERT INTO odtssw_paf.scenario_station_tb " \
+                                           f"(scenario_id, station_id, user_id, station_config_id) " \
+                                           f"VALUES {', '.join(['(%s, %s, %s, %s)'] * len(chunk))};"
+                    self.statements.write(insert_station_query,
+                                          tuple(value for station_id in chunk
+                                                for value in (scenario_id, station_id, user_id, station_config_tb)))
+        except Error as e:
+            print(f"The error '{e}' occurred, the transaction has been rolled back")
+            return ScenarioStationsDiff(rolled_back=True)
+        return ScenarioStationsDiff(added=added, removed=removed)
 
     # Section for working with the scenario_tb table
     def select_scenario(self, scenario_id: str) -> list:
@@ -210,7 +848,7 @@ class RequestHandler:
         list()
            A list of records from the database
         """
-        select_scenario_tb_query = f"SELECT * " \
-                                   f"FROM odtssw_paf.scenario_tb " \
-                                   f"WHERE scenario_id='{scenario_id}';"
-        return requestsdb.execute_read_query(self.connection, select_scenario_tb_query)
+        select_scenario_tb_query = "SELECT * " \
+                                   "FROM odtssw_paf.scenario_tb " \
+                                   "WHERE scenario_id=%s;"
+        return self.statements.read(select_scenario_tb_query, (scenario_id,))
@@ -1,7 +1,17 @@
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Iterator
+
 from mysql.connector import Error
 
+import metrics
+
+STATEMENT_CACHE_SIZE = 64
+FETCH_SIZE = 1000  # rows per fetchmany of iter_read_query
 
-def execute_read_query(connection, query: str) -> list:
+
+def execute_read_query(connection, query: str, params: tuple = None) -> list:
     """
     Getting records from a database
 
@@ -11,6 +21,8 @@ def execute_read_query(connection, query: str) -> list:
         Database connection object
     query : str
         Request to extract records from the database
+    params : tuple, optional
+        Values for the %s placeholders of the query
 
     Returns
     -------
@@ -20,11 +32,74 @@ def execute_read_query(connection, query: str) -> list:
     cursor = connection.cursor()
     result = None
     try:
-        cursor.execute(query)
-        result = cursor.fetchall()
+        with metrics.span('db_query', statement=statement_kind(query)):
+            cursor.execute(query, params)
+            result = cursor.fetchall()
+        metrics.count('db_round_trips')
         return result
     except Error as e:
         print(f"The error '{e}' occurred")
+    finally:
+        cursor.close()
+
+
+@lru_cache(maxsize=None)
+def record_type(columns: tuple) -> type:
+    """
+    Named tuple type of the records with the given column names, one type per distinct tuple of columns
+    """
+    return namedtuple('Record', columns, rename=True)
+
+
+def iter_read_query(connection, query: str, params: tuple = None, fetch_size: int = FETCH_SIZE) -> Iterator[tuple]:
+    """
+    Iterating over the records of a query without loading the whole result set
+
+    The rows are read from an unbuffered cursor by fetchmany batches of fetch_size, so a full-table read
+    holds at most one batch in memory. The connection cannot run other queries until the iteration ends,
+    leaving the loop early discards the rest of the result set.
+
+    Parameters
+    ----------
+    connection : mysql.connector.connect
+        Database connection object
+    query : str
+        Request to extract records from the database
+    params : tuple, optional
+        Values for the %s placeholders of the query
+    fetch_size : int
+        Number of rows per fetchmany
+
+    Yields
+    ------
+    namedtuple
+        One record per row, with the selected column names as fields
+
+    Raises
+    ------
+    Error
+        If the query fails, unlike execute_read_query an error is not hidden as an empty or partial result
+    """
+    cursor = connection.cursor(buffered=False)
+    try:
+        with metrics.span('db_query', statement=statement_kind(query)):
+            cursor.execute(query, params)
+        metrics.count('db_round_trips')
+        record = record_type(tuple(cursor.column_names))
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            metrics.count('db_rows_streamed', len(rows))
+            for row in rows:
+                yield record._make(row)
+    except Error as e:
+        print(f"The error '{e}' occurred")
+        raise
+    finally:
+        if getattr(connection, 'unread_result', False):
+            connection.consume_results()
+        cursor.close()
 
 
 def execute_write_query(connection, query: str) -> None:
@@ -44,8 +119,232 @@ def execute_write_query(connection, query: str) -> None:
     """
     cursor = connection.cursor()
     try:
-        cursor.execute(query)
-        connection.commit()
+        with metrics.span('db_query', statement=statement_kind(query)):
+            cursor.execute(query)
+            connection.commit()
+        metrics.count('db_round_trips', 2)
         print("Query executed successfully")
     except Error as e:
         print(f"The error '{e}' occurred")
+    finally:
+        cursor.close()
+
+
+def statement_kind(query: str) -> str:
+    """
+    First keyword of a query (SELECT, INSERT...), the label of its metrics
+    """
+    words = query.split(None, 1)
+    return words[0].upper() if words else ''
+
+
+class PreparedStatements:
+    """
+    Server-side prepared statements with bound parameters cached for one connection
+
+    Every distinct query text is prepared once and its cursor is reused for all later executions,
+    the least recently used statements are deallocated when the cache exceeds cache_size.
+    Outside of transaction() every write is committed and errors are printed as in execute_*_query,
+    inside of it nothing is committed until the block ends and errors are raised.
+
+    Attributes
+    ----------
+    connection : mysql.connector.connect
+        Database connection object
+    cache_size : int
+        Maximum number of prepared statements kept open
+
+    Methods
+    -------
+    read(query, params)
+        Getting records from a database
+    write(query, params)
+        Inserting/updating records in the database
+    write_many(query, rows)
+        Executing a write statement for each tuple of rows
+    execute(query)
+        Executing a statement that cannot be prepared
+    stream(query, params, fetch_size)
+        Iterating over the records of a query without loading the whole result set
+    transaction()
+        Context manager grouping statements into one transaction
+    close()
+        Deallocating all prepared statements
+    """
+
+    def __init__(self, connection, cache_size: int = STATEMENT_CACHE_SIZE):
+        self.connection = connection
+        self.cache_size = cache_size
+        self.in_transaction = False
+        self.__cursors = OrderedDict()  # (query, cursor) by query text
+
+    def cursor(self, query: str) -> tuple:
+        """
+        Getting the prepared cursor for the query, preparing it on first use
+
+        MySQLCursorPrepared.execute prepares the statement again unless it gets the very string object
+        it executed last (an identity check), so the query object stored with the cursor is returned too
+        and must be the one executed: queries built at runtime are equal but distinct objects on every call.
+
+        Parameters
+        ----------
+        query : str
+            Query with %s placeholders
+
+        Returns
+        -------
+        tuple
+            The stored query string and the mysql.connector.cursor.MySQLCursorPrepared holding the statement
+        """
+        entry = self.__cursors.get(query)
+        if entry is not None:
+            self.__cursors.move_to_end(query)
+            return entry
+        entry = (query, self.connection.cursor(prepared=True))
+        self.__cursors[query] = entry
+        if len(self.__cursors) > self.cache_size:
+            _, (_, evicted) = self.__cursors.popitem(last=False)
+            evicted.close()
+        return entry
+
+    def read(self, query: str, params: tuple = ()) -> list:
+        """
+        Getting records from a database
+
+        Parameters
+        ----------
+        query : str
+            Request to extract records from the database with %s placeholders
+        params : tuple
+            Values bound to the placeholders
+
+        Returns
+        -------
+        result : list
+            tuple of records, None if an error occurred outside of a transaction
+        """
+        try:
+            query, cursor = self.cursor(query)
+            with metrics.span('db_query', statement=statement_kind(query)):
+                cursor.execute(query, params)
+                result = cursor.fetchall()
+            metrics.count('db_round_trips')
+            return result
+        except Error as e:
+            if self.in_transaction:
+                raise
+            print(f"The error '{e}' occurred")
+
+    def stream(self, query: str, params: tuple = (), fetch_size: int = FETCH_SIZE) -> Iterator[tuple]:
+        """
+        Iterating over the records of a query with an unbuffered cursor, see iter_read_query
+
+        The statement is not prepared: prepared cursors of the connector buffer the whole result set.
+        """
+        return iter_read_query(self.connection, query, params, fetch_size)
+
+    def write(self, query: str, params: tuple = ()) -> bool:
+        """
+        Inserting/updating records in the database
+
+        Parameters
+        ----------
+        query : str
+            Database write request with %s placeholders
+        params : tuple
+            Values bound to the placeholders
+
+        Returns
+        -------
+        bool
+            False if an error occurred outside of a transaction
+        """
+        return self.write_many(query, [params])
+
+    def write_many(self, query: str, rows: list) -> bool:
+        """
+        Executing a write statement for each tuple of rows with the same prepared statement
+
+        Parameters
+        ----------
+        query : str
+            Database write request with %s placeholders
+        rows : list
+            Tuples of values bound to the placeholders
+
+        Returns
+        -------
+        bool
+            False if an error occurred outside of a transaction
+        """
+        try:
+            with metrics.span('db_query', statement=statement_kind(query)):
+                query, cursor = self.cursor(query)
+                cursor.executemany(query, rows)
+                if not self.in_transaction:
+                    self.connection.commit()
+            metrics.count('db_round_trips', len(rows) + (not self.in_transaction))
+            if not self.in_transaction:
+                print("Query executed successfully")
+            return True
+        except Error as e:
+            if self.in_transaction:
+                raise
+            print(f"The error '{e}' occurred")
+            return False
+
+    def execute(self, query: str) -> int:
+        """
+        Executing a statement that cannot be prepared (LOAD DATA, temporary tables) with the text protocol
+
+        Parameters
+        ----------
+        query : str
+            Database request without placeholders
+
+        Returns
+        -------
+        int
+            Number of affected rows, None if an error occurred outside of a transaction
+        """
+        cursor = self.connection.cursor()
+        try:
+            with metrics.span('db_query', statement=statement_kind(query)):
+                cursor.execute(query)
+                if not self.in_transaction:
+                    self.connection.commit()
+            metrics.count('db_round_trips', 1 + (not self.in_transaction))
+            return cursor.rowcount
+        except Error as e:
+            if self.in_transaction:
+                raise
+            print(f"The error '{e}' occurred")
+        finally:
+            cursor.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Grouping the statements of the block into one transaction with a single commit
+
+        The transaction is rolled back and the error is raised again if the block fails
+        """
+        self.in_transaction = True
+        try:
+            yield self
+            with metrics.span('db_commit'):
+                self.connection.commit()
+            metrics.count('db_round_trips')
+        except BaseException:
+            self.connection.rollback()
+            raise
+        finally:
+            self.in_transaction = False
+
+    def close(self) -> None:
+        """
+        Deallocating all prepared statements
+        """
+        while self.__cursors:
+            _, (_, cursor) = self.__cursors.popitem()
+            cursor.close()
@@ -0,0 +1,226 @@
+import datetime
+import itertools
+import math
+from functools import lru_cache
+from typing import Iterable, Iterator, NamedTuple, Optional, Union
+
+import metrics
+from common import READ_CHUNK_SIZE
+
+Chunk = Union[str, bytes]
+
+# Fixed columns of a SOLUTION/ESTIMATE data line (SINEX 2.02, 0-based slices)
+#  *INDEX TYPE__ CODE PT SOLN _REF_EPOCH__ UNIT S __ESTIMATED VALUE____ _STD_DEV___
+#       1 STAX   ABMF  A    1 22:001:43200 m    2  2.91978717591126e+06 3.42470e-04
+TYPE_SLICE = slice(7, 13)
+CODE_SLICE = slice(14, 18)
+REF_EPOCH_SLICE = slice(27, 39)
+VALUE_SLICE = slice(47, 68)
+STD_DEV_SLICE = slice(69, 80)
+
+
+class StationEstimate(NamedTuple):
+    """
+    Station coordinates from the SOLUTION/ESTIMATE block of a SINEX file
+
+    Velocities (VELX/VELY/VELZ, m/year) are zero and standard deviations NaN when the block has none,
+    epoch is the reference epoch of the coordinates (None if undefined).
+    """
+    name: str
+    x: float
+    y: float
+    z: float
+    vx: float = 0.0
+    vy: float = 0.0
+    vz: float = 0.0
+    sx: float = math.nan
+    sy: float = math.nan
+    sz: float = math.nan
+    epoch: Optional[datetime.datetime] = None
+
+
+@lru_cache(maxsize=1024)
+def parse_epoch(text: str) -> Optional[datetime.datetime]:
+    """
+    Converting a SINEX epoch YY:DDD:SSSSS (or YYYY:DDD:SSSSS) to a datetime, None for 00:000:00000
+
+    Two-digit years up to 50 are 20YY, the other ones 19YY.
+    """
+    fields = text.strip().split(':')
+    year, day, seconds = (int(field) for field in fields)
+    if year == 0 and day == 0 and seconds == 0:
+        return None
+    if len(fields[0]) <= 2:
+        year += 2000 if year <= 50 else 1900
+    return datetime.datetime(year, 1, 1) + datetime.timedelta(days=day - 1, seconds=seconds)
+
+
+class _Markers:
+    """
+    Section markers and record types for one string type (str or bytes)
+    """
+
+    def __init__(self, kind: type):
+        enc = (lambda s: s.encode('ascii')) if kind is bytes else (lambda s: s)
+        self.newline = enc('\n')
+        self.section_start = enc('+')
+        self.section_end = enc('-')
+        self.estimate_start = enc('+SOLUTION/ESTIMATE')
+        self.estimate_end = enc('-SOLUTION/ESTIMATE')
+        self.data_line = enc(' ')
+        # Positions and velocities, in the order of the fields of StationEstimate
+        self.axes = {enc('STAX  '): 0, enc('STAY  '): 1, enc('STAZ  '): 2,
+                     enc('VELX  '): 3, enc('VELY  '): 4, enc('VELZ  '): 5}
+        self.encode = enc
+        self.decode = (lambda b: b.decode('ascii')) if kind is bytes else (lambda s: s)
+
+
+_MARKERS = {str: _Markers(str), bytes: _Markers(bytes)}
+
+
+def _iter_lines(chunks: Iterable[Chunk], markers: Optional[_Markers] = None) -> Iterator[Chunk]:
+    """
+    Splitting a stream of chunks with arbitrary boundaries into lines
+
+    Parameters
+    ----------
+    chunks : iterable of str or bytes
+        Lines or raw chunks of a file
+    markers : _Markers
+        Markers for the type of chunks
+
+    Returns
+    -------
+    Iterator
+        Lines without the trailing newline
+    """
+    tail = None
+    for chunk in chunks:
+        if markers is None:
+            markers = _MARKERS[type(chunk)]
+        if tail:
+            chunk = tail + chunk
+        lines = chunk.split(markers.newline)
+        tail = lines.pop()
+        yield from lines
+    if tail:
+        yield tail
+
+
+def read_estimates(chunks: Iterable[Chunk], stations: Optional[frozenset] = None) -> Iterator[StationEstimate]:
+    """
+    Streaming the station coordinates out of the SOLUTION/ESTIMATE block
+
+    The block is read with a section-aware state machine working on fixed-column slices,
+    lines outside of the block are only checked by their first character.
+    Consecutive STAX/STAY/STAZ and VELX/VELY/VELZ lines of one station are yielded as one result
+    with the standard deviations and the reference epoch of the positions,
+    a station appearing again later in the block (another SOLN) is yielded again.
+
+    Parameters
+    ----------
+    chunks : iterable of str or bytes
+        Lines or raw chunks of a SINEX file (e.g. an opened file, a decompression stream)
+    stations : set or frozenset, optional
+        Station names to keep (case-insensitive), all stations if None
+
+    Returns
+    -------
+    Iterator
+        StationEstimate for each station of the block
+    """
+    it = iter(chunks)
+    first = next(it, None)
+    if first is None:
+        return
+    markers = _MARKERS[type(first)]
+    wanted = None
+    if stations is not None:
+        wanted = frozenset(markers.encode(station.upper()) for station in stations)
+
+    section_start = markers.section_start
+    section_end = markers.section_end
+    data_line = markers.data_line
+    axes = markers.axes
+    decode = markers.decode
+
+    lines = _iter_lines(itertools.chain((first,), it), markers)
+    for line in lines:
+        if line[:1] == section_start and line.startswith(markers.estimate_start):
+            break
+    else:
+        return
+
+    code = None
+    values = [0.0] * 6
+    sigmas = [math.nan] * 3
+    ref_epoch = None
+    epochs = dict()  # datetime by raw reference epoch, a product has only a few distinct ones
+    parsed = 0
+    matched = 0
+    try:
+        for line in lines:
+            parsed += 1
+            if line[:1] != data_line:
+                if line[:1] == section_end and line.startswith(markers.estimate_end):
+                    break
+                continue
+            axis = axes.get(line[TYPE_SLICE])
+            if axis is None:
+                continue
+            line_code = line[CODE_SLICE].upper()
+            if wanted is not None and line_code not in wanted:
+                continue
+            if line_code != code:
+                if code is not None:
+                    matched += 1
+                    yield StationEstimate(decode(code).lower(), *values, *sigmas,
+                                          _epoch(ref_epoch, epochs, decode))
+                code = line_code
+                values = [0.0] * 6
+                sigmas = [math.nan] * 3
+                ref_epoch = None
+            values[axis] = float(line[VALUE_SLICE])
+            if axis < 3:
+                try:
+                    sigmas[axis] = float(line[STD_DEV_SLICE])
+                except ValueError:
+                    pass  # blank standard deviation
+                ref_epoch = line[REF_EPOCH_SLICE]
+        if code is not None:
+            matched += 1
+            yield StationEstimate(decode(code).lower(), *values, *sigmas, _epoch(ref_epoch, epochs, decode))
+    finally:
+        metrics.count('sinex_lines_parsed', parsed)
+        metrics.count('stations_matched', matched)
+
+
+def _epoch(ref_epoch: Optional[Chunk], epochs: dict, decode) -> Optional[datetime.datetime]:
+    try:
+        return epochs[ref_epoch]
+    except KeyError:
+        text = decode(ref_epoch) if ref_epoch is not None else ''
+        epoch = parse_epoch(text) if text.strip() else None
+        epochs[ref_epoch] = epoch
+        return epoch
+
+
+def read_file(file: str, stations: Optional[frozenset] = None) -> Iterator[StationEstimate]:
+    """
+    Streaming the station coordinates out of an uncompressed SINEX file
+
+    Parameters
+    ----------
+    file : str
+        Path to the SINEX file
+    stations : set or frozenset, optional
+        Station names to keep (case-insensitive), all stations if None
+
+    Returns
+    -------
+    Iterator
+        StationEstimate for each station of the file
+    """
+    with open(file, 'rb') as f:
+        yield from read_estimates(iter(lambda: f.read(READ_CHUNK_SIZE), b''), stations)
+
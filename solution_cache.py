@@ -0,0 +1,254 @@
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import time
+from typing import Callable, Iterable
+
+import numpy as np
+
+import metrics
+from common import READ_CHUNK_SIZE
+from station_batch import StationBatch
+
+# File layout: a fixed-size header, then the columns one after the other, each aligned to ALIGNMENT bytes,
+# with the stations sorted by name:
+#   magic, format version, number of stations, SHA-256 of the source product, creation time
+#   names (S9) | epochs (int64 seconds since 1970) | xyz (3 x float64) | blh (3 x float64) | sigmas (3 x float64)
+#   | velocities (3 x float64) | reference epochs (int64 seconds since 1970, NaT as the smallest int64)
+MAGIC = b'SNXSOL\x00\x00'
+VERSION = 2
+HEADER = struct.Struct('<8sI4xQ32sd')
+HEADER_SIZE = 128
+ALIGNMENT = 64
+COLUMNS = (('names', 'S9', ()), ('epochs', '<i8', ()), ('xyz', '<f8', (3,)), ('blh', '<f8', (3,)),
+           ('sigmas', '<f8', (3,)), ('velocities', '<f8', (3,)), ('reference_epochs', '<i8', ()))
+
+
+def file_digest(file: str) -> bytes:
+    """
+    SHA-256 of the contents of a file, the identity of a source product
+    """
+    digest = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _layout(count: int) -> list:
+    layout = list()
+    offset = HEADER_SIZE
+    for name, dtype, shape in COLUMNS:
+        layout.append((name, np.dtype(dtype), (count,) + shape, offset))
+        size = np.dtype(dtype).itemsize * count * int(np.prod(shape, dtype=np.int64))
+        offset += (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+    return layout
+
+
+class SolutionCache:
+    """
+    An on-disk cache of parsed and converted SINEX solutions, one binary file per product file
+
+    A solution is keyed by the name of the product and the file name of the source product (e.g.
+    igs22P2190.snx.Z or COD0OPSFIN_20220010000_01D_01D_SOL.SNX.gz), so the daily products of a week
+    get their own files. Files are written to a temporary file and renamed, concurrent writers of one key
+    write the same solution and readers never see a partial file. The maps of the files read stay open
+    (reopened when a file is replaced), so one instance should be kept for the life of the process:
+    shared(directory) returns it, and an instance sent to a worker process is resolved to the one of the worker.
+
+    The columns are read through a memory map, so loading a solution costs the header, the names column
+    and the pages holding the requested stations. A solution is only used if it was built from a source
+    product with the same SHA-256 and with the same format version, otherwise it is parsed and written again.
+
+    Attributes
+    ----------
+    directory : str
+        Directory of the cache
+
+    Methods
+    -------
+    load(key, digest, stations, dt)
+        Reading a cached solution
+    store(key, digest, batch)
+        Writing a solution
+    get(key, source_file, parse, stations, dt)
+        Reading a cached solution or parsing the product and caching the result
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.__maps = dict()  # (file identity, source digest, count, columns) by path
+        self.__lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def __reduce__(self):
+        return shared, (self.directory,)
+
+    def path(self, key: str, product: str = 'igs') -> str:
+        return os.path.join(self.directory, f"{product}_{os.path.basename(key)}.sol")
+
+    def load(self, key: str, digest: bytes = None, stations: Iterable[str] = None, dt=None,
+             product: str = 'igs'):
+        """
+        Reading a cached solution
+
+        Parameters
+        ----------
+        key : str
+            File name of the source product (the name of its URL)
+        digest : bytes, optional
+            SHA-256 of the source product (file_digest), the solution is not checked against it if None
+        stations : iterable of str, optional
+            Station names to read (lower case), all stations if None
+        dt : datetime, optional
+            Epoch given to the stations, the epoch stored with the solution by default
+        product : str
+            Name of the product
+
+        Returns
+        -------
+        StationBatch
+            Stations found, sorted by name, None if there is no valid solution
+        """
+        mapped = self.__open(self.path(key, product))
+        if mapped is None:
+            return None
+        source, count, columns = mapped
+        if digest is not None and source != digest:
+            return None
+        if count == 0:
+            return StationBatch.empty()
+        if stations is None:
+            rows = slice(None)
+        else:
+            # Binary search in the sorted names column
+            wanted = np.unique(np.array([station.lower().encode('ascii') for station in stations], dtype='S9'))
+            index = np.minimum(np.searchsorted(columns['names'], wanted), count - 1)
+            rows = index[columns['names'][index] == wanted]
+        # Fancy indexing copies the selected rows out of the map, only their pages are read
+        names = np.array(columns['names'][rows]).astype('U9')
+        epochs = np.array(columns['epochs'][rows]).astype('datetime64[s]') if dt is None else dt
+        return StationBatch(names, epochs, np.array(columns['xyz'][rows]), np.array(columns['blh'][rows]),
+                            np.array(columns['sigmas'][rows]), np.array(columns['velocities'][rows]),
+                            np.array(columns['reference_epochs'][rows]).astype('datetime64[s]'))
+
+    def __open(self, path: str):
+        # The columns of a valid solution file, mapped once while the file is not replaced
+        try:
+            info = os.stat(path)
+        except OSError:
+            return None
+        identity = (info.st_ino, info.st_mtime_ns, info.st_size)
+        with self.__lock:
+            cached = self.__maps.get(path)
+        if cached is not None and cached[0] == identity:
+            return cached[1:]
+        try:
+            with open(path, 'rb') as f:
+                magic, version, count, source, _ = HEADER.unpack(f.read(HEADER.size))
+        except (OSError, struct.error):
+            return None
+        if magic != MAGIC or version != VERSION:
+            return None
+        columns = None
+        if count:
+            data = np.memmap(path, dtype=np.uint8, mode='r')
+            columns = {name: np.ndarray(shape, dtype, buffer=data, offset=offset)
+                       for name, dtype, shape, offset in _layout(count)}
+        with self.__lock:
+            self.__maps[path] = (identity, source, count, columns)
+        return source, count, columns
+
+    def store(self, key: str, digest: bytes, batch: StationBatch, product: str = 'igs') -> str:
+        """
+        Writing a solution, replacing the previous one atomically
+
+        Parameters
+        ----------
+        key : str
+            File name of the source product (the name of its URL)
+        digest : bytes
+            SHA-256 of the source product (file_digest)
+        batch : StationBatch
+            Parsed and converted stations (with blh filled), station names must be unique
+        product : str
+            Name of the product
+
+        Returns
+        -------
+        str
+            Path of the solution file
+        """
+        order = np.argsort(batch.names, kind='stable')
+        columns = {
+            'names': np.char.encode(batch.names[order], 'ascii').astype('S9'),
+            'epochs': batch.epochs[order].astype('datetime64[s]').astype('<i8'),
+            'xyz': batch.xyz[order],
+            'blh': batch.blh[order],
+            'sigmas': batch.sigmas[order],
+            'velocities': batch.velocities[order],
+            'reference_epochs': batch.reference_epochs[order].astype('datetime64[s]').astype('<i8'),
+        }
+        path = self.path(key, product)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, VERSION, len(batch), digest, time.time()).ljust(HEADER_SIZE, b'\0'))
+                for name, dtype, shape, offset in _layout(len(batch)):
+                    f.write(b'\0' * (offset - f.tell()))
+                    f.write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return path
+
+    def get(self, key: str, source_file: str, parse: Callable, stations: Iterable[str] = None, dt=None,
+            product: str = 'igs') -> StationBatch:
+        """
+        Reading a cached solution or parsing the product and caching the result
+
+        Parameters
+        ----------
+        key : str
+            File name of the source product (the name of its URL)
+        source_file : str
+            Path of the product (.Z, .gz or uncompressed)
+        parse : callable
+            parse(source_file) -> StationBatch with all the stations of the product and blh filled
+        stations : iterable of str, optional
+            Station names to return (lower case), all stations if None
+        dt : datetime, optional
+            Epoch given to the stations
+        product : str
+            Name of the product
+
+        Returns
+        -------
+        StationBatch
+            Stations found, sorted by name
+        """
+        digest = file_digest(source_file)
+        result = self.load(key, digest, stations, dt, product)
+        if result is not None:
+            metrics.count('solution_cache_hits')
+            return result
+        metrics.count('solution_cache_misses')
+        self.store(key, digest, parse(source_file), product)
+        return self.load(key, digest, stations, dt, product)
+
+
+_shared = dict()
+_shared_lock = threading.Lock()
+
+
+def shared(directory: str) -> SolutionCache:
+    """
+    The SolutionCache of a directory kept for the life of the process
+    """
+    with _shared_lock:
+        if directory not in _shared:
+            _shared[directory] = SolutionCache(directory)
+        return _shared[directory]
@@ -0,0 +1,292 @@
+import heapq
+import math
+from typing import NamedTuple, Union
+
+import numpy as np
+
+from station_batch import StationBatch
+
+EARTH_RADIUS_KM = 6371.0088  # mean radius, distances are great-circle distances on this sphere
+LEAF_SIZE = 128
+
+
+def unit_vectors(blh) -> np.ndarray:
+    """
+    Directions of the geodetic latitude/longitude on the unit sphere
+
+    Parameters
+    ----------
+    blh : array_like
+        N x 2 (or N x 3, the height is ignored) latitude and longitude in degrees
+
+    Returns
+    -------
+    numpy.ndarray
+        N x 3 unit vectors
+    """
+    blh = np.asarray(blh, dtype=np.float64).reshape(-1, np.shape(blh)[-1])
+    lat = np.radians(blh[:, 0])
+    lon = np.radians(blh[:, 1])
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+def chord(distance_km: float) -> float:
+    """
+    Straight-line distance on the unit sphere of a great-circle distance in km
+    """
+    return 2.0 * math.sin(min(distance_km / EARTH_RADIUS_KM, math.pi) / 2.0)
+
+
+def great_circle_km(chord_length) -> np.ndarray:
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.minimum(np.asarray(chord_length) / 2.0, 1.0))
+
+
+class StationIndex:
+    """
+    A KD-tree over the stations of a batch, on their unit-sphere directions
+
+    The tree is built once with median splits along the widest axis; every node keeps the bounding box
+    of its points, so the queries skip whole subtrees and take the subtrees entirely inside the region
+    without testing their points. Leaves are tested with vectorized distances.
+    Latitude/longitude boxes are answered from the stations sorted by latitude: a binary search gives
+    the band of latitudes, only its longitudes are tested.
+
+    Attributes
+    ----------
+    names : numpy.ndarray
+        Station names, in the order of the batch
+    blh : numpy.ndarray
+        N x 3 latitude and longitude in degrees and height in meters, in the order of the batch
+
+    Methods
+    -------
+    within(lat, lon, radius_km)
+        Stations within a great-circle distance of a point
+    nearest(lat, lon, count)
+        The closest stations to a point
+    in_box(lat_min, lat_max, lon_min, lon_max)
+        Stations inside a latitude/longitude box
+    """
+
+    def __init__(self, batch: StationBatch, leaf_size: int = LEAF_SIZE):
+        """
+        Parameters
+        ----------
+        batch : StationBatch
+            Stations with their geodetic coordinates filled (fill_geodetic)
+        leaf_size : int
+            Largest number of points in a leaf
+        """
+        self.names = batch.names
+        self.blh = batch.blh
+        self.leaf_size = leaf_size
+        points = unit_vectors(batch.blh)
+        order = np.arange(len(points))
+        # Nodes in flat lists: bounding box (x, y, z lower then upper, Python floats are faster than
+        # NumPy for one node), range of self.__order and children (-1 for a leaf)
+        self.__boxes = list()
+        self.__start = list()
+        self.__end = list()
+        self.__left = list()
+        self.__right = list()
+        if len(points):
+            self.__build(points, order, 0, len(points))
+        self.__order = order
+        self.__points = points[order]
+        self.__by_latitude = np.argsort(batch.blh[:, 0], kind='stable')
+        self.__latitudes = batch.blh[self.__by_latitude, 0]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def within(self, lat: float, lon: float, radius_km: float) -> np.ndarray:
+        """
+        Stations within a great-circle distance of a point
+
+        Returns
+        -------
+        numpy.ndarray
+            Indices of the stations in the batch, ascending
+        """
+        if not len(self):
+            return np.empty(0, dtype=np.intp)
+        query = unit_vectors([(lat, lon)])[0]
+        point = tuple(query.tolist())
+        limit = chord(radius_km) ** 2
+        found = list()
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if self.__box_distance2(node, point) > limit:
+                continue
+            start, end = self.__start[node], self.__end[node]
+            if self.__box_farthest2(node, point) <= limit:
+                found.append(self.__order[start:end])
+            elif self.__left[node] < 0:
+                distance2 = np.sum((self.__points[start:end] - query) ** 2, axis=1)
+                found.append(self.__order[start:end][distance2 <= limit])
+            else:
+                stack += (self.__left[node], self.__right[node])
+        return np.sort(np.concatenate(found)) if found else np.empty(0, dtype=np.intp)
+
+    def nearest(self, lat: float, lon: float, count: int) -> np.ndarray:
+        """
+        The closest stations to a point
+
+        Returns
+        -------
+        numpy.ndarray
+            Indices of the stations in the batch, by increasing distance
+        """
+        count = min(count, len(self))
+        if count <= 0:
+            return np.empty(0, dtype=np.intp)
+        query = unit_vectors([(lat, lon)])[0]
+        point = tuple(query.tolist())
+        best_distance2 = np.empty(0)
+        best_index = np.empty(0, dtype=np.intp)
+        kth = math.inf
+        # Best-first search: nodes by the distance of their bounding box
+        heap = [(0.0, 0)]
+        while heap:
+            box_distance2, node = heapq.heappop(heap)
+            if box_distance2 > kth:
+                break
+            left = self.__left[node]
+            if left >= 0:
+                for child in (left, self.__right[node]):
+                    heapq.heappush(heap, (self.__box_distance2(child, point), child))
+                continue
+            start, end = self.__start[node], self.__end[node]
+            distance2 = np.concatenate((best_distance2, np.sum((self.__points[start:end] - query) ** 2, axis=1)))
+            index = np.concatenate((best_index, self.__order[start:end]))
+            if len(distance2) > count:
+                keep = np.argpartition(distance2, count - 1)[:count]
+                distance2, index = distance2[keep], index[keep]
+            best_distance2, best_index = distance2, index
+            if len(best_distance2) == count:
+                kth = best_distance2.max()
+        return best_index[np.lexsort((best_index, best_distance2))]
+
+    def in_box(self, lat_min: float, lat_max: float, lon_min: float, lon_max: float) -> np.ndarray:
+        """
+        Stations inside a latitude/longitude box, lon_min > lon_max for a box across the antimeridian
+
+        Returns
+        -------
+        numpy.ndarray
+            Indices of the stations in the batch, ascending
+        """
+        if not len(self) or lat_min > lat_max:
+            return np.empty(0, dtype=np.intp)
+        span = 360.0 if lon_max - lon_min >= 360.0 else (lon_max - lon_min) % 360.0
+        start = np.searchsorted(self.__latitudes, lat_min, side='left')
+        end = np.searchsorted(self.__latitudes, lat_max, side='right')
+        index = self.__by_latitude[start:end]
+        if span < 360.0:
+            # Longitudes east of lon_min, in [0, 360)
+            index = index[(self.blh[index, 1] - lon_min) % 360.0 <= span]
+        return np.sort(index)
+
+    def distances_km(self, lat: float, lon: float, index) -> np.ndarray:
+        """
+        Great-circle distances of stations of the batch to a point
+        """
+        query = unit_vectors([(lat, lon)])[0]
+        return great_circle_km(np.linalg.norm(unit_vectors(self.blh[index]) - query, axis=1))
+
+    def __build(self, points: np.ndarray, order: np.ndarray, start: int, end: int) -> int:
+        node = len(self.__start)
+        block = points[order[start:end]]
+        lower = block.min(axis=0)
+        upper = block.max(axis=0)
+        self.__boxes.append(tuple(lower.tolist()) + tuple(upper.tolist()))
+        self.__start.append(start)
+        self.__end.append(end)
+        self.__left.append(-1)
+        self.__right.append(-1)
+        if end - start > self.leaf_size:
+            axis = int(np.argmax(upper - lower))
+            middle = (end - start) // 2
+            order[start:end] = order[start:end][np.argpartition(block[:, axis], middle)]
+            self.__left[node] = self.__build(points, order, start, start + middle)
+            self.__right[node] = self.__build(points, order, start + middle, end)
+        return node
+
+    def __box_distance2(self, node: int, point: tuple) -> float:
+        x0, y0, z0, x1, y1, z1 = self.__boxes[node]
+        x, y, z = point
+        dx = x0 - x if x < x0 else (x - x1 if x > x1 else 0.0)
+        dy = y0 - y if y < y0 else (y - y1 if y > y1 else 0.0)
+        dz = z0 - z if z < z0 else (z - z1 if z > z1 else 0.0)
+        return dx * dx + dy * dy + dz * dz
+
+    def __box_farthest2(self, node: int, point: tuple) -> float:
+        x0, y0, z0, x1, y1, z1 = self.__boxes[node]
+        x, y, z = point
+        dx = max(x - x0, x1 - x)
+        dy = max(y - y0, y1 - y)
+        dz = max(z - z0, z1 - z)
+        return dx * dx + dy * dy + dz * dz
+
+
+class Circle(NamedTuple):
+    """
+    Stations within radius_km of a point
+    """
+    lat: float
+    lon: float
+    radius_km: float
+
+    def select(self, index: StationIndex) -> np.ndarray:
+        return index.within(self.lat, self.lon, self.radius_km)
+
+
+class Box(NamedTuple):
+    """
+    Stations inside a latitude/longitude box
+    """
+    lat_min: float
+    lat_max: float
+    lon_min: float
+    lon_max: float
+
+    def select(self, index: StationIndex) -> np.ndarray:
+        return index.in_box(self.lat_min, self.lat_max, self.lon_min, self.lon_max)
+
+
+class Nearest(NamedTuple):
+    """
+    The count closest stations to a point
+    """
+    lat: float
+    lon: float
+    count: int
+
+    def select(self, index: StationIndex) -> np.ndarray:
+        return np.sort(index.nearest(self.lat, self.lon, int(self.count)))
+
+
+Region = Union[Circle, Box, Nearest]
+
+
+def select_region(batch: StationBatch, region: Region) -> StationBatch:
+    """
+    Keeping the stations of a batch inside a region
+
+    Parameters
+    ----------
+    batch : StationBatch
+        Stations with their geodetic coordinates filled
+    region : Circle, Box or Nearest
+        Selection, all the stations are kept if None
+
+    Returns
+    -------
+    StationBatch
+        A new batch with the selected stations, in the order of the batch
+    """
+    if region is None:
+        return batch
+    return batch[region.select(StationIndex(batch))]
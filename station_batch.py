@@ -0,0 +1,331 @@
+import datetime
+from typing import Iterable, Iterator
+
+import numpy as np
+
+import geodesy
+
+NAME_DTYPE = 'U9'  # 4-character SINEX codes, 9-character long names
+PRODUCT_DTYPE = 'U32'  # names of the products of stations_handler configuration
+EPOCH_DTYPE = 'datetime64[s]'
+SECONDS_PER_YEAR = 365.25 * 86400.0  # velocities of SINEX products are in m/year
+
+
+class StationRow:
+    """
+    A lightweight view of one station of a StationBatch
+
+    Has the attributes of request_handler.Coordinates (name, dt, x, y, z, vx, vy, vz, latitude, longitude,
+    height, product) plus the standard deviations sx, sy, sz, the values are read from the batch when accessed.
+    """
+    __slots__ = ('batch', 'index')
+
+    def __init__(self, batch: 'StationBatch', index: int):
+        self.batch = batch
+        self.index = index
+
+    def __repr__(self):
+        return f"StationRow(name={self.name!r}, dt={self.dt!r}, x={self.x!r}, y={self.y!r}, z={self.z!r})"
+
+    @property
+    def name(self) -> str:
+        return str(self.batch.names[self.index])
+
+    @property
+    def dt(self) -> datetime.datetime:
+        return self.batch.epochs[self.index].item()
+
+    @property
+    def x(self) -> float:
+        return float(self.batch.xyz[self.index, 0])
+
+    @property
+    def y(self) -> float:
+        return float(self.batch.xyz[self.index, 1])
+
+    @property
+    def z(self) -> float:
+        return float(self.batch.xyz[self.index, 2])
+
+    @property
+    def vx(self) -> float:
+        return float(self.batch.velocities[self.index, 0])
+
+    @property
+    def vy(self) -> float:
+        return float(self.batch.velocities[self.index, 1])
+
+    @property
+    def vz(self) -> float:
+        return float(self.batch.velocities[self.index, 2])
+
+    @property
+    def latitude(self) -> float:
+        return float(self.batch.blh[self.index, 0])
+
+    @property
+    def longitude(self) -> float:
+        return float(self.batch.blh[self.index, 1])
+
+    @property
+    def height(self) -> float:
+        return float(self.batch.blh[self.index, 2])
+
+    @property
+    def product(self) -> str:
+        return str(self.batch.products[self.index])
+
+    @property
+    def sx(self) -> float:
+        return float(self.batch.sigmas[self.index, 0])
+
+    @property
+    def sy(self) -> float:
+        return float(self.batch.sigmas[self.index, 1])
+
+    @property
+    def sz(self) -> float:
+        return float(self.batch.sigmas[self.index, 2])
+
+
+class StationBatch:
+    """
+    Columnar container of station coordinates
+
+    Every column is a NumPy array with one row per station, so a batch costs a few arrays
+    instead of one Python object per station. Slicing returns a batch sharing the arrays (no copy),
+    indexing with a mask or with an index array returns a copy, iterating yields StationRow views.
+    Batches are picklable (backfill workers return them) and can be concatenated.
+
+    Attributes
+    ----------
+    names : numpy.ndarray
+        Station names (lower case)
+    epochs : numpy.ndarray
+        Epochs of the coordinates (datetime64[s])
+    xyz : numpy.ndarray
+        N x 3 geocentric coordinates X, Y, Z in meters
+    blh : numpy.ndarray
+        N x 3 latitude and longitude in degrees and height in meters
+    sigmas : numpy.ndarray
+        N x 3 standard deviations of X, Y, Z in meters, NaN if unknown
+    velocities : numpy.ndarray
+        N x 3 velocities VX, VY, VZ in meters per year, zeros if unknown
+    reference_epochs : numpy.ndarray
+        Epochs xyz refer to (datetime64[s]), NaT if unknown
+    products : numpy.ndarray
+        Name of the product each station comes from, empty if unknown
+
+    Methods
+    -------
+    from_estimates(estimates, dt)
+        Building a batch out of sinex.StationEstimate records
+    from_coordinates(records)
+        Building a batch out of request_handler.Coordinates-like records
+    concatenate(batches)
+        Joining several batches into one
+    select(stations)
+        Keeping the stations of a set
+    fill_geodetic(method)
+        Computing blh out of xyz
+    propagate(dt)
+        Moving the stations to another epoch with their velocities
+    """
+    __slots__ = ('names', 'epochs', 'xyz', 'blh', 'sigmas', 'velocities', 'reference_epochs', 'products')
+
+    def __init__(self, names, epochs, xyz, blh=None, sigmas=None, velocities=None, reference_epochs=None,
+                 products=None):
+        self.names = np.asarray(names, dtype=NAME_DTYPE).reshape(-1)
+        count = len(self.names)
+        epochs = np.asarray(epochs, dtype=EPOCH_DTYPE)
+        # One epoch for all the stations is repeated
+        self.epochs = np.full(count, epochs) if epochs.ndim == 0 else epochs
+        self.xyz = np.asarray(xyz, dtype=np.float64).reshape(count, 3)
+        self.blh = np.zeros((count, 3)) if blh is None else np.asarray(blh, dtype=np.float64).reshape(count, 3)
+        self.sigmas = np.full((count, 3), np.nan) if sigmas is None else \
+            np.asarray(sigmas, dtype=np.float64).reshape(count, 3)
+        self.velocities = np.zeros((count, 3)) if velocities is None else \
+            np.asarray(velocities, dtype=np.float64).reshape(count, 3)
+        reference_epochs = np.asarray(np.datetime64('NaT') if reference_epochs is None else reference_epochs,
+                                      dtype=EPOCH_DTYPE)
+        self.reference_epochs = np.full(count, reference_epochs) if reference_epochs.ndim == 0 \
+            else reference_epochs
+        products = np.asarray('' if products is None else products, dtype=PRODUCT_DTYPE)
+        self.products = np.full(count, products) if products.ndim == 0 else products
+        if len(self.epochs) != count:
+            raise ValueError(f"{len(self.epochs)} epochs for {count} stations")
+        if len(self.reference_epochs) != count:
+            raise ValueError(f"{len(self.reference_epochs)} reference epochs for {count} stations")
+        if len(self.products) != count:
+            raise ValueError(f"{len(self.products)} products for {count} stations")
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __iter__(self) -> Iterator[StationRow]:
+        return (StationRow(self, index) for index in range(len(self.names)))
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return StationRow(self, range(len(self.names))[key])
+        return StationBatch(self.names[key], self.epochs[key], self.xyz[key], self.blh[key], self.sigmas[key],
+                            self.velocities[key], self.reference_epochs[key], self.products[key])
+
+    def __repr__(self):
+        return f"StationBatch({len(self)} stations)"
+
+    @classmethod
+    def empty(cls) -> 'StationBatch':
+        return cls(np.empty(0, dtype=NAME_DTYPE), np.empty(0, dtype=EPOCH_DTYPE), np.empty((0, 3)))
+
+    @classmethod
+    def from_estimates(cls, estimates: Iterable, dt: datetime.datetime) -> 'StationBatch':
+        """
+        Building a batch out of sinex.StationEstimate records
+
+        A station appearing several times keeps its last estimate, as the dictionary built by parse did.
+        The velocities, standard deviations and reference epochs of the estimates are kept, the coordinates
+        are not moved to dt (see propagate).
+
+        Parameters
+        ----------
+        estimates : iterable of StationEstimate
+            Records with name, x, y, z (and optionally vx, vy, vz, sx, sy, sz, epoch)
+        dt : datetime
+            Epoch of all the stations
+
+        Returns
+        -------
+        StationBatch
+            Stations in the order of their first appearance
+        """
+        latest = dict()
+        for estimate in estimates:
+            latest[estimate.name] = estimate
+        if not latest:
+            return cls.empty()
+        # name, x, y, z, vx, vy, vz, sx, sy, sz, epoch
+        values = np.array([estimate[1:10] for estimate in latest.values()], dtype=np.float64).reshape(-1, 9)
+        # A product has a few distinct reference epochs, each one is converted once
+        codes = dict()
+        index = np.fromiter((codes.setdefault(getattr(estimate, 'epoch', None), len(codes))
+                             for estimate in latest.values()), dtype=np.intp, count=len(latest))
+        reference_epochs = np.array([epoch or 'NaT' for epoch in codes], dtype=EPOCH_DTYPE)[index]
+        return cls(list(latest), np.datetime64(dt, 's'), values[:, 0:3], sigmas=values[:, 6:9],
+                   velocities=values[:, 3:6], reference_epochs=reference_epochs)
+
+    @classmethod
+    def from_coordinates(cls, records: Iterable) -> 'StationBatch':
+        """
+        Building a batch out of request_handler.Coordinates-like records
+
+        Parameters
+        ----------
+        records : iterable of Coordinates
+            Records with name, dt, x, y, z, latitude, longitude, height (and optionally vx, vy, vz, product)
+
+        Returns
+        -------
+        StationBatch
+            Stations in the order of the records
+        """
+        records = list(records)
+        if not records:
+            return cls.empty()
+        return cls([data.name for data in records], [np.datetime64(data.dt, 's') for data in records],
+                   [(data.x, data.y, data.z) for data in records],
+                   [(data.latitude, data.longitude, data.height) for data in records],
+                   velocities=[(getattr(data, 'vx', 0.0), getattr(data, 'vy', 0.0), getattr(data, 'vz', 0.0))
+                               for data in records],
+                   products=[getattr(data, 'product', '') for data in records])
+
+    @classmethod
+    def concatenate(cls, batches: Iterable['StationBatch']) -> 'StationBatch':
+        """
+        Joining several batches into one
+
+        Parameters
+        ----------
+        batches : iterable of StationBatch
+            Batches to join, in order
+
+        Returns
+        -------
+        StationBatch
+            A new batch with the rows of all the batches
+        """
+        batches = list(batches)
+        if not batches:
+            return cls.empty()
+        return cls(np.concatenate([batch.names for batch in batches]),
+                   np.concatenate([batch.epochs for batch in batches]),
+                   np.concatenate([batch.xyz for batch in batches]),
+                   np.concatenate([batch.blh for batch in batches]),
+                   np.concatenate([batch.sigmas for batch in batches]),
+                   np.concatenate([batch.velocities for batch in batches]),
+                   np.concatenate([batch.reference_epochs for batch in batches]),
+                   np.concatenate([batch.products for batch in batches]))
+
+    def select(self, stations: Iterable[str]) -> 'StationBatch':
+        """
+        Keeping the stations of a set
+
+        Parameters
+        ----------
+        stations : iterable of str
+            Station names (lower case)
+
+        Returns
+        -------
+        StationBatch
+            A new batch with the stations found, in the order of this batch
+        """
+        return self[np.isin(self.names, np.array(list(stations), dtype=NAME_DTYPE))]
+
+    def fill_geodetic(self, method: str = None) -> 'StationBatch':
+        """
+        Computing the latitude, longitude and height of all the stations in place
+
+        Parameters
+        ----------
+        method : str, optional
+            Conversion method of geodesy.ecef2blh, geodesy.BOWRING by default
+
+        Returns
+        -------
+        StationBatch
+            This batch
+        """
+        if len(self):
+            self.blh[:] = geodesy.ecef2blh(self.xyz, method or geodesy.BOWRING)
+        return self
+
+    def propagate(self, dt) -> 'StationBatch':
+        """
+        Moving the stations to another epoch with their velocities
+
+        xyz + velocities * (dt - reference_epochs) for the whole batch at once, the stations without
+        a reference epoch or with zero velocities keep their coordinates. The geodetic coordinates
+        of the moved stations are recomputed, the standard deviations are kept.
+
+        Parameters
+        ----------
+        dt : datetime or array_like of datetime64
+            Target epoch of all the stations, or one per station
+
+        Returns
+        -------
+        StationBatch
+            A new batch with epochs and reference epochs set to dt, the products are kept
+        """
+        target = np.broadcast_to(np.asarray(dt, dtype=EPOCH_DTYPE), self.epochs.shape)
+        years = (target - self.reference_epochs).astype(np.float64) / SECONDS_PER_YEAR
+        years[np.isnat(self.reference_epochs)] = 0.0
+        shift = self.velocities * years[:, np.newaxis]
+        xyz = self.xyz + shift
+        blh = self.blh.copy()
+        moved = np.any(shift != 0.0, axis=1)
+        if moved.any():
+            blh[moved] = geodesy.ecef2blh(xyz[moved], geodesy.BOWRING)
+        return StationBatch(self.names, target.copy(), xyz, blh, self.sigmas, self.velocities, target.copy(),
+                            self.products)
@@ -1,15 +1,30 @@
 from sys import platform
+import sys
 import argparse
+import asyncio
+import time
+from collections import Counter
 from datetime import datetime, timedelta
 import os
-import ftplib
+import threading
 import configparser
 import mysqldb
 import request_handler
 import requests
-import gnsscal
-import re
+import geodesy
 import math
+import sinex
+import decompress
+import downloader
+import ftp_discovery
+import backfill
+import product_cache
+import daemon
+import solution_cache
+import metrics
+import products
+import spatial_index
+from station_batch import StationBatch
 
 
 def os_dependency_slash() -> str:
@@ -37,35 +52,29 @@ class SessionWithHeaderRedirection(requests.Session):
                     redirect_parsed.hostname != self.AUTH_HOST and \
                     original_parsed.hostname != self.AUTH_HOST:
                 del headers['Authorization']
+        metrics.count('http_redirects')
 
         return
 
 
-def download(url: str, file_path='', attempts=1) -> str:
-    """Downloads a URL content into a file (with large file support by streaming)
+def download(url: str, file_path='', attempts=5, http_session=None) -> str:
+    """Downloads a URL content into a file (resumable, with retries and backoff)
 
     :param url: URL to download
     :param file_path: Local file name to contain the data downloaded
     :param attempts: Number of attempts
-    :return: New file path. Empty string if the download failed
+    :param http_session: Session used for the request, the global session by default
+    :return: New file path
+    :raises downloader.DownloadError: If the download failed
     """
+    http_session = http_session or session
     if not file_path:
         file_path = os.path.realpath(os.path.basename(url))
     print(f'Downloading {url} content to {file_path}')
-    for attempt in range(1, attempts + 1):
-        try:
-            # if attempt > 1:
-            # time.sleep(1)  # 10 seconds wait time between downloads
-            with session.get(url, stream=True) as response:
-                response.raise_for_status()
-                with open(file_path, 'wb') as out_file:
-                    for chunk in response.iter_content(chunk_size=1024 * 1024):  # 1MB chunks
-                        out_file.write(chunk)
-                print('Download finished successfully')
-                return file_path
-        except Exception as ex:
-            print(f'Attempt #{attempt} failed with error: {ex}')
-    return file_path
+    result = downloader.download(url, file_path, http_session, attempts=attempts)
+    print(f'Download finished successfully: {result.size} bytes in {result.duration:.1f} s '
+          f'({result.throughput / 1e6:.2f} MB/s, {result.attempts} attempts)')
+    return result.path
 
 
 def length_calculator(num: int) -> int:
@@ -85,107 +94,62 @@ def get_doy_str(num: int) -> str:
     return day
 
 
-def get_calculation_epoch() -> datetime:
-    selected_scenario_data = handler.select_scenario_data(scenario_id)
-    if len(selected_scenario_data) == 0:
-        print(f"In the database {db_name} no data for scenario_id {scenario_id}")
-        database.close_connection()
-        exit()
-    return selected_scenario_data[0][4]
+def date_argument(value: str) -> datetime:
+    return datetime.strptime(value, '%Y-%m-%d')
 
 
-def get_list_stations() -> list:
-    result = list()
-    with ftplib.FTP(ftp_server) as ftp:
-        ftp.login(ftp_login, ftp_pass)
-        d_o_y = get_doy_str(epoch.timetuple().tm_yday)
-        ftp.cwd(f"LOCAL/FREE/CDIS/DATA/DAILY/{epoch.year}/{d_o_y}/{epoch.strftime('%Y')[2:]}o")
-        for file in ftp.nlst():
-            result.append(file[:4])
-    return result
+def connect_database():
+    with metrics.span('db_connect'):
+        return database.create_connection_tunnel(ssh_host=ssh_host, ssh_port=ssh_port, ssh_username=ssh_user,
+                                                 ssh_password=ssh_password)
 
 
-def gunzip(file):
-    exit_status = os.system('gunzip -f ' + file)
+def get_calculation_epoch() -> datetime:
+    with metrics.span('scenario_lookup'):
+        selected_scenario_data = handler.select_scenario_data(scenario_id)
+    # None if the query failed
+    if not selected_scenario_data:
+        print(f"In the database {db_name} no data for scenario_id {scenario_id}")
+        handler.close()
+        database.close_connection()
+        exit()
+    return selected_scenario_data[0][request_handler.SCENARIO_TB_EPOCH_INDEX]
 
-    if exit_status != 0:
-        print(f"ERROR: Could not gunzip file {file}!")
 
-    return exit_status
+def get_list_stations(day: datetime = None) -> list:
+    with metrics.span('ftp_listing'):
+        return sorted(discovery.list_day(day or epoch))
 
 
-def parse(file: str) -> dict:
-    result = dict()
-    in_solution_estimate_section = False
+def parse(file: str, station_filter: frozenset = None, dt: datetime = None) -> StationBatch:
+    station_filter = frozenset(stations) if station_filter is None else station_filter
+    dt = dt or epoch
     try:
-        with open(file, 'r') as f:
-            start_solution_estimate_pattern = re.compile('^\+SOLUTION/ESTIMATE.*')
-            end_solution_estimate_pattern = re.compile('^\-SOLUTION\/ESTIMATE.*')
-            station_coordinate_pattern = re.compile(
-                '^\s+\d+\s+STA(\w)\s+(\w+)\s+(\w).*\d+\s+(-?[\d+]?\.\d+[Ee][+-]?\d+)\s+(-?[\d+]?\.\d+[Ee][+-]?\d+)$')
-            for line in f:
-                start_solution_estimate_match = start_solution_estimate_pattern.findall(line)
-                end_solution_estimate_match = end_solution_estimate_pattern.findall(line)
-
-                if start_solution_estimate_match:
-                    in_solution_estimate_section = True
-                    continue
-                elif end_solution_estimate_match:
-                    in_solution_estimate_section = False
-                    break
-
-                if in_solution_estimate_section:
-                    station_coordinate_match = station_coordinate_pattern.findall(line)
-                    if station_coordinate_match and stations.count(station_coordinate_match[0][1].lower()):
-                        if not station_coordinate_match[0][1].lower() in result.keys():
-                            coord_data = request_handler.Coordinates()
-                            coord_data.name = station_coordinate_match[0][1].lower()
-                            coord_data.dt = epoch
-                            result[station_coordinate_match[0][1].lower()] = coord_data
-                        if station_coordinate_match[0][0] == 'X':
-                            result[station_coordinate_match[0][1].lower()].x = float(station_coordinate_match[0][3])
-                        elif station_coordinate_match[0][0] == 'Y':
-                            result[station_coordinate_match[0][1].lower()].y = float(station_coordinate_match[0][3])
-                        else:
-                            result[station_coordinate_match[0][1].lower()].z = float(station_coordinate_match[0][3])
+        with metrics.span('parse'):
+            return StationBatch.from_estimates(sinex.read_estimates(decompress.iter_file(file), station_filter), dt)
     except Exception as ex:
         print(f"Failed with error: {ex}")
         raise
-    return result
+
+
+PI_180 = math.pi / 180.0
 
 
 def ecef2blh(x: float, y: float, z: float) -> list:
-    PI_180 = math.pi / 180.0
-    # WGS84 座標パラメータ
-    A = 6378137.0
-    ONE_F = 298.257223563
-    B = A * (1.0 - 1.0 / ONE_F)
-    E2 = (1.0 / ONE_F) * (2 - (1.0 / ONE_F))
-    # e^2 = 2 * f - f * f
-    #     = (a^2 - b^2) / a^2
-    ED2 = E2 * A * A / (B * B)  # e'^2= (a^2 - b^2) / b^2
-    try:
-        n = lambda x: A / \
-                      math.sqrt(1.0 - E2 * math.sin(x * PI_180) ** 2)
-        p = math.sqrt(x * x + y * y)
-        theta = math.atan2(z * A, p * B) / PI_180
-        lat = math.atan2(
-            z + ED2 * B * math.sin(theta * PI_180) ** 3,
-            p - E2 * A * math.cos(theta * PI_180) ** 3
-        ) / PI_180
-        lon = math.atan2(y, x) / PI_180
-        ht = (p / math.cos(lat * PI_180)) - n(lat)
-        return [lat, lon, ht]
-    except Exception as e:
-        raise
+    p = math.sqrt(x * x + y * y)
+    theta = math.atan2(z * geodesy.A, p * geodesy.B) / PI_180
+    lat = math.atan2(
+        z + geodesy.ED2 * geodesy.B * math.sin(theta * PI_180) ** 3,
+        p - geodesy.E2 * geodesy.A * math.cos(theta * PI_180) ** 3
+    ) / PI_180
+    lon = math.atan2(y, x) / PI_180
+    ht = (p / math.cos(lat * PI_180)) - geodesy.A / math.sqrt(1.0 - geodesy.E2 * math.sin(lat * PI_180) ** 2)
+    return [lat, lon, ht]
 
 
-def fill_geocentric_coordinates(data: dict) -> None:
-    for value in data.values():
-        blh = ecef2blh(value.x, value.y, value.z)
-        value.latitude = blh[0]
-        value.longitude = blh[1]
-        value.height = blh[2]
+def fill_geocentric_coordinates(data: StationBatch) -> None:
+    with metrics.span('geodesy'):
+        data.fill_geodetic()
 
 
 def check_station_id() -> bool:
@@ -194,61 +158,400 @@ def check_station_id() -> bool:
               f"You must specify the scenario_id in config.ini")
         return False
     selected_scenario_tb = handler.select_scenario(scenario_id)
-    if len(selected_scenario_tb) == 0:
+    if not selected_scenario_tb:
         print(f"Verification error scenario_id. "
               f"Check the correctness of the specified.")
         return False
     return True
 
 
+def region_stations(data: StationBatch) -> StationBatch:
+    # Stations of the scenarios: all the stations written to station_tb, or those inside the region
+    if region is None:
+        return data
+    with metrics.span('region_selection'):
+        selected = spatial_index.select_region(data, region)
+    print(f"{region}: {len(selected)} of {len(data)} stations selected")
+    return selected
+
+
 def updating_list_stations(set_stations: set) -> None:
     if not check_station_id():
         return
-    handler.delete_stations(scenario_id)
-    for station in set_stations:
-        handler.insert_station(scenario_id, station)
-
-
-def sending_data_db(data: dict) -> None:
-    set_stations = set()
-    for key in data.keys():
-        set_stations.add(key)
-        selected_station_data = handler.select_station_data(key)
-        if len(selected_station_data) == 0:
-            # insert
-            handler.insert_station_data(data[key])
+    with metrics.span('scenario_stations'):
+        diff = handler.sync_scenario_stations(scenario_id, set_stations)
+    if diff.rolled_back:
+        print(f"scenario_station_tb has not been updated for scenario {scenario_id}")
+        return
+    print(f"scenario_station_tb: {len(diff.added)} stations added {sorted(diff.added)}, "
+          f"{len(diff.removed)} stations removed {sorted(diff.removed)}")
+
+
+def sending_data_db(data: StationBatch, snapshot: dict = None) -> None:
+    with metrics.span('db_write'):
+        result = handler.upsert_changed_station_data(data, snapshot, position_tolerance, epoch_tolerance)
+    print(f"station_tb: {result.inserted} stations inserted, {result.updated} stations updated, "
+          f"{result.unchanged} stations unchanged")
+    updating_list_stations(set(region_stations(data).names.tolist()))
+
+
+def product_url(day: datetime, product: products.Product = products.IGS) -> str:
+    return product.url_for(day)
+
+
+def fetch_product(day: datetime, file_path='', http_session=None, product: products.Product = products.IGS) -> str:
+    """Gets the product for a day, through the product cache if it is enabled
+
+    :param day: Day of the product
+    :param file_path: Local file name to contain the product (ignored if the cache is enabled)
+    :param http_session: Session used for the request, the global session by default
+    :param product: Product to download, the IGS weekly product by default
+    :return: Path of the product, in the cache directory if the cache is enabled
+    """
+    url = product_url(day, product)
+    with metrics.span('download'):
+        if cache is None:
+            return download(url, file_path, http_session=http_session)
+        return cache.get(url, http_session or session)
+
+
+def parse_solution(file: str, dt: datetime) -> StationBatch:
+    # All the stations of the product with their geodetic coordinates, as kept by the solution cache
+    with metrics.span('parse'):
+        result = StationBatch.from_estimates(sinex.read_estimates(decompress.iter_file(file)), dt)
+    fill_geocentric_coordinates(result)
+    return result
+
+
+def process_product(file: str, station_filter: frozenset, dt: datetime, remove_file: bool = False,
+                    solutions=None, product: str = products.IGS.name, source: str = None) -> StationBatch:
+    if solutions:
+        # A product already parsed by an earlier run (same product file, same contents) is read from the cache
+        if isinstance(solutions, str):
+            solutions = solution_cache.shared(solutions)
+        result_parse = solutions.get(source or os.path.basename(file), file, lambda path: parse_solution(path, dt),
+                                     station_filter, dt, product)
+    elif station_filter is None:
+        result_parse = parse_solution(file, dt)
+    else:
+        # .Z/.gz products are decompressed in memory while they are parsed
+        result_parse = parse(file, station_filter, dt)
+        fill_geocentric_coordinates(result_parse)
+    # Coordinates of the reference epoch of the product moved to dt, unchanged without velocities
+    with metrics.span('propagate'):
+        result_parse = result_parse.propagate(dt)
+
+    # удаления загруженного файла
+    if remove_file:
+        os.remove(file)
+    return result_parse
+
+
+_thread_data = threading.local()
+
+
+def fetch_solution(product: products.Product, day: datetime, station_filter: frozenset = None) -> tuple:
+    # Runs in a thread of products.run: every thread has its own HTTP session, every product its own file
+    if not hasattr(_thread_data, 'session'):
+        _thread_data.session = SessionWithHeaderRedirection(cddis_username, cddis_password)
+    source = os.path.basename(product_url(day, product))
+    file = fetch_product(day, os.path.realpath(f"{day:%Y%m%d}_{source}"), _thread_data.session, product)
+    return file, station_filter, day, cache is None, solutions_cache, product.name, source
+
+
+def process_products(day: datetime, station_filter: frozenset = None) -> StationBatch:
+    """Downloads and parses the configured products of a day concurrently and merges them
+
+    :param day: Day of the products (calculation epoch)
+    :param station_filter: Stations to keep, all the stations of the products if None
+    :return: One estimate per station moved to day, with the name of its product
+    :raises RuntimeError: If none of the products could be processed
+    """
+    results = products.run(product_list, day, lambda product, _: fetch_solution(product, day, station_filter),
+                           process_product, product_workers)
+    for result in results:
+        status = f"{len(result.batch)} stations" if result.ok else f"FAILED: {result.error}"
+        print(f"Product {result.product.name} {result.product.url_for(day)}: {status} ({result.elapsed:.1f} s)")
+    solved = [(result.product, result.batch) for result in results if result.ok]
+    if not solved:
+        raise RuntimeError(f"No product available for {day:%Y-%m-%d}")
+    with metrics.span('merge'):
+        merged = products.merge(solved, merge_rule)
+    if len(results) > 1:
+        counts = Counter(merged.products.tolist())
+        print(f"Merged by {merge_rule}: {len(merged)} stations, "
+              f"{', '.join(f'{count} from {name}' for name, count in sorted(counts.items()))}")
+    return merged
+
+
+def group_scenarios_by_epoch(scenario_epochs: dict) -> dict:
+    # Scenarios of the same calculation epoch share the station listing, the product and the parse
+    groups = dict()
+    for scenario, scenario_epoch in sorted(scenario_epochs.items()):
+        groups.setdefault(scenario_epoch - timedelta(days=1), []).append(scenario)
+    return dict(sorted(groups.items()))
+
+
+def update_scenario_group(day: datetime, scenario_ids: list, group_handler=None,
+                          solution: StationBatch = None) -> None:
+    group_handler = group_handler or handler
+    print(f"Epoch {day:%Y-%m-%d}: scenarios {', '.join(scenario_ids)}")
+    station_filter = frozenset(get_list_stations(day))
+    if solution is None:
+        result_parse = process_products(day, station_filter)
+    else:
+        # All the stations of the merged products, already downloaded and parsed for another day of the week
+        with metrics.span('propagate'):
+            result_parse = solution.select(station_filter).propagate(day)
+    with metrics.span('db_write'):
+        result = group_handler.upsert_changed_station_data(result_parse, None, position_tolerance, epoch_tolerance)
+    if result.inserted + result.updated + result.unchanged < len(result_parse):
+        raise RuntimeError(f"station_tb has not been updated for {day:%Y-%m-%d}")
+    print(f"station_tb: {result.inserted} stations inserted, {result.updated} stations updated, "
+          f"{result.unchanged} stations unchanged")
+    set_stations = set(region_stations(result_parse).names.tolist())
+    for group_scenario_id in scenario_ids:
+        with metrics.span('scenario_stations'):
+            diff = group_handler.sync_scenario_stations(group_scenario_id, set_stations)
+        if diff.rolled_back:
+            # The group fails, the daemon retries it rather than moving its watermark over the scenario
+            raise RuntimeError(f"scenario_station_tb has not been updated for scenario {group_scenario_id}")
+        print(f"scenario_station_tb {group_scenario_id}: {len(diff.added)} stations added, "
+              f"{len(diff.removed)} stations removed")
+
+
+def run_scenarios(scenario_ids: list = None, date_from: datetime = None, date_to: datetime = None) -> bool:
+    """Updates several scenarios, downloading and parsing the products once per set of product files
+
+    Consecutive days resolved to the same product files (a URL with {week} but no day, e.g. a weekly product)
+    share the parse and merge, the stations are moved from their reference epoch to every calculation epoch
+    with their velocities. Daily products, such as the IGS one, are processed for every day.
+
+    :param scenario_ids: Scenario IDs to update, None to select them by the epoch window
+    :param date_from: First day of the window of calculation epochs
+    :param date_to: Last day of the window (included)
+    :return: False if a scenario is missing or a group failed
+    """
+    with metrics.span('scenario_lookup'):
+        if scenario_ids is None:
+            scenario_epochs = handler.select_scenario_epochs_in_window(epoch_column, date_from,
+                                                                      date_to + timedelta(days=1))
         else:
-            # update
-            handler.update_station_data(key, data[key])
-    updating_list_stations(set_stations)
+            scenario_epochs = handler.select_scenario_epochs(scenario_ids)
+    if scenario_epochs is None:
+        return False
+    missing = sorted(set(scenario_ids or ()) - set(scenario_epochs))
+    if missing:
+        print(f"In the database {db_name} no data or no calculation epoch for scenario_id {', '.join(missing)}")
+    groups = group_scenarios_by_epoch(scenario_epochs)
+    print(f"{len(scenario_epochs)} scenarios in {len(groups)} groups of equal epochs")
+    failed = list()
+    solutions = dict()  # all the stations of the merged products by their URLs, only the latest ones are kept
+    for day, group in groups.items():
+        urls = tuple(product.url_for(day) for product in product_list)
+        try:
+            if urls not in solutions:
+                solutions = {urls: process_products(day)}
+            update_scenario_group(day, group, solution=solutions[urls])
+        except Exception as ex:
+            print(f"Epoch {day:%Y-%m-%d} failed with error: {ex}")
+            failed.append(day)
+    return not missing and not failed
 
 
 def upd_coordinates() -> None:
-    gps_week = gnsscal.date2gpswd(epoch.date())
-    url_file = f"https://cddis.nasa.gov/archive/gnss/products/{gps_week[0]}" \
-               f"/igs{epoch.strftime('%Y')[2:]}P{gps_week[0]}{gps_week[1]}.snx.Z"
-    current_file = download(url_file)
-    gunzip(current_file)
-
-    result_parse = parse(os.path.basename(current_file)[:-2])
-    fill_geocentric_coordinates(result_parse)
+    result_parse = process_products(epoch, frozenset(stations))
 
     # отправка данных в БД odtssw_paf
     sending_data_db(result_parse)
 
-    # удаления tmp_ каталога
-    os.remove(current_file[:-2])
+
+def fetch_epoch(day: datetime) -> tuple:
+    station_filter = frozenset(get_list_stations(day))
+    # Every epoch gets its own copy of the product files, even epochs sharing them (a weekly product)
+    fetched = list()
+    for product in product_list:
+        try:
+            fetched.append((product, fetch_solution(product, day, station_filter)))
+        except Exception as ex:
+            print(f"Product {product.name} for {day:%Y-%m-%d} failed with error: {ex}")
+    if not fetched:
+        raise RuntimeError(f"No product available for {day:%Y-%m-%d}")
+    return fetched, merge_rule
+
+
+def process_epoch(fetched: list, rule: str) -> StationBatch:
+    # Parsing and merging the products of a backfill epoch in a worker process
+    return products.merge([(product, process_product(*args)) for product, args in fetched], rule)
+
+
+def poll_scenarios(watermark) -> list:
+    with pool.connection() as connection:
+        poll_handler = request_handler.RequestHandler(connection)
+        try:
+            rows = poll_handler.select_scenarios_after(watermark_column, watermark, poll_limit)
+        finally:
+            poll_handler.close()
+    if rows is None:
+        raise RuntimeError("scenario_tb could not be read")
+    return rows
+
+
+def process_scenario_group(scenario_epoch: datetime, scenario_ids: list) -> None:
+    # Groups run concurrently, each one downloads to its own files (named after the day)
+    day = scenario_epoch - timedelta(days=1)
+    with pool.connection() as connection:
+        group_handler = request_handler.RequestHandler(connection, bulk_load_threshold=bulk_load_threshold)
+        try:
+            update_scenario_group(day, scenario_ids, group_handler)
+        finally:
+            group_handler.close()
+
+
+def run_daemon(start_watermark, poll_interval: float, max_concurrency: int, state_file: str,
+               health_port: int, retry_attempts: int = daemon.RETRY_ATTEMPTS,
+               retry_delay: float = daemon.RETRY_DELAY) -> None:
+    """Processes new scenarios of scenario_tb until SIGTERM/SIGINT, reusing the tunnel, connections and caches
+
+    :param start_watermark: Watermark to start from without a state file, the current maximum if None
+    :param poll_interval: Seconds between polls of scenario_tb
+    :param max_concurrency: Maximum number of epochs processed at the same time
+    :param state_file: JSON file keeping the watermark between runs
+    :param health_port: Port of the health/status endpoint on 127.0.0.1, None to disable it
+    :param retry_attempts: Number of attempts of a failed group before it is given up
+    :param retry_delay: Seconds before the first retry of a failed group, doubled for every further one
+    """
+    if start_watermark is None and not os.path.exists(state_file):
+        # Only the scenarios created from now on are processed
+        with pool.connection() as connection:
+            start_handler = request_handler.RequestHandler(connection)
+            try:
+                start_watermark = start_handler.select_scenario_watermark(watermark_column)
+            finally:
+                start_handler.close()
+    service = daemon.ScenarioDaemon(poll_scenarios, process_scenario_group, start_watermark, poll_interval,
+                                    max_concurrency, state_file, health_port, retry_attempts, retry_delay)
+    service.install_signal_handlers()
+    print(f"Polling scenario_tb every {poll_interval:.0f} s by {watermark_column}")
+    service.run()
+
+
+def write_epoch(day: datetime, data: StationBatch) -> int:
+    with pool.connection() as connection:
+        epoch_handler = request_handler.RequestHandler(connection, bulk_load_threshold=bulk_load_threshold)
+        try:
+            with metrics.span('db_write'):
+                result = epoch_handler.upsert_changed_station_data(data, None, position_tolerance, epoch_tolerance)
+        finally:
+            epoch_handler.close()
+    if result.inserted + result.updated + result.unchanged < len(data):
+        raise RuntimeError(f"station_tb has not been updated for {day:%Y-%m-%d}")
+    return len(data)
+
+
+def run_backfill(date_from: datetime, date_to: datetime, step_days: int, download_workers: int,
+                 parse_workers: int, state_file: str = None) -> bool:
+    epochs = backfill.epochs_range(date_from, date_to, step_days)
+    print(f"Backfill of {len(epochs)} epochs from {date_from:%Y-%m-%d} to {date_to:%Y-%m-%d}")
+    results = backfill.run(epochs, fetch_epoch, process_epoch, write_epoch,
+                           download_workers=download_workers, parse_workers=parse_workers, state_file=state_file)
+    failed = [result for result in results if not result.ok]
+    metrics.count('backfill_epochs_written', len(results) - len(failed))
+    metrics.count('backfill_epochs_failed', len(failed))
+    print(f"Backfill finished: {len(results) - len(failed)} epochs written, {len(failed)} failed")
+    for result in failed:
+        print(f"  {result.epoch:%Y-%m-%d}: {result.error}")
+    return not failed
+
+
+async def timed_stage(name: str, timings: dict, func, *args):
+    start = time.perf_counter()
+    result = await asyncio.get_running_loop().run_in_executor(None, func, *args)
+    timings[name] = time.perf_counter() - start
+    print(f"Stage '{name}' finished in {timings[name]:.2f} s")
+    return result
+
+
+async def run_scenario_async() -> None:
+    """Updates the scenario like the sequential run, overlapping the stages that do not depend on each other
+
+    The FTP login runs during the SSH tunnel setup; the FTP listing and the download and parse of the products
+    run together once the epoch is known, the station_tb snapshot of the listed stations is loaded meanwhile.
+    Blocking clients run in the default executor.
+    """
+    global db_connection, handler, epoch, stations
+    timings = dict()
+    start = time.perf_counter()
+
+    ftp_ready = asyncio.ensure_future(timed_stage('ftp login', timings, discovery.warm_up))
+    db_connection = await timed_stage('db connect', timings, connect_database)
+    handler = request_handler.RequestHandler(db_connection, bulk_load_threshold=bulk_load_threshold)
+    epoch = await timed_stage('scenario lookup', timings, get_calculation_epoch) - timedelta(days=1)
+
+    listing = asyncio.ensure_future(timed_stage('ftp listing', timings, get_list_stations, epoch))
+    # The products are parsed with all their stations, the listing is not known yet
+    solution = asyncio.ensure_future(timed_stage('products', timings, process_products, epoch))
+    await ftp_ready
+    stations = await listing
+    prefetch = asyncio.ensure_future(timed_stage('db prefetch', timings, handler.load_station_snapshot,
+                                                  stations))
+    result_parse = (await solution).select(stations)
+    snapshot = await prefetch
+    await timed_stage('db write', timings, sending_data_db, result_parse, snapshot)
+
+    wall_clock = time.perf_counter() - start
+    total = sum(timings.values())
+    print(f"Wall-clock {wall_clock:.2f} s, sum of the stages {total:.2f} s, "
+          f"saved by the overlap {total - wall_clock:.2f} s")
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='Processing of the result of station coordinates refinement (IAC)')
-    parser.add_argument('--scenario_id', type=str, dest='scenario_id',
-                        default='011888',
-                        help="scenario_id for which you want to update the set of stations")
+    parser.add_argument('--scenario_id', type=str, dest='scenario_ids', nargs='+',
+                        default=['011888'],
+                        help="scenario_id for which you want to update the set of stations, several IDs are "
+                             "processed with one download and parse per calculation epoch")
+    parser.add_argument('--epoch-from', type=date_argument, dest='epoch_from',
+                        help="update every scenario of scenario_tb with the calculation epoch from this date "
+                             "(YYYY-MM-DD)")
+    parser.add_argument('--epoch-to', type=date_argument, dest='epoch_to',
+                        help="last calculation epoch of the scenarios (YYYY-MM-DD), the --epoch-from date by default")
+    parser.add_argument('--async', action='store_true', dest='async_mode',
+                        help="overlap the FTP listing, the download and the database reads")
+    parser.add_argument('--from', type=date_argument, dest='date_from',
+                        help="backfill station_tb from this date (YYYY-MM-DD) instead of processing a scenario")
+    parser.add_argument('--to', type=date_argument, dest='date_to',
+                        help="last date of the backfill (YYYY-MM-DD), the --from date by default")
+    parser.add_argument('--step', type=int, dest='step_days', default=7,
+                        help="days between backfill epochs, one epoch per GPS week by default")
+    parser.add_argument('--daemon', action='store_true', dest='daemon_mode',
+                        help="keep running and process the new scenarios of scenario_tb, see the [Daemon] section")
+    parser.add_argument('--download-workers', type=int, dest='download_workers', default=4,
+                        help="number of parallel downloads of the backfill")
+    parser.add_argument('--parse-workers', type=int, dest='parse_workers', default=None,
+                        help="number of parsing processes of the backfill, the number of CPUs by default")
+    parser.add_argument('--state-file', dest='state_file', default=None,
+                        help="JSON file keeping the progress of the backfill, a rerun from the same date resumes it")
+    region_group = parser.add_mutually_exclusive_group()
+    region_group.add_argument('--within', type=float, nargs=3, metavar=('LAT', 'LON', 'KM'),
+                              help="keep in scenario_station_tb only the stations within KM kilometers of a point")
+    region_group.add_argument('--box', type=float, nargs=4, metavar=('LAT_MIN', 'LAT_MAX', 'LON_MIN', 'LON_MAX'),
+                              help="keep in scenario_station_tb only the stations inside a latitude/longitude box, "
+                                   "LON_MIN > LON_MAX for a box across the antimeridian")
+    region_group.add_argument('--nearest', type=float, nargs=3, metavar=('LAT', 'LON', 'COUNT'),
+                              help="keep in scenario_station_tb only the COUNT stations closest to a point")
 
     args = parser.parse_args()
-    scenario_id = args.scenario_id
+    scenario_id = args.scenario_ids[0]
+    # Selection of the scenario stations, station_tb is always updated with every station
+    region = None
+    if args.within is not None:
+        region = spatial_index.Circle(*args.within)
+    elif args.box is not None:
+        region = spatial_index.Box(*args.box)
+    elif args.nearest is not None:
+        region = spatial_index.Nearest(args.nearest[0], args.nearest[1], int(args.nearest[2]))
 
     # Чтение config-файла
     config = configparser.ConfigParser(allow_no_value=True)
@@ -258,6 +561,12 @@ if __name__ == '__main__':
     username = config['Database']['username']
     password = config['Database']['password']
     port = config.getint('Database', 'port')
+    position_tolerance = config.getfloat('Database', 'position_tolerance', fallback=0.001)
+    # Without a value only the positions are compared: a new calculation epoch alone does not rewrite a station
+    epoch_tolerance_hours = config.get('Database', 'epoch_tolerance_hours', fallback='').strip()
+    epoch_tolerance = timedelta(hours=float(epoch_tolerance_hours)) if epoch_tolerance_hours else None
+    # Batches of at least this many stations are written with LOAD DATA LOCAL INFILE, 0 disables it
+    bulk_load_threshold = config.getint('Database', 'bulk_load_threshold', fallback=0) or None
     ssh_host = config['SSH']['ssh_host']
     ssh_port = config.getint('SSH', 'ssh_port')
     ssh_user = config['SSH']['ssh_user']
@@ -267,19 +576,95 @@ if __name__ == '__main__':
     ftp_pass = config['FTP']['password']
     cddis_username = config['CDDIS']['username']
     cddis_password = config['CDDIS']['password']
+    # Spans and counters are written only if a file is configured
+    metrics.configure(config.get('Metrics', 'jsonl', fallback=None),
+                      config.get('Metrics', 'prometheus', fallback=None))
+    discovery = ftp_discovery.StationDiscovery(ftp_server, ftp_login, ftp_pass,
+                                               cache_dir=config.get('FTP', 'cache_dir', fallback='ftp_cache'),
+                                               ttl=config.getfloat('FTP', 'cache_ttl', fallback=3600.0),
+                                               workers=config.getint('FTP', 'sessions', fallback=4))
+    cache = None
+    if config.getboolean('Cache', 'enabled', fallback=True):
+        cache = product_cache.ProductCache(config.get('Cache', 'directory', fallback='products_cache'),
+                                           config.getint('Cache', 'max_size_mb', fallback=2048) * 1024 * 1024,
+                                           attempts=config.getint('Download', 'attempts', fallback=5),
+                                           parallel_ranges=config.getint('Download', 'parallel_ranges', fallback=1))
+    # Parsed products by product file, an empty value disables the solution cache
+    solutions_directory = config.get('Cache', 'solutions_directory', fallback='solutions_cache')
+    # One instance for the whole run (and the daemon), its maps of the solution files stay open
+    solutions_cache = solution_cache.shared(solutions_directory) if solutions_directory else None
+    # Products of the [Product <name>] sections, downloaded and parsed concurrently and merged per station
+    product_list = products.from_config(config)
+    merge_rule = config.get('Products', 'merge', fallback=products.PRIORITY)
+    if merge_rule not in products.MERGE_RULES:
+        print(f"Unknown merge rule '{merge_rule}' in [Products], expected one of {', '.join(products.MERGE_RULES)}")
+        sys.exit(1)
+    product_workers = config.getint('Products', 'parse_workers', fallback=0) or None
+    # Column of scenario_tb with the calculation epoch, the window of --epoch-from/--epoch-to is selected on it
+    epoch_column = config.get('Database', 'epoch_column', fallback=None)
+    if args.epoch_from is not None and not epoch_column:
+        print("Selecting scenarios by epoch needs epoch_column (the calculation epoch column of scenario_tb) "
+              "in [Database]")
+        sys.exit(1)
+
+    if args.daemon_mode:
+        max_concurrency = config.getint('Daemon', 'max_concurrency', fallback=2)
+        watermark_column = config.get('Daemon', 'watermark_column', fallback='scenario_id')
+        poll_limit = config.getint('Daemon', 'poll_limit', fallback=100)
+        health_port = config.getint('Daemon', 'health_port', fallback=8787)
+        with mysqldb.ConnectionPool(host_name=host, database_name=db_name, user_name=username, user_password=password,
+                                    port=port, pool_size=max_concurrency + 1, ssh_host=ssh_host, ssh_port=ssh_port,
+                                    ssh_username=ssh_user, ssh_password=ssh_password,
+                                    allow_local_infile=bulk_load_threshold is not None) as pool:
+            run_daemon(config.get('Daemon', 'start_watermark', fallback=None),
+                       config.getfloat('Daemon', 'poll_interval', fallback=60.0), max_concurrency,
+                       config.get('Daemon', 'state_file', fallback='daemon_state.json'), health_port or None,
+                       config.getint('Daemon', 'retry_attempts', fallback=daemon.RETRY_ATTEMPTS),
+                       config.getfloat('Daemon', 'retry_delay', fallback=daemon.RETRY_DELAY))
+        discovery.close()
+        sys.exit(0)
+
+    if args.date_from is not None:
+        with mysqldb.ConnectionPool(host_name=host, database_name=db_name, user_name=username, user_password=password,
+                                    port=port, pool_size=1, ssh_host=ssh_host, ssh_port=ssh_port,
+                                    ssh_username=ssh_user, ssh_password=ssh_password,
+                                    allow_local_infile=bulk_load_threshold is not None) as pool:
+            succeeded = run_backfill(args.date_from, args.date_to or args.date_from, args.step_days,
+                                     args.download_workers, args.parse_workers, args.state_file)
+        if cache is not None:
+            print(f"Product cache: {cache.stats}")
+        discovery.close()
+        sys.exit(0 if succeeded else 1)
 
     database = mysqldb.MySQLConnection(host_name=host, database_name=db_name, user_name=username,
-                                       user_password=password, port=port)
-
-    db_connection = database.create_connection_tunnel(ssh_host=ssh_host, ssh_port=ssh_port, ssh_username=ssh_user,
-                                                      ssh_password=ssh_password)
+                                       user_password=password, port=port,
+                                       allow_local_infile=bulk_load_threshold is not None)
 
-    handler = request_handler.RequestHandler(db_connection)
     session = SessionWithHeaderRedirection(cddis_username, cddis_password)
-    epoch = get_calculation_epoch() - timedelta(days=1)
+    succeeded = True
+    if args.epoch_from is not None or len(args.scenario_ids) > 1:
+        db_connection = connect_database()
+        handler = request_handler.RequestHandler(db_connection, bulk_load_threshold=bulk_load_threshold)
+        succeeded = run_scenarios(args.scenario_ids if args.epoch_from is None else None, args.epoch_from,
+                                  args.epoch_to or args.epoch_from)
+    elif args.async_mode:
+        asyncio.run(run_scenario_async())
+    else:
+        db_connection = connect_database()
+
+        handler = request_handler.RequestHandler(db_connection, bulk_load_threshold=bulk_load_threshold)
+        epoch = get_calculation_epoch() - timedelta(days=1)
+
+        stations = get_list_stations()
+        upd_coordinates()
+
+    if cache is not None:
+        print(f"Product cache: {cache.stats}")
 
-    stations = get_list_stations()
-    upd_coordinates()
+    discovery.close()
 
     # Закрыть подключение к БД
+    handler.close()
     database.close_connection()
+    if not succeeded:
+        sys.exit(1)
@@ -0,0 +1,92 @@
+import json
+from datetime import datetime
+
+import pytest
+
+import backfill
+
+EPOCHS = backfill.epochs_range(datetime(2022, 1, 2), datetime(2022, 2, 6))
+
+
+def parse(epoch: datetime, fail: bool) -> int:
+    # Runs in the worker processes of backfill.run
+    if fail:
+        raise ValueError(f"corrupted product of {epoch:%Y-%m-%d}")
+    return epoch.day
+
+
+class Pipeline:
+    """
+    fetch/write callables of a backfill failing at the given epochs
+    """
+
+    def __init__(self, fetch_failures=(), parse_failures=(), write_failures=()):
+        self.fetch_failures = set(fetch_failures)
+        self.parse_failures = set(parse_failures)
+        self.write_failures = set(write_failures)
+        self.fetched = []
+        self.written = []
+
+    def fetch(self, epoch: datetime) -> tuple:
+        self.fetched.append(epoch)
+        if epoch in self.fetch_failures:
+            raise ConnectionError('product not published')
+        return epoch, epoch in self.parse_failures
+
+    def write(self, epoch: datetime, day: int) -> int:
+        if epoch in self.write_failures:
+            raise RuntimeError('station_tb has not been updated')
+        self.written.append((epoch, day))
+        return 10
+
+    def run(self, epochs=EPOCHS, **options) -> list:
+        return backfill.run(epochs, self.fetch, parse, self.write, download_workers=3, parse_workers=2, **options)
+
+
+def test_epochs_range():
+    assert EPOCHS == [datetime(2022, 1, 2), datetime(2022, 1, 9), datetime(2022, 1, 16), datetime(2022, 1, 23),
+                      datetime(2022, 1, 30), datetime(2022, 2, 6)]
+    assert backfill.epochs_range(datetime(2022, 1, 2), datetime(2022, 1, 4), 1)[-1] == datetime(2022, 1, 4)
+    assert backfill.epochs_range(datetime(2022, 1, 2), datetime(2022, 1, 1)) == []
+
+
+def test_a_failure_only_fails_its_own_epoch():
+    pipeline = Pipeline(fetch_failures=[EPOCHS[1]], parse_failures=[EPOCHS[2]], write_failures=[EPOCHS[4]])
+    results = pipeline.run(max_in_flight=2)
+    assert [result.epoch for result in results] == EPOCHS
+    assert [result.ok for result in results] == [True, False, False, True, False, True]
+    assert 'ConnectionError' in results[1].error and 'corrupted product' in results[2].error
+    assert 'station_tb' in results[4].error
+    assert [result.stations for result in results if result.ok] == [10, 10, 10]
+    # Written by the single writer in chronological order
+    assert pipeline.written == [(EPOCHS[0], 2), (EPOCHS[3], 23), (EPOCHS[5], 6)]
+
+
+def test_a_rerun_resumes_after_the_epochs_written_in_order(tmp_path):
+    state_file = str(tmp_path / 'backfill_state.json')
+    first = Pipeline(write_failures=[EPOCHS[2]])
+    assert [result.ok for result in first.run(state_file=state_file)] == [True, True, False, True, True, True]
+    with open(state_file) as f:
+        assert json.load(f)['written_through'] == EPOCHS[1].isoformat()
+    # The epochs after the failed one are written again after it, in order
+    second = Pipeline()
+    assert [result.epoch for result in second.run(state_file=state_file)] == EPOCHS[2:]
+    assert [epoch for epoch, _ in second.written] == EPOCHS[2:]
+    third = Pipeline()
+    assert third.run(state_file=state_file) == [] and third.fetched == []
+
+
+def test_the_progress_of_another_backfill_is_not_used(tmp_path):
+    state_file = str(tmp_path / 'backfill_state.json')
+    Pipeline().run(EPOCHS[2:], state_file=state_file)
+    pipeline = Pipeline()
+    assert len(pipeline.run(state_file=state_file)) == len(EPOCHS)
+    assert backfill.load_progress(state_file, EPOCHS[0]) == EPOCHS[-1]
+
+
+@pytest.mark.parametrize('contents', ['', '{"first": "2022-01-02T00:00:00"}', 'not json'])
+def test_an_unreadable_state_file_starts_over(tmp_path, contents):
+    state_file = tmp_path / 'backfill_state.json'
+    state_file.write_text(contents)
+    assert backfill.load_progress(str(state_file), EPOCHS[0]) is None
+    assert backfill.load_progress(str(tmp_path / 'missing.json'), EPOCHS[0]) is None
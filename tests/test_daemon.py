@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+import daemon
+import metrics
+
+EPOCH = datetime(2022, 1, 1)
+
+
+class FakeScenarios:
+    """
+    poll/process callables of a daemon: one poll returns rows, process fails the first `failures` calls
+    """
+
+    def __init__(self, rows: list, failures: int = 0):
+        self.rows = rows
+        self.failures = failures
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def poll(self, watermark) -> list:
+        rows, self.rows = self.rows, []
+        return rows
+
+    def process(self, epoch, scenario_ids) -> None:
+        with self.lock:
+            self.calls.append((epoch, tuple(scenario_ids)))
+            if len(self.calls) <= self.failures:
+                raise ConnectionError('product not published yet')
+
+
+def run_until(service: daemon.ScenarioDaemon, condition, timeout: float = 5.0) -> None:
+    thread = threading.Thread(target=service.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    service.stop()
+    thread.join(5)
+    assert not thread.is_alive()
+
+
+def daemon_for(scenarios: FakeScenarios, **options) -> daemon.ScenarioDaemon:
+    return daemon.ScenarioDaemon(scenarios.poll, scenarios.process, watermark=(0, '0'), poll_interval=0.05,
+                                 retry_delay=0.01, **options)
+
+
+def test_retries_a_failed_group_before_advancing_the_watermark():
+    scenarios = FakeScenarios([((5, '1'), '1', EPOCH), ((5, '2'), '2', EPOCH)], failures=2)
+    service = daemon_for(scenarios, retry_attempts=5)
+    run_until(service, lambda: service.status()['processed_scenarios'] == 2)
+    status = service.status()
+    assert scenarios.calls == [(EPOCH, ('1', '2'))] * 3
+    assert status['failed_groups'] == 2
+    assert status['abandoned_scenarios'] == 0
+    assert status['committed_watermark'] == (5, '2')
+
+
+def test_keeps_the_watermark_while_a_group_waits_for_its_retry():
+    scenarios = FakeScenarios([((5, '1'), '1', EPOCH)], failures=1)
+    service = daemon_for(scenarios)
+    service.retry_delay = 60.0
+    run_until(service, lambda: service.status()['failed_groups'] == 1)
+    status = service.status()
+    assert status['retrying'] == {str(EPOCH): 1}
+    assert status['pending'] == {str(EPOCH): ['1']}
+    assert status['committed_watermark'] == (0, '0')
+
+
+def test_gives_up_a_group_after_the_attempts():
+    scenarios = FakeScenarios([((5, '1'), '1', EPOCH)], failures=10)
+    service = daemon_for(scenarios, retry_attempts=3)
+    run_until(service, lambda: service.status()['abandoned_scenarios'] == 1)
+    status = service.status()
+    assert len(scenarios.calls) == 3
+    assert status['retrying'] == {}
+    assert status['committed_watermark'] == (5, '1')
+
+
+def test_skips_scenarios_without_epoch():
+    scenarios = FakeScenarios([((5, '1'), '1', None), ((5, '2'), '2', EPOCH), ((6, '3'), '3', None)])
+    service = daemon_for(scenarios)
+    run_until(service, lambda: service.status()['committed_watermark'] == (6, '3'))
+    assert scenarios.calls == [(EPOCH, ('2',))]
+    assert service.status()['committed_watermark'] == (6, '3')
+
+
+def test_flushes_the_metrics_while_running(tmp_path):
+    textfile = str(tmp_path / 'station_handler.prom')
+    metrics.configure(prometheus_path=textfile)
+    try:
+        scenarios = FakeScenarios([((5, '1'), '1', EPOCH)])
+        service = daemon_for(scenarios)
+        flushed = []
+
+        def processed_and_flushed():
+            if service.status()['processed_scenarios'] == 1 and os.path.exists(textfile):
+                with open(textfile) as f:
+                    flushed.append(f.read())
+            return bool(flushed)
+
+        run_until(service, processed_and_flushed)
+        # Read while the service was still running, long before the exit handler
+        assert flushed and 'station_handler_daemon_scenarios_polled_total 1' in flushed[0]
+    finally:
+        metrics.configure()
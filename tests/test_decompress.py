@@ -0,0 +1,87 @@
+import gzip
+import random
+import shutil
+import subprocess
+
+import pytest
+
+import decompress
+from benchmarks import synthetic
+
+SINEX = synthetic.generate_sinex(300, matrix_rows=2000).encode('ascii')
+# Random bytes hardly repeat: about one code per byte fills the 16-bit table
+NOISE = random.Random(0).randbytes(200000)
+# Every string is the previous one plus its own first byte: almost every code is the KwKwK case
+RUN = b'a' * 20000
+
+
+def write(tmp_path, name: str, contents: bytes) -> str:
+    path = tmp_path / name
+    path.write_bytes(contents)
+    return str(path)
+
+
+def read_all(file: str, chunk_size: int = decompress.READ_CHUNK_SIZE) -> bytes:
+    return b''.join(decompress.iter_file(file, chunk_size))
+
+
+def gzip_reference(compressed: bytes) -> bytes:
+    # gzip -d also reads the .Z format, an independent decoder for the streams written by compress_z
+    if shutil.which('gzip') is None:
+        pytest.skip('gzip is not installed')
+    return subprocess.run(['gzip', '-dc'], input=compressed, capture_output=True, check=True).stdout
+
+
+@pytest.mark.parametrize('data', [SINEX, NOISE, RUN], ids=['sinex', 'noise', 'run'])
+@pytest.mark.parametrize('max_bits', [10, 12, 16])
+@pytest.mark.parametrize('clear', [False, True], ids=['no_clear', 'clear'])
+def test_z_files_match_gzip(tmp_path, data, max_bits, clear):
+    compressed = synthetic.compress_z(data, max_bits, clear)
+    assert gzip_reference(compressed) == data
+    assert read_all(write(tmp_path, 'product.snx.Z', compressed)) == data
+
+
+@pytest.mark.parametrize('max_bits', [10, 16])
+def test_clear_codes_are_written_once_the_table_is_full(max_bits):
+    # Otherwise the cases with clear would not test anything more
+    data = SINEX + NOISE
+    assert synthetic.compress_z(data, max_bits, clear=True) != synthetic.compress_z(data, max_bits)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 1000, 65537])
+def test_chunks_splitting_codes(tmp_path, chunk_size):
+    file = write(tmp_path, 'product.snx.Z', synthetic.compress_z(SINEX + NOISE, clear=True))
+    assert read_all(file, chunk_size) == SINEX + NOISE
+
+
+def test_without_numpy(tmp_path, monkeypatch):
+    file = write(tmp_path, 'product.snx.Z', synthetic.compress_z(SINEX + NOISE + RUN, clear=True))
+    expected = read_all(file)
+    monkeypatch.setattr(decompress, 'np', None)
+    assert read_all(file) == expected == SINEX + NOISE + RUN
+    assert read_all(file, 5) == expected
+
+
+@pytest.mark.parametrize('chunk_size', [1, 10, decompress.READ_CHUNK_SIZE])
+def test_gzip_members_are_concatenated(tmp_path, chunk_size):
+    file = write(tmp_path, 'product.SNX.gz', gzip.compress(SINEX) + gzip.compress(RUN) + gzip.compress(b''))
+    assert read_all(file, chunk_size) == SINEX + RUN
+
+
+def test_uncompressed_files_are_passed_through(tmp_path):
+    assert read_all(write(tmp_path, 'product.snx', SINEX), 1) == SINEX
+    assert read_all(write(tmp_path, 'empty.snx', b'')) == b''
+
+
+@pytest.mark.parametrize('compressed', [b'\x1f\x9d', b'\x1f\x9d\x91', b'\x1f\x9d\x88'],
+                         ids=['truncated_header', 'max_bits_17', 'max_bits_8'])
+def test_bad_headers_are_rejected(compressed):
+    with pytest.raises(ValueError):
+        b''.join(decompress.iter_unlzw([compressed]))
+
+
+def test_codes_outside_the_table_are_rejected():
+    # Second 9-bit code 300 while the table only has the literals, CLEAR and one free entry
+    codes = 65 | 300 << 9
+    with pytest.raises(ValueError, match='code 300'):
+        b''.join(decompress.iter_unlzw([b'\x1f\x9d\x90' + codes.to_bytes(3, 'little')]))
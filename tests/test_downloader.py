@@ -0,0 +1,156 @@
+import os
+import re
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import downloader
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """
+    Serves server.content with an ETag, Range and If-Range
+
+    Before answering, the n-th request applies server.script[n] (if any): a dict with 'content' to replace
+    the file (with a new ETag) and 'drop' to close the connection after that many bytes of the body.
+    """
+
+    def do_GET(self) -> None:
+        server = self.server
+        with server.lock:
+            step = server.script[len(server.requests)] if len(server.requests) < len(server.script) else {}
+            server.requests.append(dict(self.headers))
+            if 'content' in step:
+                server.content = step['content']
+                server.version += 1
+        content, etag = server.content, f'"v{server.version}"'
+        first, last = 0, len(content) - 1
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if_range = self.headers.get('If-Range')
+        if match is not None and (if_range is None or if_range == etag):
+            first = int(match.group(1))
+            last = int(match.group(2)) if match.group(2) else last
+            if first >= len(content):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(content)}')
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {first}-{last}/{len(content)}')
+        else:
+            self.send_response(200)
+        body = content[first:last + 1]
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if step.get('drop') is not None:
+            self.wfile.write(body[:step['drop']])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+@contextmanager
+def range_server(content: bytes, script: list = ()):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    server.daemon_threads = True
+    server.content = content
+    server.version = 1
+    server.script = list(script)
+    server.requests = list()
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server, f"http://127.0.0.1:{server.server_address[1]}/file.snx"
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    # The data received before a broken connection is only written by whole chunks
+    monkeypatch.setattr(downloader, 'CHUNK_SIZE', 4096)
+
+
+def fetch(url: str, path: str, **options) -> downloader.DownloadResult:
+    with requests.Session() as session:
+        return downloader.download(url, path, session, backoff=0.0, timeout=5.0, **options)
+
+
+def read(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_resumes_after_a_broken_connection(tmp_path):
+    content = bytes(range(256)) * 400
+    with range_server(content, [{'drop': 30000}]) as (server, url):
+        result = fetch(url, str(tmp_path / 'file.snx'))
+    assert read(result.path) == content
+    assert result.attempts == 2
+    offset = int(re.match(r'bytes=(\d+)-$', server.requests[1]['Range']).group(1))
+    assert 0 < offset <= 30000
+    assert server.requests[1]['If-Range'] == '"v1"'
+    assert not os.path.exists(str(tmp_path / 'file.snx.part.validator'))
+
+
+def test_restarts_when_the_file_changed_between_attempts(tmp_path):
+    with range_server(b'A' * 50000, [{'drop': 20000}, {'content': b'B' * 60000}]) as (server, url):
+        result = fetch(url, str(tmp_path / 'file.snx'))
+    assert read(result.path) == b'B' * 60000
+    assert server.requests[1]['If-Range'] == '"v1"'
+
+
+def test_discards_a_part_file_without_validator(tmp_path):
+    path = str(tmp_path / 'file.snx')
+    with open(path + '.part', 'wb') as f:
+        f.write(b'old data of another run')
+    with range_server(b'C' * 1000) as (server, url):
+        result = fetch(url, path)
+    assert read(result.path) == b'C' * 1000
+    assert 'Range' not in server.requests[0]
+
+
+def test_discards_a_part_file_of_another_version(tmp_path):
+    path = str(tmp_path / 'file.snx')
+    with open(path + '.part', 'wb') as f:
+        f.write(b'A' * 500)
+    with open(path + '.part.validator', 'w') as f:
+        f.write('"v0"')
+    with range_server(b'B' * 1000) as (server, url):
+        result = fetch(url, path)
+    assert read(result.path) == b'B' * 1000
+    assert server.requests[0]['If-Range'] == '"v0"'
+
+
+def test_parallel_ranges_restart_when_the_file_changes(tmp_path):
+    # The probe sees version 1, the ranges get the whole version 2
+    with range_server(b'A' * 40000, [{}, {'content': b'B' * 40000}]) as (server, url):
+        result = fetch(url, str(tmp_path / 'file.snx'), parallel_ranges=4, min_range_size=10000)
+    assert read(result.path) == b'B' * 40000
+
+
+def test_parallel_ranges_retry_a_broken_range(tmp_path):
+    content = bytes(range(256)) * 160
+    with range_server(content, [{}, {'drop': 100}]) as (server, url):
+        result = fetch(url, str(tmp_path / 'file.snx'), parallel_ranges=4, min_range_size=10000)
+    assert read(result.path) == content
+
+
+def test_gives_up_after_the_attempts(tmp_path):
+    with range_server(b'D' * 1000, [{'drop': 10}] * 3) as (server, url):
+        with pytest.raises(downloader.DownloadError):
+            fetch(url, str(tmp_path / 'file.snx'), attempts=3)
+    assert len(server.requests) == 3
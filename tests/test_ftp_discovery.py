@@ -0,0 +1,153 @@
+import ftplib
+import os
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+import ftp_discovery
+from benchmarks.servers import LOCALHOST, ftp_server
+
+DAY = datetime(2022, 1, 1)
+
+
+class FakeFTP:
+    """
+    Stand-in for ftplib.FTP listing the same files for every directory
+
+    Class attributes configure the behaviour of all the sessions of a test: mlsd_error makes MLSD fail,
+    list_hook is called by every listing (to block or fail it).
+    """
+    files = ('abmf0010.22o', 'zimm0010.22o')
+    mlsd_error = None
+    list_hook = None
+    connects = 0
+    listings = 0
+    lock = threading.Lock()
+
+    def __init__(self, server: str):
+        with FakeFTP.lock:
+            FakeFTP.connects += 1
+        self.alive = True
+
+    def login(self, user: str, password: str) -> None:
+        pass
+
+    def voidcmd(self, command: str) -> None:
+        if not self.alive:
+            raise ftplib.error_temp('421 Timeout')
+
+    def mlsd(self, path: str, facts=()):
+        self.__listed()
+        if FakeFTP.mlsd_error is not None:
+            raise ftplib.error_perm(FakeFTP.mlsd_error)
+        return [(name, {'type': 'file'}) for name in self.files] + [('sub', {'type': 'dir'})]
+
+    def nlst(self, path: str) -> list:
+        self.__listed()
+        return [f"{path}/{name}" for name in self.files]
+
+    def quit(self) -> None:
+        self.alive = False
+
+    def close(self) -> None:
+        self.alive = False
+
+    def __listed(self) -> None:
+        with FakeFTP.lock:
+            FakeFTP.listings += 1
+        if FakeFTP.list_hook is not None:
+            FakeFTP.list_hook()
+
+
+@pytest.fixture(autouse=True)
+def reset_fake():
+    FakeFTP.mlsd_error = None
+    FakeFTP.list_hook = None
+    FakeFTP.connects = 0
+    FakeFTP.listings = 0
+
+
+def discovery(**options) -> ftp_discovery.StationDiscovery:
+    return ftp_discovery.StationDiscovery('ftp.example', 'user', 'password', ftp_class=FakeFTP, **options)
+
+
+def test_lists_with_mlsd_and_caches_the_day(tmp_path):
+    with discovery(cache_dir=str(tmp_path)) as stations:
+        assert stations.list_day(DAY) == {'abmf', 'zimm'}
+        assert stations.list_day(DAY) == {'abmf', 'zimm'}
+    assert FakeFTP.listings == 1
+    assert os.listdir(str(tmp_path)) == ['ftp_2022_001.json']
+
+
+def test_falls_back_to_nlst():
+    FakeFTP.mlsd_error = '502 Command not implemented'
+    with discovery() as stations:
+        assert stations.list_day(DAY) == {'abmf', 'zimm'}
+        assert stations.list_day(DAY + timedelta(days=1)) == {'abmf', 'zimm'}
+    # MLSD is not tried again once the server refused it
+    assert FakeFTP.listings == 3
+
+
+def test_reuses_at_most_workers_sessions():
+    with discovery(workers=2) as stations:
+        result = stations.list_days(DAY + timedelta(days=i) for i in range(8))
+    assert len(result) == 8
+    assert FakeFTP.connects <= 2
+
+
+def test_replaces_a_dead_session():
+    with discovery(workers=1) as stations:
+        stations.warm_up()
+        stations.close()
+        stations.list_day(DAY)
+    assert FakeFTP.connects == 2
+
+
+def test_a_failed_session_wakes_a_waiting_thread():
+    holding = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def hook():
+        calls.append(1)
+        if len(calls) == 1:
+            holding.set()
+            release.wait(5)
+            raise ftplib.error_temp('421 Connection lost')
+
+    FakeFTP.list_hook = hook
+    stations = discovery(workers=1)
+    errors = []
+    results = []
+
+    def first():
+        try:
+            stations.list_day(DAY)
+        except ftplib.error_temp as ex:
+            errors.append(ex)
+
+    threads = [threading.Thread(target=first, daemon=True)]
+    threads[0].start()
+    assert holding.wait(5)
+    # The only session is in use, the second thread waits for it
+    threads.append(threading.Thread(target=lambda: results.append(stations.list_day(DAY + timedelta(days=1))),
+                                   daemon=True))
+    threads[1].start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert not any(thread.is_alive() for thread in threads)
+    assert len(errors) == 1
+    assert results == [{'abmf', 'zimm'}]
+    stations.close()
+
+
+def test_lists_a_local_ftp_server(tmp_path):
+    daily = tmp_path / ftp_discovery.DAILY_DIRECTORY.format(year=2022, doy=1, yy=22)
+    daily.mkdir(parents=True)
+    for name in ('abmf0010.22o', 'zimm0010.22o'):
+        (daily / name).write_bytes(b'')
+    with ftp_server(str(tmp_path)) as ftp_class, \
+            ftp_discovery.StationDiscovery(LOCALHOST, 'anonymous', '', ftp_class=ftp_class) as stations:
+        assert stations.list_day(DAY) == {'abmf', 'zimm'}
@@ -0,0 +1,79 @@
+import math
+
+import numpy as np
+import pytest
+
+import geodesy
+from benchmarks import synthetic
+
+METHODS = [geodesy.BOWRING, geodesy.ITERATIVE]
+# Latitude, longitude, height: equator, poles and near them, antimeridian, below the ellipsoid
+SPECIAL = np.array([(0.0, 0.0, 0.0), (0.0, 90.0, 120.0), (0.0, 180.0, -100.0), (0.0, -90.0, 8848.0),
+                    (90.0, 0.0, 100.0), (-90.0, 0.0, -50.0), (89.9999, 10.0, 10.0), (-89.9999, -170.0, 2800.0),
+                    (31.5, 35.5, -430.0), (11.35, 142.2, -10994.0), (45.0, -120.0, 3000.0)])
+
+
+def station_xyz(count: int = 2000) -> np.ndarray:
+    return np.array([position[1:] for position in synthetic.station_positions(count)])
+
+
+def surface_error_m(blh: np.ndarray, expected: np.ndarray) -> np.ndarray:
+    """
+    Distances in meters between geodetic coordinates (north, east, up differences combined)
+    """
+    north = np.radians(blh[:, 0] - expected[:, 0]) * geodesy.A
+    east = np.radians((blh[:, 1] - expected[:, 1] + 180.0) % 360.0 - 180.0) * geodesy.A * \
+        np.cos(np.radians(expected[:, 0]))
+    return np.sqrt(north ** 2 + east ** 2 + (blh[:, 2] - expected[:, 2]) ** 2)
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_special_points_round_trip(method):
+    blh = geodesy.ecef2blh(geodesy.blh2ecef(SPECIAL), method)
+    assert surface_error_m(blh, SPECIAL).max() < 1e-6
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_points_on_the_polar_axis(method):
+    xyz = [(0.0, 0.0, geodesy.B + 100.0), (0.0, 0.0, -geodesy.B - 50.0), (0.0, 0.0, geodesy.B - 1000.0)]
+    np.testing.assert_allclose(geodesy.ecef2blh(xyz, method)[:, [0, 2]], [(90.0, 100.0), (-90.0, 50.0),
+                                                                          (90.0, -1000.0)], rtol=0, atol=1e-6)
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_points_on_the_equator(method):
+    xyz = [(geodesy.A + 10.0, 0.0, 0.0), (0.0, -geodesy.A + 200.0, 0.0), (-geodesy.A, 0.0, 0.0)]
+    np.testing.assert_allclose(geodesy.ecef2blh(xyz, method), [(0.0, 0.0, 10.0), (0.0, -90.0, -200.0),
+                                                               (0.0, 180.0, 0.0)], rtol=0, atol=1e-6)
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_agrees_with_the_scalar_conversion(method):
+    stations_handler = pytest.importorskip('stations_handler')
+    xyz = np.concatenate((station_xyz(), geodesy.blh2ecef(SPECIAL[SPECIAL[:, 0] % 90.0 != 0.0])))
+    expected = np.array([stations_handler.ecef2blh(*point) for point in xyz])
+    assert surface_error_m(geodesy.ecef2blh(xyz, method), expected).max() < 1e-4
+
+
+def test_methods_agree_and_the_iterative_one_converges():
+    xyz = station_xyz()
+    bowring = geodesy.ecef2blh(xyz, geodesy.BOWRING)
+    iterative = geodesy.ecef2blh(xyz, geodesy.ITERATIVE)
+    assert surface_error_m(bowring, iterative).max() < 1e-6
+    np.testing.assert_allclose(geodesy.blh2ecef(iterative), xyz, rtol=0, atol=1e-6)
+
+
+def test_shapes_and_unknown_methods():
+    assert geodesy.ecef2blh(np.empty((0, 3))).shape == (0, 3)
+    assert geodesy.ecef2blh([geodesy.A, 0.0, 0.0]).shape == (1, 3)
+    assert geodesy.blh2ecef([0.0, 0.0, 0.0]).tolist() == [[geodesy.A, 0.0, 0.0]]
+    with pytest.raises(ValueError):
+        geodesy.ecef2blh([(geodesy.A, 0.0, 0.0)], 'vincenty')
+
+
+def test_heights_below_the_ellipsoid():
+    blh = np.array([(lat, 10.0, height) for lat in (-60.0, 0.0, 45.0) for height in (-1.0, -430.0, -11000.0)])
+    for method in METHODS:
+        result = geodesy.ecef2blh(geodesy.blh2ecef(blh), method)
+        np.testing.assert_allclose(result[:, 2], blh[:, 2], rtol=0, atol=1e-6)
+        assert math.isclose(result[:, 0].sum(), blh[:, 0].sum(), abs_tol=1e-9)
@@ -0,0 +1,147 @@
+import threading
+import time
+
+import pytest
+from mysql.connector import Error
+from mysql.connector.errors import PoolError
+
+import mysqldb
+
+
+class FakePoolConnection:
+    def __init__(self, **options):
+        self.options = options
+        self.connected = True
+        self.closed = False
+        self.rollback_error = None
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    def rollback(self) -> None:
+        if self.rollback_error is not None:
+            raise self.rollback_error
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class FakeTunnel:
+    instances = []
+
+    def __init__(self, address, **options):
+        self.address = address
+        self.is_active = False
+        self.local_bind_port = 40000 + len(FakeTunnel.instances)
+        self.restarts = 0
+        FakeTunnel.instances.append(self)
+
+    def start(self) -> None:
+        self.is_active = True
+
+    def restart(self) -> None:
+        self.restarts += 1
+        self.is_active = True
+
+    def close(self) -> None:
+        self.is_active = False
+
+
+@pytest.fixture
+def opened():
+    return []
+
+
+@pytest.fixture
+def pool(opened):
+    FakeTunnel.instances = []
+
+    def connect(**options):
+        opened.append(FakePoolConnection(**options))
+        return opened[-1]
+
+    with mysqldb.ConnectionPool('db.example', 'odtssw_paf', 'user', 'password', 3306, pool_size=2, timeout=0.05,
+                                ssh_host='ssh.example', connect=connect, tunnel_class=FakeTunnel) as result:
+        yield result
+
+
+def test_returned_connections_are_reused(pool, opened):
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert second is first
+    assert len(opened) == 1
+    assert opened[0].options['port'] == FakeTunnel.instances[0].local_bind_port
+
+
+def test_borrow_waits_for_a_free_connection(pool, opened):
+    first = pool.borrow()
+    pool.borrow()
+    with pytest.raises(PoolError):
+        pool.borrow()
+    pool.give_back(first)
+    assert pool.borrow() is first
+    assert len(opened) == 2
+
+
+def test_broken_connections_are_discarded_on_borrow(pool, opened):
+    with pool.connection() as first:
+        pass
+    first.connected = False
+    with pool.connection() as second:
+        assert second is not first
+    assert first.closed
+    # The discarded connection does not count against the size of the pool
+    pool.borrow()
+    pool.borrow()
+
+
+def test_a_connection_failing_its_rollback_is_discarded(pool, opened):
+    connection = pool.borrow()
+    connection.rollback_error = Error('Lost connection')
+    pool.give_back(connection)
+    assert connection.closed
+    assert pool.borrow() is not connection
+
+
+def test_the_tunnel_is_shared_and_restarted_when_it_drops(pool, opened):
+    first = pool.borrow()
+    FakeTunnel.instances[0].is_active = False
+    pool.borrow()
+    assert len(FakeTunnel.instances) == 1
+    assert FakeTunnel.instances[0].restarts == 1
+    pool.give_back(first)
+
+
+def test_close_closes_idle_connections_and_the_tunnel(pool, opened):
+    idle = pool.borrow()
+    borrowed = pool.borrow()
+    pool.give_back(idle)
+    pool.close()
+    assert idle.closed and not borrowed.closed
+    assert not FakeTunnel.instances[0].is_active
+    with pytest.raises(PoolError):
+        pool.borrow()
+    pool.give_back(borrowed)
+    assert borrowed.closed
+
+
+def test_a_connection_given_back_broken_wakes_a_waiting_borrower(opened):
+    def connect(**options):
+        opened.append(FakePoolConnection(**options))
+        return opened[-1]
+
+    with mysqldb.ConnectionPool('db.example', 'odtssw_paf', 'user', 'password', 3306, pool_size=1, timeout=5.0,
+                                connect=connect) as pool:
+        held = pool.borrow()
+        borrowed = []
+        waiter = threading.Thread(target=lambda: borrowed.append(pool.borrow()), daemon=True)
+        start = time.monotonic()
+        waiter.start()
+        time.sleep(0.1)
+        held.rollback_error = Error('Lost connection')
+        pool.give_back(held)
+        waiter.join(5)
+        assert time.monotonic() - start < 2.0
+        assert len(borrowed) == 1 and borrowed[0] is not held
+        assert held.closed
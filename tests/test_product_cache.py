@@ -0,0 +1,115 @@
+import functools
+import os
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+import requests
+
+import product_cache
+from benchmarks.servers import LOCALHOST, QuietHTTPRequestHandler, http_server
+
+
+class CountingHandler(QuietHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self) -> None:
+        CountingHandler.requests.append(dict(self.headers))
+        super().do_GET()
+
+
+@pytest.fixture
+def served(tmp_path):
+    directory = tmp_path / 'server'
+    directory.mkdir()
+    with http_server(str(directory)) as url, requests.Session() as session:
+        yield directory, url, session
+
+
+@pytest.fixture
+def counted(tmp_path):
+    directory = tmp_path / 'server'
+    directory.mkdir()
+    CountingHandler.requests = []
+    server = ThreadingHTTPServer((LOCALHOST, 0), functools.partial(CountingHandler, directory=str(directory)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        with requests.Session() as session:
+            yield directory, f"http://{LOCALHOST}:{server.server_address[1]}", session, server
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def publish(directory, name: str, contents: bytes, mtime: float = 1.6e9) -> None:
+    path = directory / name
+    path.write_bytes(contents)
+    os.utime(str(path), (mtime, mtime))
+
+
+def read(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_unchanged_products_are_revalidated(tmp_path, served):
+    directory, url, session = served
+    publish(directory, 'igs22P21906.snx.Z', b'week 2190')
+    cache = product_cache.ProductCache(str(tmp_path / 'cache'), backoff=0.0)
+    first = cache.get(f"{url}/igs22P21906.snx.Z", session)
+    second = cache.get(f"{url}/igs22P21906.snx.Z", session)
+    assert first == second and read(second) == b'week 2190'
+    assert (cache.stats.misses, cache.stats.hits, cache.stats.revalidated) == (1, 1, 1)
+    cache.get(f"{url}/igs22P21906.snx.Z", session, revalidate=False)
+    assert cache.stats.hits == 2
+
+
+def test_changed_products_are_downloaded_again(tmp_path, served):
+    directory, url, session = served
+    publish(directory, 'igs22P21906.snx.Z', b'first version')
+    cache = product_cache.ProductCache(str(tmp_path / 'cache'), backoff=0.0)
+    cache.get(f"{url}/igs22P21906.snx.Z", session)
+    publish(directory, 'igs22P21906.snx.Z', b'second version', mtime=1.7e9)
+    assert read(cache.get(f"{url}/igs22P21906.snx.Z", session)) == b'second version'
+    assert cache.stats.misses == 2
+    assert cache.stats.bytes_downloaded == len(b'first version') + len(b'second version')
+
+
+def test_least_recently_used_products_are_evicted(tmp_path, served):
+    directory, url, session = served
+    for name in ('a.snx', 'b.snx', 'c.snx'):
+        publish(directory, name, name.encode('ascii') * 100)
+    cache = product_cache.ProductCache(str(tmp_path / 'cache'), max_bytes=1000, backoff=0.0)
+    paths = [cache.get(f"{url}/{name}", session) for name in ('a.snx', 'b.snx')]
+    os.utime(paths[0], (1.6e9, 1.6e9))
+    os.utime(paths[1], (1.7e9, 1.7e9))
+    cache.get(f"{url}/c.snx", session)
+    assert not os.path.exists(paths[0]) and os.path.exists(paths[1])
+    assert cache.stats.evictions == 1
+
+
+def test_a_changed_product_costs_one_request(tmp_path, counted):
+    directory, url, session, _ = counted
+    publish(directory, 'igs22P21906.snx.Z', b'first version')
+    cache = product_cache.ProductCache(str(tmp_path / 'cache'), backoff=0.0)
+    cache.get(f"{url}/igs22P21906.snx.Z", session)
+    publish(directory, 'igs22P21906.snx.Z', b'second version', mtime=1.7e9)
+    CountingHandler.requests = []
+    assert read(cache.get(f"{url}/igs22P21906.snx.Z", session)) == b'second version'
+    assert len(CountingHandler.requests) == 1
+    assert 'If-Modified-Since' in CountingHandler.requests[0]
+
+
+def test_the_cached_copy_is_served_when_the_server_is_down(tmp_path, counted):
+    directory, url, session, server = counted
+    publish(directory, 'igs22P21906.snx.Z', b'week 2190')
+    cache = product_cache.ProductCache(str(tmp_path / 'cache'), attempts=2, backoff=0.0, timeout=1.0)
+    cache.get(f"{url}/igs22P21906.snx.Z", session)
+    server.shutdown()
+    server.server_close()
+    assert read(cache.get(f"{url}/igs22P21906.snx.Z", session)) == b'week 2190'
+    assert cache.stats.stale == 1
+    with pytest.raises(product_cache.downloader.DownloadError):
+        cache.get(f"{url}/another.snx.Z", session)
@@ -0,0 +1,90 @@
+import os
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import metrics
+import products
+from station_batch import StationBatch
+
+DAY = datetime(2022, 1, 3)
+IGS = products.Product('igs', products.IGS_URL, 0)
+COD = products.Product('cod', 'https://example.org/{week}/COD0OPSFIN_{yyyy}{doy}0000_01D_01D_SOL.SNX.gz', 1)
+ESA = products.Product('esa', 'https://example.org/{week}/ESA0OPSFIN_{yyyy}{doy}0000_01D_01D_SOL.SNX.gz', 2)
+
+
+def solution(names: list, x: float, sigma=np.nan) -> StationBatch:
+    count = len(names)
+    return StationBatch(names, np.datetime64(DAY, 's'), np.full((count, 3), x),
+                        sigmas=np.broadcast_to(np.asarray(sigma, dtype=np.float64).reshape(-1, 1), (count, 3)))
+
+
+def merged(batch: StationBatch) -> dict:
+    return {row.name: (row.product, row.x) for row in batch}
+
+
+def test_priority_prefers_the_lowest_priority_having_the_station():
+    batch = products.merge([(ESA, solution(['abmf', 'zimm', 'wtzr'], 3.0)),
+                            (IGS, solution(['zimm'], 1.0)),
+                            (COD, solution(['abmf', 'zimm'], 2.0))])
+    assert merged(batch) == {'zimm': ('igs', 1.0), 'abmf': ('cod', 2.0), 'wtzr': ('esa', 3.0)}
+    # The stations of the preferred product come first
+    assert batch.names.tolist() == ['zimm', 'abmf', 'wtzr']
+
+
+def test_sigma_prefers_the_smallest_standard_deviation():
+    batch = products.merge([(IGS, solution(['abmf', 'zimm', 'wtzr', 'brux'], 1.0, [3e-3, 1e-3, np.nan, 2e-3])),
+                            (COD, solution(['abmf', 'zimm', 'wtzr', 'brux'], 2.0, [1e-3, 2e-3, 5e-3, 2e-3]))],
+                           products.SIGMA)
+    # Unknown standard deviations lose, ties go by priority
+    assert merged(batch) == {'abmf': ('cod', 2.0), 'zimm': ('igs', 1.0), 'wtzr': ('cod', 2.0),
+                             'brux': ('igs', 1.0)}
+
+
+def test_sigma_also_picks_between_the_estimates_of_one_product():
+    batch = products.merge([(IGS, solution(['abmf', 'abmf'], 1.0, [2e-3, 1e-3]))], products.SIGMA)
+    assert merged(batch) == {'abmf': ('igs', 1.0)} and batch.sigmas[0, 0] == 1e-3
+
+
+def test_merge_of_nothing_and_unknown_rules():
+    assert len(products.merge([])) == 0
+    assert len(products.merge([(IGS, StationBatch.empty())], products.SIGMA)) == 0
+    with pytest.raises(ValueError):
+        products.merge([(IGS, solution(['abmf'], 1.0))], 'newest')
+
+
+def worker(name: str, fail: bool = False) -> StationBatch:
+    # Runs in the spawned workers of products.run
+    with metrics.span('parse', product=name):
+        metrics.count('sinex_lines_parsed', 10)
+        if fail:
+            raise ValueError(f"{name} is corrupted")
+    return StationBatch([name[:4]], np.datetime64(DAY, 's'), [(float(os.getpid()), 0.0, 0.0)])
+
+
+@pytest.fixture
+def recorded(tmp_path):
+    metrics.configure(jsonl_path=str(tmp_path / 'metrics.jsonl'))
+    try:
+        yield metrics._recorder
+    finally:
+        metrics.configure()
+
+
+def test_workers_are_kept_between_runs():
+    pids = set()
+    for _ in range(3):
+        results = products.run([IGS, COD, ESA], DAY, lambda product, day: (product.name,), worker, 2)
+        assert [result.batch.names.tolist() for result in results] == [['igs'], ['cod'], ['esa']]
+        pids.update(int(result.batch.xyz[0, 0]) for result in results)
+    assert len(pids) <= 2 and os.getpid() not in pids
+
+
+def test_spans_and_counters_of_the_workers_reach_the_parent(recorded):
+    results = products.run([IGS, COD, ESA], DAY, lambda product, day: (product.name, product is COD), worker, 2)
+    assert [result.ok for result in results] == [True, False, True]
+    assert 'cod is corrupted' in results[1].error
+    assert recorded.counters['sinex_lines_parsed'] == 30
+    assert recorded.spans[('parse', (('product', 'cod'),))][:2] == [1, 1]
+    assert recorded.spans[('parse', (('product', 'igs'),))][:2] == [1, 0]
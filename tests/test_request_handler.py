@@ -0,0 +1,267 @@
+import datetime
+
+import numpy as np
+import pytest
+from mysql.connector import Error
+
+import request_handler
+from benchmarks import synthetic
+from benchmarks.fakes import FakeConnection
+from station_batch import StationBatch
+
+
+class RecordingCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+
+    def execute(self, query, params=()):
+        self.connection.executed.append((query, tuple(params or ())))
+        if self.connection.failing and query.startswith(self.connection.failing):
+            raise Error('Lock wait timeout exceeded')
+        self.rows = self.connection.results.pop(0) if self.connection.results else []
+
+    def executemany(self, query, rows):
+        for params in rows:
+            self.execute(query, params)
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class RecordingConnection:
+    """
+    Connection answering the queries with the next list of results and recording them,
+    the queries starting with failing raise an error
+    """
+
+    def __init__(self, results=(), failing=None):
+        self.results = list(results)
+        self.executed = []
+        self.failing = failing
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self, prepared=False):
+        return RecordingCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+EPOCH = datetime.datetime(2022, 1, 2)
+
+
+def scenario_row(value, scenario_id):
+    # watermark column, scenario_id, then the columns of scenario_tb
+    return (value, scenario_id, scenario_id, 'name', 1, 1, EPOCH)
+
+
+def test_select_scenarios_after_pages_on_the_compound_key():
+    connection = RecordingConnection([[scenario_row(7, '011890'), scenario_row(7, '011891')]])
+    handler = request_handler.RequestHandler(connection)
+    rows = handler.select_scenarios_after('modified', (7, '011889'), 2)
+    query, params = connection.executed[0]
+    assert "WHERE (modified, scenario_id) > (%s, %s)" in query
+    assert "ORDER BY modified, scenario_id" in query
+    assert params == (7, '011889', 2)
+    assert rows == [((7, '011890'), '011890', EPOCH), ((7, '011891'), '011891', EPOCH)]
+
+
+def test_select_scenarios_after_accepts_a_single_value_watermark():
+    connection = RecordingConnection()
+    handler = request_handler.RequestHandler(connection)
+    assert handler.select_scenarios_after('modified', 7, 10) == []
+    query, params = connection.executed[0]
+    assert "WHERE modified > %s" in query
+    assert params == (7, 10)
+    handler.select_scenarios_after('modified', None, 10)
+    assert "WHERE" not in connection.executed[1][0]
+
+
+def test_select_scenario_epochs_in_window_filters_in_the_query():
+    connection = RecordingConnection([[('011890', EPOCH)]])
+    handler = request_handler.RequestHandler(connection)
+    date_to = EPOCH + datetime.timedelta(days=1)
+    assert handler.select_scenario_epochs_in_window('epoch', EPOCH, date_to) == {'011890': EPOCH}
+    query, params = connection.executed[0]
+    assert query.startswith("SELECT scenario_id, epoch FROM odtssw_paf.scenario_tb ")
+    assert "WHERE epoch >= %s AND epoch < %s" in query
+    assert params == (EPOCH, date_to)
+    with pytest.raises(ValueError):
+        handler.select_scenario_epochs_in_window('epoch; DROP TABLE scenario_tb', EPOCH, date_to)
+
+
+def test_select_scenario_epochs_leaves_out_null_epochs():
+    connection = RecordingConnection([[('011890', '011890', 'name', 1, 1, EPOCH),
+                                       ('011891', '011891', 'name', 1, 1, None)]])
+    handler = request_handler.RequestHandler(connection)
+    assert handler.select_scenario_epochs(['011890', '011891']) == {'011890': EPOCH}
+
+
+def station_batch(count: int, shift: float = 0.0) -> StationBatch:
+    positions = synthetic.station_positions(count)
+    xyz = np.array([position[1:] for position in positions]) + shift
+    return StationBatch([position[0].lower() for position in positions], EPOCH, xyz).fill_geodetic()
+
+
+def test_upsert_station_data_writes_chunks_of_batch_size():
+    connection = FakeConnection()
+    handler = request_handler.RequestHandler(connection)
+    batch = station_batch(25)
+    assert handler.upsert_station_data(batch[:5]) == request_handler.UpsertResult(inserted=5)
+    connection.reset_counters()
+    result = handler.upsert_station_data(station_batch(25, shift=1.0), batch_size=10)
+    assert result == request_handler.UpsertResult(inserted=20, updated=5)
+    # One existence SELECT per chunk, the 5 known stations are all in the first chunk
+    assert connection.statements == {'SELECT': 3, 'INSERT': 3, 'UPDATE': 1, 'COMMIT': 1}
+    assert sorted(connection.station_tb) == sorted(batch.names.tolist())
+    assert all(connection.station_tb[name][0] == x + 1.0 for name, x in zip(batch.names, batch.xyz[:, 0]))
+
+
+def test_upsert_changed_station_data_skips_unchanged_stations():
+    connection = FakeConnection()
+    handler = request_handler.RequestHandler(connection)
+    handler.upsert_station_data(station_batch(12))
+    moved = station_batch(12)
+    moved.xyz[:4] += 0.01
+    connection.reset_counters()
+    result = handler.upsert_changed_station_data(moved, batch_size=3)
+    assert result == request_handler.UpsertResult(updated=4, unchanged=8)
+    # The snapshot replaces the existence SELECTs, the 4 moved stations take two UPDATEs of 3 and 1
+    assert connection.statements == {'SELECT': 1, 'UPDATE': 2, 'COMMIT': 1}
+
+
+def test_a_new_epoch_alone_does_not_rewrite_stations():
+    connection = FakeConnection()
+    handler = request_handler.RequestHandler(connection)
+    handler.upsert_station_data(station_batch(6))
+    next_day = station_batch(6)
+    next_day.epochs[:] = np.datetime64(EPOCH + datetime.timedelta(days=1), 's')
+    next_day.xyz[0] += 0.01
+    assert handler.upsert_changed_station_data(next_day) == request_handler.UpsertResult(updated=1, unchanged=5)
+    # With an epoch tolerance every station of the new epoch is written
+    result = handler.upsert_changed_station_data(next_day, epoch_tolerance=datetime.timedelta(hours=1))
+    assert result == request_handler.UpsertResult(updated=5, unchanged=1)
+
+
+def test_a_velocity_change_alone_rewrites_the_station():
+    connection = FakeConnection()
+    handler = request_handler.RequestHandler(connection)
+    handler.upsert_station_data(station_batch(4))
+    faster = station_batch(4)
+    faster.velocities[1] = (0.0, 0.0, 0.002)
+    assert handler.upsert_changed_station_data(faster) == request_handler.UpsertResult(updated=1, unchanged=3)
+    assert connection.station_tb[faster.names[1]][3:6] == (0.0, 0.0, 0.002)
+    # The row-by-row comparison agrees with the vectorized one
+    snapshot = handler.load_station_snapshot(faster.names.tolist())
+    faster.velocities[2] = (0.001, 0.0, 0.0)
+    assert [request_handler.is_station_changed(row, snapshot[row.name], 0.001) for row in faster] == \
+        request_handler.station_changed_mask(faster, snapshot, 0.001).tolist() == [False, False, True, False]
+
+
+def test_null_velocities_are_written():
+    snapshot = {'abmf': request_handler.StationSnapshot(1.0, 2.0, 3.0, EPOCH, '')}
+    batch = StationBatch(['abmf'], EPOCH, [(1.0, 2.0, 3.0)])
+    assert request_handler.station_changed_mask(batch, snapshot, 0.001).tolist() == [True]
+
+
+class FailingStreamConnection(FakeConnection):
+    def cursor(self, prepared: bool = False, buffered: bool = None):
+        cursor = super().cursor(prepared, buffered)
+        if buffered is False:
+            def fetchmany(size):
+                raise Error('Lost connection')
+            cursor.fetchmany = fetchmany
+        return cursor
+
+
+def test_load_station_snapshot_streams_the_rows():
+    connection = FakeConnection()
+    handler = request_handler.RequestHandler(connection)
+    batch = station_batch(5)
+    handler.upsert_station_data(batch)
+    snapshot = handler.load_station_snapshot(batch.names.tolist() + ['none'])
+    assert sorted(snapshot) == sorted(batch.names.tolist())
+    assert snapshot[batch.names[0]].x == batch.xyz[0, 0] and snapshot[batch.names[0]].vx == 0.0
+    assert request_handler.RequestHandler(FailingStreamConnection()).load_station_snapshot(['abmf']) is None
+
+
+def test_sync_scenario_stations_writes_the_difference_in_one_transaction():
+    connection = RecordingConnection([[('abmf',), ('brux',), ('zimm',)]])
+    handler = request_handler.RequestHandler(connection)
+    diff = handler.sync_scenario_stations('011888', {'zimm', 'wtzr', 'onsa', 'abmf'}, batch_size=1)
+    assert diff == request_handler.ScenarioStationsDiff(frozenset({'wtzr', 'onsa'}), frozenset({'brux'}))
+    assert [query.split()[0] for query, _ in connection.executed] == ['SELECT', 'DELETE', 'INSERT', 'INSERT']
+    assert connection.executed[2][1] == ('011888', 'onsa', 1, 1)
+    assert (connection.commits, connection.rollbacks) == (1, 0)
+
+
+def test_sync_scenario_stations_reports_a_rollback():
+    connection = RecordingConnection([[('abmf',), ('brux',)]], failing='INSERT')
+    handler = request_handler.RequestHandler(connection)
+    diff = handler.sync_scenario_stations('011888', {'abmf', 'zimm'})
+    assert diff.rolled_back and not diff.added and not diff.removed
+    assert (connection.commits, connection.rollbacks) == (0, 1)
+    # Unlike a scenario already up to date
+    connection = RecordingConnection([[('abmf',)]])
+    assert request_handler.RequestHandler(connection).sync_scenario_stations('011888', {'abmf'}) == \
+        request_handler.ScenarioStationsDiff()
+
+
+def test_bulk_load_counts_the_inserted_and_updated_stations(tmp_path):
+    connection = FakeConnection()
+    handler = request_handler.RequestHandler(connection)
+    batch = station_batch(25)
+    assert handler.bulk_load_station_data(batch[:5], str(tmp_path)) == request_handler.UpsertResult(inserted=5)
+    connection.reset_counters()
+    moved = station_batch(25, shift=1.0)
+    moved.velocities[0] = (0.01, 0.0, 0.0)
+    assert handler.bulk_load_station_data(moved, str(tmp_path)) == request_handler.UpsertResult(inserted=20, updated=5)
+    # The same statements whatever the number of stations, the temporary file is removed
+    assert connection.statements == {'CREATE': 1, 'DELETE': 1, 'LOAD': 1, 'UPDATE': 1, 'INSERT': 1, 'COMMIT': 1}
+    assert list(tmp_path.iterdir()) == []
+    assert sorted(connection.station_tb) == sorted(batch.names.tolist())
+    assert connection.station_tb[batch.names[0]][:4] == (*(batch.xyz[0] + 1.0), 0.01)
+    assert connection.station_tb[batch.names[0]][6] == EPOCH
+
+
+def test_bulk_load_writes_the_last_row_of_a_station():
+    connection = FakeConnection()
+    handler = request_handler.RequestHandler(connection)
+    twice = StationBatch.concatenate([station_batch(3), station_batch(3, shift=2.0)])
+    assert handler.bulk_load_station_data(twice) == request_handler.UpsertResult(inserted=3)
+    once = station_batch(3)
+    assert {name: row[0] for name, row in connection.station_tb.items()} == \
+        dict(zip(once.names.tolist(), (once.xyz[:, 0] + 2.0).tolist()))
+
+
+def test_upsert_uses_the_bulk_load_from_the_threshold():
+    connection = FakeConnection()
+    handler = request_handler.RequestHandler(connection, bulk_load_threshold=10)
+    assert handler.upsert_station_data(station_batch(9)) == request_handler.UpsertResult(inserted=9)
+    assert 'LOAD' not in connection.statements
+    assert handler.upsert_station_data(station_batch(10, shift=1.0)) == \
+        request_handler.UpsertResult(inserted=1, updated=9)
+    assert connection.statements['LOAD'] == 1
+
+
+class FailingLoadConnection(FakeConnection):
+    def apply(self, query, params):
+        if query.startswith('LOAD DATA'):
+            raise Error('Loading local data is disabled')
+        return super().apply(query, params)
+
+
+def test_a_failed_bulk_load_is_rolled_back(tmp_path):
+    connection = FailingLoadConnection()
+    handler = request_handler.RequestHandler(connection)
+    assert handler.bulk_load_station_data(station_batch(5), str(tmp_path)) == request_handler.UpsertResult()
+    assert connection.statements.get('ROLLBACK') == 1 and 'COMMIT' not in connection.statements
+    assert connection.station_tb == {} and list(tmp_path.iterdir()) == []
@@ -0,0 +1,161 @@
+import pytest
+from mysql.connector import Error
+
+import requestsdb
+
+
+class PreparedCursor:
+    """
+    Stand-in for MySQLCursorPrepared: the statement is prepared again unless the operation is the very
+    object executed last
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.executed = None
+
+    def execute(self, operation, params=None):
+        if operation is not self.executed:
+            self.connection.prepares += 1
+            self.executed = operation
+
+    def executemany(self, operation, rows):
+        for params in rows:
+            self.execute(operation, params)
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        self.connection.closed += 1
+
+
+class Connection:
+    def __init__(self):
+        self.prepares = 0
+        self.closed = 0
+        self.commits = 0
+
+    def cursor(self, prepared=False):
+        return PreparedCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+def dynamic_query(count: int) -> str:
+    # A new string object on every call, as the queries built by RequestHandler
+    return f"SELECT x FROM t WHERE id IN ({', '.join(['%s'] * count)});"
+
+
+def test_read_prepares_dynamic_query_once():
+    connection = Connection()
+    statements = requestsdb.PreparedStatements(connection)
+    queries = [dynamic_query(3) for _ in range(5)]
+    assert len({id(query) for query in queries}) == 5
+    for query in queries:
+        statements.read(query, (1, 2, 3))
+    assert connection.prepares == 1
+
+
+def test_write_many_prepares_dynamic_query_once():
+    connection = Connection()
+    statements = requestsdb.PreparedStatements(connection)
+    for _ in range(5):
+        statements.write_many("".join(["UPDATE t SET x=%s ", "WHERE id=%s;"]), [(1, 2), (3, 4)])
+    assert connection.prepares == 1
+    assert connection.commits == 5
+
+
+def test_distinct_queries_are_prepared_separately_and_evicted():
+    connection = Connection()
+    statements = requestsdb.PreparedStatements(connection, cache_size=2)
+    for count in (1, 2, 3):
+        statements.read(dynamic_query(count))
+    assert connection.prepares == 3
+    assert connection.closed == 1  # the least recently used statement
+    statements.read(dynamic_query(1))
+    assert connection.prepares == 4
+    statements.close()
+    assert connection.closed == 4
+
+
+class StreamingCursor:
+    """
+    Stand-in for an unbuffered cursor: execute_error fails the query, fetch_error fails the n-th fetchmany
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.column_names = ('station_id', 'x')
+        self.position = 0
+
+    def execute(self, operation, params=None):
+        if self.connection.execute_error:
+            raise Error('Table does not exist')
+        self.connection.unread_result = True
+
+    def fetchmany(self, size):
+        self.connection.fetches.append(size)
+        if len(self.connection.fetches) == self.connection.fetch_error:
+            raise Error('Lost connection')
+        rows = self.connection.rows[self.position:self.position + size]
+        self.position += len(rows)
+        if not rows:
+            self.connection.unread_result = False
+        return rows
+
+    def close(self):
+        self.connection.closed += 1
+
+
+class StreamingConnection:
+    def __init__(self, rows=(), execute_error=False, fetch_error=None):
+        self.rows = list(rows)
+        self.execute_error = execute_error
+        self.fetch_error = fetch_error
+        self.fetches = []
+        self.closed = 0
+        self.consumed = 0
+        self.unread_result = False
+
+    def cursor(self, prepared=False, buffered=None):
+        assert buffered is False and not prepared
+        return StreamingCursor(self)
+
+    def consume_results(self):
+        self.consumed += 1
+        self.unread_result = False
+
+
+ROWS = [(f"s{index:03d}", float(index)) for index in range(5)]
+
+
+def test_stream_pages_with_fetchmany():
+    connection = StreamingConnection(ROWS)
+    records = list(requestsdb.PreparedStatements(connection).stream("SELECT station_id, x FROM t;", fetch_size=2))
+    assert [(record.station_id, record.x) for record in records] == ROWS
+    assert connection.fetches == [2, 2, 2, 2]  # 2 + 2 + 1 rows, then the empty batch
+    assert connection.closed == 1 and connection.consumed == 0
+
+
+def test_stream_closes_the_cursor_when_the_consumer_stops_early():
+    connection = StreamingConnection(ROWS)
+    records = requestsdb.PreparedStatements(connection).stream("SELECT station_id, x FROM t;", fetch_size=2)
+    assert next(records).station_id == 's000'
+    records.close()
+    # The rest of the result set is discarded so that the connection can run other queries
+    assert connection.consumed == 1 and connection.closed == 1
+    assert connection.fetches == [2]
+
+
+@pytest.mark.parametrize('options', [dict(execute_error=True), dict(fetch_error=2)])
+def test_stream_raises_errors_and_closes_the_cursor(options):
+    connection = StreamingConnection(ROWS, **options)
+    records = requestsdb.PreparedStatements(connection).stream("SELECT station_id, x FROM t;", fetch_size=2)
+    with pytest.raises(Error):
+        list(records)
+    assert connection.closed == 1
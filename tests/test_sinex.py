@@ -0,0 +1,113 @@
+import math
+from datetime import datetime
+
+import pytest
+
+import sinex
+from benchmarks import synthetic
+
+EPOCH = '22:001:43200'
+
+
+def estimates(*lines: str, header: str = '') -> str:
+    return header + '+SOLUTION/ESTIMATE\n' \
+                    '*INDEX TYPE__ CODE PT SOLN _REF_EPOCH__ UNIT S __ESTIMATED VALUE____ _STD_DEV___\n' + \
+        ''.join(lines) + '-SOLUTION/ESTIMATE\n%ENDSNX\n'
+
+
+def station(code: str, x: float, epoch: str = EPOCH, velocity: float = None, std: float = 1e-3) -> list:
+    lines = [synthetic.estimate_line(1, kind, code, epoch, 'm', x + offset, std)
+             for offset, kind in enumerate(('STAX', 'STAY', 'STAZ'))]
+    if velocity is not None:
+        lines += [synthetic.estimate_line(1, kind, code, epoch, 'm/y', velocity, std / 10)
+                  for kind in ('VELX', 'VELY', 'VELZ')]
+    return lines
+
+
+def parse(text: str, stations=None) -> list:
+    return list(sinex.read_estimates(text.splitlines(keepends=True), stations))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 80, 81, 4096])
+def test_lines_split_across_read_chunks(tmp_path, monkeypatch, chunk_size):
+    file = synthetic.write_sinex(str(tmp_path / 'product.snx'), 50, matrix_rows=100, velocities=True)
+    monkeypatch.setattr(sinex, 'READ_CHUNK_SIZE', chunk_size)
+    result = list(sinex.read_file(file))
+    positions = synthetic.station_positions(50)
+    assert [estimate.name for estimate in result] == [name.lower() for name, _, _, _ in positions]
+    for estimate, (_, x, y, z) in zip(result, positions):
+        assert (estimate.x, estimate.y, estimate.z) == pytest.approx((x, y, z), rel=1e-13)
+        assert all(0 < abs(v) < 0.05 for v in (estimate.vx, estimate.vy, estimate.vz))
+        assert estimate.epoch == datetime(2022, 1, 1, 12)
+
+
+def test_str_and_bytes_chunks_give_the_same_estimates():
+    text = synthetic.generate_sinex(20, velocities=True)
+    chunks = [text[index:index + 33] for index in range(0, len(text), 33)]
+    assert list(sinex.read_estimates(chunks)) == \
+        list(sinex.read_estimates(chunk.encode('ascii') for chunk in chunks)) == parse(text)
+
+
+def test_velocities_sigmas_and_reference_epoch():
+    abmf, zimm = parse(estimates(*station('ABMF', 100.0, velocity=0.02, std=2e-3), *station('ZIMM', 200.0)))
+    assert abmf == sinex.StationEstimate('abmf', 100.0, 101.0, 102.0, 0.02, 0.02, 0.02, 2e-3, 2e-3, 2e-3,
+                                         datetime(2022, 1, 1, 12))
+    # Without VELX/VELY/VELZ the station does not move
+    assert (zimm.vx, zimm.vy, zimm.vz) == (0.0, 0.0, 0.0)
+    assert (zimm.x, zimm.sx) == (200.0, 1e-3)
+
+
+def test_blank_standard_deviation_and_undefined_epoch():
+    lines = [line[:69] + ' ' * 11 + '\n' for line in station('ABMF', 100.0, epoch='00:000:00000')]
+    estimate, = parse(estimates(*lines))
+    assert math.isnan(estimate.sx) and math.isnan(estimate.sy) and math.isnan(estimate.sz)
+    assert estimate.epoch is None
+
+
+@pytest.mark.parametrize('text, expected', [('22:001:43200', datetime(2022, 1, 1, 12)),
+                                            ('50:365:00000', datetime(2050, 12, 31)),
+                                            ('95:032:00060', datetime(1995, 2, 1, 0, 1)),
+                                            ('2022:002:00000', datetime(2022, 1, 2)),
+                                            ('00:000:00000', None)])
+def test_parse_epoch(text, expected):
+    assert sinex.parse_epoch(text) == expected
+
+
+def test_station_filter_is_case_insensitive():
+    text = estimates(*station('ABMF', 100.0), *station('ZIMM', 200.0), *station('WTZR', 300.0))
+    assert [estimate.name for estimate in parse(text, frozenset({'zimm', 'WTZR'}))] == ['zimm', 'wtzr']
+    assert parse(text, frozenset()) == []
+
+
+def test_lines_outside_the_estimates_and_other_parameters_are_ignored():
+    apriori = '+SOLUTION/APRIORI\n' + ''.join(station('ABMF', 1.0)) + '-SOLUTION/APRIORI\n'
+    lines = ['* comment\n', *station('ABMF', 100.0)[:2],
+             synthetic.estimate_line(1, 'AXIS', 'ABMF', EPOCH, 'm', 7.0, 1e-3),
+             station('ABMF', 100.0)[2], synthetic.estimate_line(1, 'XGC', '----', EPOCH, 'm', 7.0, 1e-3)]
+    text = estimates(*lines, header=apriori) + ''.join(station('WTZR', 1.0))
+    estimate, = parse(text)
+    assert (estimate.name, estimate.x, estimate.y, estimate.z) == ('abmf', 100.0, 101.0, 102.0)
+
+
+def test_a_station_estimated_again_is_yielded_again():
+    text = estimates(*station('ABMF', 100.0), *station('ZIMM', 200.0), *station('ABMF', 300.0))
+    assert [(estimate.name, estimate.x) for estimate in parse(text)] == \
+        [('abmf', 100.0), ('zimm', 200.0), ('abmf', 300.0)]
+
+
+def test_missing_estimates():
+    assert parse('') == []
+    assert parse('%=SNX 2.02\n+SITE/ID\n-SITE/ID\n%ENDSNX\n') == []
+    assert parse(estimates()) == []
+    # A truncated file still yields the stations read so far
+    truncated = estimates(*station('ABMF', 100.0)).replace('-SOLUTION/ESTIMATE\n%ENDSNX\n', '')
+    assert [estimate.name for estimate in parse(truncated)] == ['abmf']
+
+
+@pytest.mark.parametrize('line', [synthetic.estimate_line(1, 'STAX', 'ABMF', EPOCH, 'm', 1.0, 1e-3)[:40] + '\n',
+                                  synthetic.estimate_line(1, 'STAX', 'ABMF', EPOCH, 'm', 1.0, 1e-3)
+                                  .replace('1.00000000000000e+00', '1.0000000000000Xe+00')],
+                         ids=['truncated', 'not_a_number'])
+def test_malformed_estimates_are_errors(line):
+    with pytest.raises(ValueError):
+        parse(estimates(line))
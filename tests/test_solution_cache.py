@@ -0,0 +1,80 @@
+import os
+import pickle
+import threading
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import solution_cache
+from benchmarks import synthetic
+from station_batch import StationBatch
+
+DAY = datetime(2022, 1, 1)
+
+
+def solution(names: list, x: float) -> StationBatch:
+    count = len(names)
+    return StationBatch(np.array(names, dtype='U9'), np.full(count, np.datetime64(DAY, 's')),
+                        np.full((count, 3), x), np.zeros((count, 3)))
+
+
+def write_product(path, contents: bytes) -> str:
+    path.write_bytes(contents)
+    return str(path)
+
+
+def test_daily_products_of_a_week_have_their_own_files(tmp_path):
+    cache = solution_cache.SolutionCache(str(tmp_path / 'solutions'))
+    first = write_product(tmp_path / 'day1.snx', b'day 1')
+    second = write_product(tmp_path / 'day2.snx', b'day 2')
+    parsed = []
+
+    def parse(x):
+        return lambda path: parsed.append(path) or solution(['abmf', 'zimm'], x)
+
+    for _ in range(2):
+        assert cache.get('COD0_2022001.SNX.gz', first, parse(1.0), product='cod').xyz[0, 0] == 1.0
+        assert cache.get('COD0_2022002.SNX.gz', second, parse(2.0), product='cod').xyz[0, 0] == 2.0
+    # Parsed once each, the second day does not replace the file of the first one
+    assert parsed == [first, second]
+    assert sorted(os.listdir(cache.directory)) == ['cod_COD0_2022001.SNX.gz.sol', 'cod_COD0_2022002.SNX.gz.sol']
+
+
+def test_concurrent_writers_leave_a_complete_file(tmp_path):
+    cache = solution_cache.SolutionCache(str(tmp_path / 'solutions'))
+    source = write_product(tmp_path / 'product.snx', b'product')
+    names = [f"s{index:03d}" for index in range(500)]
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        cache.get('igs22P2190.snx.Z', source, lambda path: solution(names, 3.0), ['s042'])))
+        for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [result.names.tolist() for result in results] == [['s042']] * 8
+    assert os.listdir(cache.directory) == ['igs_igs22P2190.snx.Z.sol']
+
+
+def test_process_product_keys_the_cache_on_the_product_file(tmp_path):
+    stations_handler = pytest.importorskip('stations_handler')
+    directory = str(tmp_path / 'solutions')
+    days = [datetime(2022, 1, 3), datetime(2022, 1, 4)]  # two days of GPS week 2190
+    sources = [f"COD0OPSFIN_{day:%Y%j}0000_01D_01D_SOL.SNX" for day in days]
+    files = [synthetic.write_sinex(str(tmp_path / source), 20, seed=seed) for seed, source in enumerate(sources)]
+    for _ in range(2):
+        results = [stations_handler.process_product(file, None, day, False, directory, 'cod', source)
+                   for file, day, source in zip(files, days, sources)]
+        assert not np.array_equal(results[0].xyz, results[1].xyz)
+    assert sorted(os.listdir(directory)) == [f"cod_{source}.sol" for source in sources]
+
+
+def test_shared_instance_survives_pickling_and_sees_replaced_files(tmp_path):
+    cache = solution_cache.shared(str(tmp_path / 'solutions'))
+    assert pickle.loads(pickle.dumps(cache)) is cache
+    cache.store('igs22P21900.snx.Z', b'1' * 32, solution(['abmf'], 1.0))
+    assert cache.load('igs22P21900.snx.Z', b'1' * 32).xyz[0, 0] == 1.0
+    cache.store('igs22P21900.snx.Z', b'2' * 32, solution(['abmf'], 2.0))
+    assert cache.load('igs22P21900.snx.Z', b'1' * 32) is None
+    assert cache.load('igs22P21900.snx.Z', b'2' * 32).xyz[0, 0] == 2.0
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+import spatial_index
+from benchmarks import synthetic
+from station_batch import StationBatch
+
+QUERIES = [(0.0, 0.0), (48.2, 16.4), (-33.9, 151.2), (89.5, -120.0), (-90.0, 0.0), (10.0, 179.9), (10.0, -180.0)]
+
+
+def stations(count: int, seed: int = 0) -> StationBatch:
+    positions = synthetic.station_positions(count, seed)
+    return StationBatch([name.lower() for name, _, _, _ in positions], np.datetime64('2022-01-01', 's'),
+                        [position[1:] for position in positions]).fill_geodetic()
+
+
+def brute_force_km(batch: StationBatch, lat: float, lon: float) -> np.ndarray:
+    # Haversine, independent of the chord computations of the index
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2, lon2 = np.radians(batch.blh[:, 0]), np.radians(batch.blh[:, 1])
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2.0 * spatial_index.EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+@pytest.fixture(scope='module', params=[4, spatial_index.LEAF_SIZE], ids=['deep', 'default'])
+def indexed(request):
+    batch = stations(3000)
+    return batch, spatial_index.StationIndex(batch, leaf_size=request.param)
+
+
+@pytest.mark.parametrize('radius_km', [0.0, 50.0, 500.0, 2500.0, 20100.0])
+def test_within_returns_exactly_the_stations_in_the_radius(indexed, radius_km):
+    batch, index = indexed
+    for lat, lon in QUERIES:
+        distances = brute_force_km(batch, lat, lon)
+        # Stations a hair away from the circle could go either way with rounding
+        expected = set(np.flatnonzero(distances <= radius_km).tolist())
+        uncertain = set(np.flatnonzero(np.abs(distances - radius_km) < 1e-6).tolist())
+        found = index.within(lat, lon, radius_km)
+        assert np.all(np.diff(found) > 0)
+        assert set(found.tolist()) ^ expected <= uncertain
+
+
+def test_the_radius_includes_its_edge():
+    # Stations on the equator every 0.5 degree of longitude from the query point
+    count = 20
+    blh = np.column_stack((np.zeros(count), np.arange(count) * 0.5, np.zeros(count)))
+    batch = StationBatch([f"s{index:03d}" for index in range(count)], np.datetime64('2022-01-01', 's'),
+                         np.zeros((count, 3)), blh)
+    index = spatial_index.StationIndex(batch, leaf_size=2)
+    step_km = spatial_index.EARTH_RADIUS_KM * np.radians(0.5)
+    assert index.within(0.0, 0.0, 3 * step_km * (1 + 1e-9)).tolist() == [0, 1, 2, 3]
+    assert index.within(0.0, 0.0, 3 * step_km * (1 - 1e-9)).tolist() == [0, 1, 2]
+    np.testing.assert_allclose(index.distances_km(0.0, 0.0, [0, 3]), [0.0, 3 * step_km], rtol=1e-12, atol=1e-9)
+
+
+@pytest.mark.parametrize('count', [1, 7, 200, 3000])
+def test_nearest_matches_the_brute_force_order(indexed, count):
+    batch, index = indexed
+    for lat, lon in QUERIES:
+        distances = brute_force_km(batch, lat, lon)
+        found = index.nearest(lat, lon, count)
+        assert len(found) == count and len(set(found.tolist())) == count
+        np.testing.assert_allclose(distances[found], np.sort(distances)[:count], rtol=0, atol=1e-6)
+
+
+@pytest.mark.parametrize('box', [(-10.0, 10.0, -10.0, 10.0), (30.0, 60.0, 170.0, -170.0), (-90.0, 90.0, -180.0, 180.0),
+                                 (80.0, 90.0, 0.0, 360.0), (20.0, 10.0, 0.0, 10.0)],
+                         ids=['equator', 'antimeridian', 'world', 'polar_cap', 'inverted'])
+def test_in_box_matches_the_brute_force(indexed, box):
+    batch, index = indexed
+    lat_min, lat_max, lon_min, lon_max = box
+    lat, lon = batch.blh[:, 0], batch.blh[:, 1]
+    in_lat = (lat >= lat_min) & (lat <= lat_max)
+    if lon_max - lon_min >= 360.0:
+        in_lon = np.ones(len(batch), dtype=bool)
+    elif lon_min <= lon_max:
+        in_lon = (lon >= lon_min) & (lon <= lon_max)
+    else:
+        in_lon = (lon >= lon_min) | (lon <= lon_max)
+    assert index.in_box(*box).tolist() == np.flatnonzero(in_lat & in_lon).tolist()
+
+
+def test_an_empty_tree():
+    index = spatial_index.StationIndex(StationBatch.empty())
+    assert len(index) == 0
+    assert index.within(0.0, 0.0, 20000.0).tolist() == []
+    assert index.nearest(0.0, 0.0, 5).tolist() == []
+    assert index.in_box(-90.0, 90.0, -180.0, 180.0).tolist() == []
+    assert len(spatial_index.select_region(StationBatch.empty(), spatial_index.Circle(0.0, 0.0, 100.0))) == 0
+
+
+def test_select_region_keeps_the_order_of_the_batch():
+    batch = stations(500, seed=3)
+    assert spatial_index.select_region(batch, None) is batch
+    for region in (spatial_index.Circle(48.2, 16.4, 3000.0), spatial_index.Box(-40.0, 0.0, 100.0, 160.0),
+                   spatial_index.Nearest(0.0, 0.0, 25)):
+        selected = spatial_index.select_region(batch, region)
+        positions = {name: position for position, name in enumerate(batch.names.tolist())}
+        assert [positions[name] for name in selected.names.tolist()] == \
+            sorted(region.select(spatial_index.StationIndex(batch)).tolist())
+    assert len(spatial_index.select_region(batch, spatial_index.Nearest(0.0, 0.0, 25))) == 25
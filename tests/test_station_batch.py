@@ -0,0 +1,119 @@
+import pickle
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import geodesy
+import sinex
+from benchmarks import synthetic
+from station_batch import SECONDS_PER_YEAR, StationBatch
+
+REFERENCE = datetime(2022, 1, 1)
+
+
+def batch(count: int = 3, velocities=None, reference_epochs=REFERENCE) -> StationBatch:
+    positions = synthetic.station_positions(count)
+    return StationBatch([name.lower() for name, _, _, _ in positions], np.datetime64(REFERENCE, 's'),
+                        [position[1:] for position in positions], sigmas=np.full((count, 3), 1e-3),
+                        velocities=velocities, reference_epochs=reference_epochs, products='igs').fill_geodetic()
+
+
+def test_propagate_moves_the_stations_with_their_velocities():
+    velocities = [(0.01, -0.02, 0.03), (0.0, 0.0, 0.0), (-0.05, 0.0, 0.01)]
+    original = batch(velocities=velocities)
+    target = np.datetime64(REFERENCE, 's') + np.timedelta64(int(2 * SECONDS_PER_YEAR), 's')
+    moved = original.propagate(target.item())
+    np.testing.assert_allclose(moved.xyz, original.xyz + 2.0 * np.array(velocities), rtol=0, atol=1e-9)
+    np.testing.assert_allclose(moved.blh, geodesy.ecef2blh(moved.xyz, geodesy.BOWRING), rtol=0, atol=1e-9)
+    # A station without velocity keeps its geodetic coordinates as they were
+    assert np.array_equal(moved.blh[1], original.blh[1])
+    assert (moved.epochs == target).all() and (moved.reference_epochs == target).all()
+    assert np.array_equal(moved.sigmas, original.sigmas) and moved.products.tolist() == ['igs'] * 3
+    # The batch itself is not changed
+    assert (original.epochs == np.datetime64(REFERENCE, 's')).all()
+
+
+def test_propagate_backwards_and_per_station_epochs():
+    original = batch(velocities=[(0.01, 0.0, 0.0)] * 3)
+    targets = np.array([REFERENCE, datetime(2021, 1, 1), datetime(2023, 1, 1)], dtype='datetime64[s]')
+    moved = original.propagate(targets)
+    years = (targets - np.datetime64(REFERENCE, 's')).astype(np.float64) / SECONDS_PER_YEAR
+    np.testing.assert_allclose(moved.xyz[:, 0] - original.xyz[:, 0], 0.01 * years, rtol=0, atol=1e-9)
+    assert moved.xyz[0, 0] == original.xyz[0, 0] and (moved.epochs == targets).all()
+
+
+def test_stations_without_a_reference_epoch_are_not_moved():
+    original = batch(velocities=[(0.01, 0.02, 0.03)] * 3,
+                     reference_epochs=np.array([REFERENCE, 'NaT', REFERENCE], dtype='datetime64[s]'))
+    moved = original.propagate(datetime(2023, 1, 1))
+    assert np.array_equal(moved.xyz[1], original.xyz[1]) and not np.array_equal(moved.xyz[0], original.xyz[0])
+
+
+@pytest.mark.parametrize('count', [0, 3])
+def test_propagate_without_velocities_keeps_the_coordinates(count):
+    original = batch(count)
+    moved = original.propagate(datetime(2030, 1, 1))
+    assert np.array_equal(moved.xyz, original.xyz) and np.array_equal(moved.blh, original.blh)
+    assert len(moved) == count
+
+
+def test_select_keeps_the_order_of_the_batch():
+    original = batch(5)
+    names = original.names.tolist()
+    selected = original.select({names[3], names[0], 'none'})
+    assert selected.names.tolist() == [names[0], names[3]]
+    assert np.array_equal(selected.xyz, original.xyz[[0, 3]]) and selected.products.tolist() == ['igs'] * 2
+    assert len(original.select([])) == 0 and len(StationBatch.empty().select(names)) == 0
+
+
+@pytest.mark.parametrize('method', [None, geodesy.BOWRING, geodesy.ITERATIVE])
+def test_fill_geodetic_converts_every_station_in_place(method):
+    original = StationBatch(['abmf', 'zimm'], np.datetime64(REFERENCE, 's'), [(geodesy.A, 0.0, 0.0),
+                                                                            (0.0, 0.0, geodesy.B + 10.0)])
+    assert original.fill_geodetic(method) is original
+    np.testing.assert_allclose(original.blh, [(0.0, 0.0, 0.0), (90.0, 0.0, 10.0)], rtol=0, atol=1e-6)
+    assert StationBatch.empty().fill_geodetic(method).blh.shape == (0, 3)
+
+
+def test_slices_share_the_arrays_and_masks_copy_them():
+    original = batch(4)
+    view = original[1:3]
+    view.xyz[0, 0] = 1.0
+    assert original.xyz[1, 0] == 1.0
+    copy = original[original.names != original.names[0]]
+    copy.xyz[0, 0] = 2.0
+    assert original.xyz[1, 0] == 1.0 and len(copy) == 3
+    row = original[-1]
+    assert (row.name, row.x, row.latitude, row.sx, row.product) == \
+        (original.names[3], original.xyz[3, 0], original.blh[3, 0], 1e-3, 'igs')
+
+
+def test_from_estimates_keeps_the_last_estimate_of_a_station():
+    estimates = [sinex.StationEstimate('abmf', 1.0, 2.0, 3.0, 0.01, 0.0, 0.0, 1e-3, 2e-3, 3e-3, REFERENCE),
+                 sinex.StationEstimate('zimm', 4.0, 5.0, 6.0),
+                 sinex.StationEstimate('abmf', 7.0, 8.0, 9.0, epoch=datetime(2021, 1, 1))]
+    result = StationBatch.from_estimates(estimates, datetime(2022, 1, 3))
+    assert result.names.tolist() == ['abmf', 'zimm']
+    assert result.xyz.tolist() == [[7.0, 8.0, 9.0], [4.0, 5.0, 6.0]]
+    assert result.velocities[0].tolist() == [0.0, 0.0, 0.0] and np.isnan(result.sigmas).all()
+    assert result.reference_epochs[0] == np.datetime64('2021-01-01') and np.isnat(result.reference_epochs[1])
+    assert (result.epochs == np.datetime64('2022-01-03')).all()
+    assert len(StationBatch.from_estimates([], REFERENCE)) == 0
+
+
+def test_concatenate_and_pickle():
+    first, second = batch(2), batch(3, velocities=[(0.01, 0.0, 0.0)] * 3)
+    joined = StationBatch.concatenate([first, second])
+    assert joined.names.tolist() == first.names.tolist() + second.names.tolist()
+    assert joined.velocities[:2].tolist() == [[0.0] * 3] * 2
+    restored = pickle.loads(pickle.dumps(joined))
+    assert all(np.array_equal(getattr(restored, column), getattr(joined, column)) for column in StationBatch.__slots__)
+    assert len(StationBatch.concatenate([])) == 0
+
+
+def test_columns_must_have_one_row_per_station():
+    with pytest.raises(ValueError):
+        StationBatch(['abmf', 'zimm'], np.array([REFERENCE], dtype='datetime64[s]'), np.zeros((2, 3)))
+    with pytest.raises(ValueError):
+        StationBatch(['abmf'], np.datetime64(REFERENCE, 's'), np.zeros((1, 3)), products=['igs', 'cod'])
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import products
+import request_handler
+import stations_handler
+from station_batch import StationBatch
+
+WEEKLY = products.Product('weekly', 'https://example.org/{week}/igs{yy}P{week}.snx.Z')
+DAILY = products.Product('cod', 'https://example.org/{week}/COD0OPSFIN_{yyyy}{doy}0000_01D_01D_SOL.SNX.gz', 1)
+
+
+class FakeHandler:
+    def __init__(self, scenario_epochs: dict):
+        self.scenario_epochs = scenario_epochs
+
+    def select_scenario_epochs(self, scenario_ids: list) -> dict:
+        return {scenario_id: self.scenario_epochs[scenario_id] for scenario_id in scenario_ids}
+
+
+@pytest.fixture
+def scenarios(monkeypatch):
+    """
+    Runs run_scenarios for the given products and scenario epochs, returns the days processed and updated
+    """
+    processed = []
+    updated = []
+
+    def run(product_list: list, scenario_epochs: dict):
+        monkeypatch.setattr(stations_handler, 'product_list', product_list, raising=False)
+        monkeypatch.setattr(stations_handler, 'handler', FakeHandler(scenario_epochs), raising=False)
+        monkeypatch.setattr(stations_handler, 'db_name', 'test', raising=False)
+        monkeypatch.setattr(stations_handler, 'process_products',
+                            lambda day: processed.append(day) or StationBatch.empty())
+        monkeypatch.setattr(stations_handler, 'update_scenario_group',
+                            lambda day, group, solution=None: updated.append((day, group)))
+        result = stations_handler.run_scenarios(sorted(scenario_epochs))
+        return result, processed, updated
+
+    return run
+
+
+def week_epochs(count: int) -> dict:
+    # Calculation epochs of the days of GPS week 2190 (from Sunday 2022-01-02), one scenario each
+    return {str(index): datetime(2022, 1, 3) + timedelta(days=index) for index in range(count)}
+
+
+def test_weekly_product_is_processed_once_per_week(scenarios):
+    result, processed, updated = scenarios([WEEKLY], week_epochs(3))
+    assert result
+    assert processed == [datetime(2022, 1, 2)]
+    assert len(updated) == 3
+
+
+@pytest.mark.parametrize('product_list', [[products.IGS], [WEEKLY, DAILY]])
+def test_daily_products_are_processed_every_day(scenarios, product_list):
+    result, processed, updated = scenarios(product_list, week_epochs(3))
+    assert result
+    assert processed == [datetime(2022, 1, 2) + timedelta(days=index) for index in range(3)]
+    assert len(updated) == 3
+
+
+class RollingBackHandler:
+    def upsert_changed_station_data(self, data, snapshot, position_tolerance, epoch_tolerance):
+        return request_handler.UpsertResult(unchanged=len(data))
+
+    def sync_scenario_stations(self, scenario_id, stations):
+        return request_handler.ScenarioStationsDiff(rolled_back=True)
+
+
+def test_a_rolled_back_scenario_fails_its_group(monkeypatch):
+    monkeypatch.setattr(stations_handler, 'get_list_stations', lambda day: ['abmf'])
+    for name, value in (('position_tolerance', 0.001), ('epoch_tolerance', None), ('region', None)):
+        monkeypatch.setattr(stations_handler, name, value, raising=False)
+    solution = StationBatch(['abmf'], datetime(2022, 1, 2), [(4.0e6, 1.0e6, 4.8e6)]).fill_geodetic()
+    # The daemon retries a failed group instead of moving its watermark over the scenario
+    with pytest.raises(RuntimeError, match='011888'):
+        stations_handler.update_scenario_group(datetime(2022, 1, 3), ['011888'], RollingBackHandler(), solution)